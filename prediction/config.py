@@ -24,6 +24,47 @@ class Config(object):
     SMALL_DICOM_PATHS_WILDCARD = join(FULL_DICOM_PATHS, *LIDC_WILDCARD)
     DATA_DIR = abspath(join(CURRENT_DIR, 'data'))
     EXTRACTED_IMAGE_DIR = abspath(join(CURRENT_DIR, 'extracted'))
+    # Number of threads used to read the files of a DICOM series concurrently
+    DICOM_READ_WORKERS = int(os.getenv('DICOM_READ_WORKERS', 8))
+    # On-disk cache of decoded CT volumes, see src.preprocess.ct_cache
+    CT_CACHE_ENABLED = os.getenv('CT_CACHE_ENABLED', '').lower() in {'1', 'true'}
+    CT_CACHE_DIR = join(DATA_DIR, 'ct_cache')
+    CT_CACHE_MAX_BYTES = int(os.getenv('CT_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+    # Memory budget of the in-process cache of pre-processed CT volumes
+    PREPROCESSED_CACHE_MAX_BYTES = int(os.getenv('PREPROCESSED_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+    # Number of slices processed at once by the slab-wise pre-processing steps
+    PREPROCESS_SLAB_DEPTH = int(os.getenv('PREPROCESS_SLAB_DEPTH', 16))
+    # Number of threads used to re-sample CT volumes, see src.preprocess.resample
+    PREPROCESS_WORKERS = int(os.getenv('PREPROCESS_WORKERS', os.cpu_count() or 1))
+    # Ceiling of the working memory of PreprocessCT.stream in bytes, 256 MiB by default
+    PREPROCESS_STREAM_MAX_BYTES = int(os.getenv('PREPROCESS_STREAM_MAX_BYTES', 256 * 1024 ** 2))
+    # Number of processes which binarize the slices in src.preprocess.extract_lungs, a few
+    # since they are started per call
+    EXTRACT_LUNGS_WORKERS = int(os.getenv('EXTRACT_LUNGS_WORKERS', min(4, os.cpu_count() or 1)))
+    # Number of processes which propagate the separation of the lungs forward and backward in
+    # src.preprocess.improved_lung_segmentation.separate_lungs3d, a second one only on several CPUs
+    SEPARATE_LUNGS_WORKERS = int(os.getenv('SEPARATE_LUNGS_WORKERS', min(2, os.cpu_count() or 1)))
+    # Number of processes which segment the slices in src.preprocess.lung_segmentation.save_lung_segments
+    LUNG_SEGMENTS_WORKERS = int(os.getenv('LUNG_SEGMENTS_WORKERS', os.cpu_count() or 1))
+    # Whether save_lung_segments also writes every slice and mask as PNG images, for debugging
+    LUNG_SEGMENTS_PNG = os.getenv('LUNG_SEGMENTS_PNG', '').lower() in {'1', 'true'}
+    # On-disk cache of the lung masks shared between the algorithms, see src.preprocess.lung_mask
+    LUNG_MASK_CACHE_ENABLED = os.getenv('LUNG_MASK_CACHE_ENABLED', '').lower() in {'1', 'true'}
+    LUNG_MASK_CACHE_DIR = join(DATA_DIR, 'lung_mask_cache')
+    LUNG_MASK_CACHE_MAX_BYTES = int(os.getenv('LUNG_MASK_CACHE_MAX_BYTES', 1024 ** 3))
+    # Whether the identification fills everything but the lungs with the padding value, as the
+    # pre-processing of the DSB2017 detector did, see src.algorithms.identify.src.gtr123_model.predict.
+    # Off by default, which keeps the detections made on the whole scan as before
+    IDENTIFY_LUNG_MASK = os.getenv('IDENTIFY_LUNG_MASK', '').lower() in {'1', 'true'}
+    # Factor by which the slices are downsampled to extract that mask coarse-to-fine, 1 for full resolution.
+    # Factors 2 to 4 are supported, see src.preprocess.extract_lungs.extract_lungs_coarse
+    IDENTIFY_LUNG_MASK_COARSE_FACTOR = int(os.getenv('IDENTIFY_LUNG_MASK_COARSE_FACTOR', 2))
+    # SQLite index of the CT series in the image directories, see src.preprocess.series_index
+    SERIES_INDEX_ENABLED = os.getenv('SERIES_INDEX_ENABLED', '').lower() in {'1', 'true'}
+    SERIES_INDEX_PATH = join(DATA_DIR, 'series_index.sqlite3')
+    # Chunked store of decoded CT volumes, see src.preprocess.volume_store and src.preprocess.ingest
+    VOLUME_STORE_DIR = join(DATA_DIR, 'volume_store')
+    VOLUME_STORE_CHUNK_DEPTH = int(os.getenv('VOLUME_STORE_CHUNK_DEPTH', 16))
 
 
 class Production(Config):
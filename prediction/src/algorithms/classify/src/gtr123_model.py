@@ -7,8 +7,7 @@ from torch.autograd import Variable
 
 from config import Config
 from src.preprocess.crop_patches import patches_from_ct
-from src.preprocess.load_ct import load_ct
-from src.preprocess.preprocess_ct import PreprocessCT
+from src.preprocess.preprocess_ct import PreprocessCT, preprocess_series
 
 
 """
@@ -257,8 +256,9 @@ def predict(ct_path, nodule_list, model_path=None):
     preprocess = PreprocessCT(clip_lower=-1200., clip_upper=600., spacing=True, order=1,
                               min_max_normalize=True, scale=255, dtype='uint8')
 
-    # convert the image to voxels(apply the real spacing between pixels)
-    ct_array, meta = preprocess(*load_ct(ct_path))
+    # convert the image to voxels(apply the real spacing between pixels),
+    # shared with the identification algorithm which pre-processes the same way
+    ct_array, meta = preprocess_series(ct_path, preprocess)
 
     patches = patches_from_ct(ct_array, meta, config['crop_size'], nodule_list,
                               stride=config['stride'], pad_value=config['filling_value'])
@@ -14,7 +14,7 @@ from keras.metrics import binary_accuracy, binary_crossentropy, mean_absolute_er
 from keras.models import Model
 from keras.optimizers import SGD
 
-from ...preprocess.lung_segmentation import rescale_patient_images
+from ...preprocess.lung_segmentation import load_lung_segments, rescale_patient_images
 
 try:
     from ....config import Config
@@ -52,6 +52,28 @@ def load_patient_images(patient_id, base_dir=EXTRACTED_IMAGE_DIR, wildcard="*.*"
     return res
 
 
+def load_patient_volume(patient_id, kind, base_dir=EXTRACTED_IMAGE_DIR):
+    """
+    Load the images or the masks of a patient written by `save_lung_segments`,
+    memory-mapped from their volume file, or stacked from the PNG images of
+    the slices if there is none.
+
+    Args:
+        patient_id: SeriesInstanceUID of the patient.
+        kind: 'images' or 'masks'.
+        base_dir: the directory of the patients.
+
+    Returns:
+        np.ndarray the uint8 volume in (z, y, x) order.
+    """
+    volume = load_lung_segments(patient_id, kind, base_dir)
+    if volume is not None:
+        return volume
+
+    wildcard = {'images': '*_i.png', 'masks': '*_m.png'}[kind]
+    return load_patient_images(patient_id, base_dir=base_dir, wildcard=wildcard, exclude_wildcards=[])
+
+
 def prepare_image_for_net3D(img):
     img = img.astype(np.float32)
     img -= MEAN_PIXEL_VALUE
@@ -61,7 +83,7 @@ def prepare_image_for_net3D(img):
 
 
 def filter_patient_nodules_predictions(df_nodule_predictions: pandas.DataFrame, patient_id, view_size):
-    patient_mask = load_patient_images(patient_id, wildcard="*_m.png")
+    patient_mask = load_patient_volume(patient_id, 'masks')
     delete_indices = []
 
     for index, row in df_nodule_predictions.iterrows():
@@ -173,11 +195,11 @@ def prepare_data(patient_id, magnification=1):
         np.ndarray a mask with a shape of the 3D image array.
         np.ndarray a placeholder for a predict values.
     """
-    patient_img = load_patient_images(patient_id, wildcard="*_i.png", exclude_wildcards=[])
+    patient_img = load_patient_volume(patient_id, 'images')
     if magnification != 1:
         patient_img = rescale_patient_images(patient_img, (1, 1, 1), magnification)
 
-    patient_mask = load_patient_images(patient_id, wildcard="*_m.png", exclude_wildcards=[])
+    patient_mask = load_patient_volume(patient_id, 'masks')
     if magnification != 1:
         patient_mask = rescale_patient_images(patient_mask, (1, 1, 1), magnification, is_mask_image=True)
 
@@ -1,4 +1,7 @@
+import logging
 import os
+import time
+
 import numpy as np
 import torch
 
@@ -7,8 +10,7 @@ from torch import nn
 from torch.autograd import Variable
 
 from config import Config
-from src.preprocess import preprocess_ct, load_ct
-from src.preprocess.extract_lungs import extract_lungs
+from src.preprocess import preprocess_ct, load_ct, lung_mask, resample
 
 """
 Detector model from team gtr123
@@ -446,33 +448,39 @@ def nms(predictions, nms_th=0.05):
     return bboxes
 
 
-def filter_lungs(image, spacing=(1, 1, 1), fill_value=170):
+def filter_lungs(image, mask, fill_value=170):
     """
 
     Args:
-      image: Image in Hu units
-      spacing: Image spacing (Default value = (1,1,1)
-      fill_value: Hu value to use (Default value = 170)
-
+      image: Pre-processed image
+      mask: Boolean mask of the lungs, of the same shape as image
+      fill_value: Value to fill everything but the lungs with (Default value = 170, the padding value of the detector)
 
     Returns:
-      An image volume containing only lungs as well as the boolean mask.
+      A copy of the image volume containing only lungs.
 
     """
-
-    mask = extract_lungs(image, spacing)
     extracted = np.array(image)
     extracted[np.logical_not(mask)] = fill_value
-    return extracted, mask
+    return extracted
 
 
-def predict(ct_path, model_path=None):
+def predict(ct_path, model_path=None, ct_array=None, meta=None, identity=None, mask_lungs=None, mask_factor=None):
     """
 
     Args:
-      image_itk: ITK Image in Hu units
+      ct_path: path to a MetaImage or DICOM data
       model_path: Path to the file containing the model state
                  (Default value = "src/algorithms/identify/assets/dsb2017_detector.ckpt")
+      ct_array: the already loaded voxel data of ct_path, it is loaded if None is set (Default value = None)
+      meta: the meta information accompanying ct_array (Default value = None)
+      identity: the series identity of ct_path returned by load_ct along with ct_array, the files of the series
+                are listed to identify it if None is set (Default value = None)
+      mask_lungs: whether everything but the lungs is filled with the padding value before the detection,
+                  Config.IDENTIFY_LUNG_MASK is used if None is set (Default value = None)
+      mask_factor: factor by which the slices are downsampled to extract the lung mask coarse-to-fine, 1 for
+                   full resolution, Config.IDENTIFY_LUNG_MASK_COARSE_FACTOR is used if None is set
+                   (Default value = None)
 
     Returns:
       List of Nodule locations and probabilities
@@ -482,18 +490,25 @@ def predict(ct_path, model_path=None):
         INDENTIFY_DIR = os.path.join(Config.ALGOS_DIR, 'identify')
         model_path = os.path.join(INDENTIFY_DIR, 'assets', 'dsb2017_detector.ckpt')
 
-    ct_array, meta = load_ct.load_ct(ct_path)
+    start = time.perf_counter()
+    if ct_array is None:
+        # the series files are listed once, for loading as well as for identifying the series
+        ct_array, meta, identity = load_ct.load_ct(ct_path, identity=True)
+        logging.info("identify: loaded {} in {:.2f}s".format(ct_path, time.perf_counter() - start))
+        start = time.perf_counter()
+
     meta = load_ct.MetaData(meta)
     spacing = np.array(meta.spacing)
-    masked_image, mask = filter_lungs(ct_array)
 
-    # masked_image = image
     net = Net()
     net.load_state_dict(torch.load(model_path)["state_dict"])
 
     if torch.cuda.is_available():
         net = torch.nn.DataParallel(net).cuda()
 
+    logging.info("identify: loaded the model in {:.2f}s".format(time.perf_counter() - start))
+    start = time.perf_counter()
+
     split_comber = SplitComb(side_len=int(144), margin=32, max_stride=16, stride=4, pad_value=170)
 
     # We have to use small batches until the next release of PyTorch, as bigger ones will segfault for CPU
@@ -502,8 +517,28 @@ def predict(ct_path, model_path=None):
     preprocess = preprocess_ct.PreprocessCT(clip_lower=-1200., clip_upper=600., spacing=True, order=1,
                                             min_max_normalize=True, scale=255, dtype='uint8')
 
-    ct_array, meta = preprocess(ct_array, meta)
+    if mask_lungs is None:
+        mask_lungs = Config.IDENTIFY_LUNG_MASK
+    if mask_factor is None:
+        mask_factor = Config.IDENTIFY_LUNG_MASK_COARSE_FACTOR
+
+    mask = None
+    if mask_lungs:
+        method = 'extract_lungs_coarse{}'.format(mask_factor) if mask_factor > 1 else 'extract_lungs'
+        # extracted in HU, before ct_array may be pre-processed in place
+        mask = lung_mask.get_lung_mask(ct_path, method, spacing=spacing, voxel_data=ct_array, identity=identity)
+
+    # shared with the classification algorithm which pre-processes the same way
+    ct_array, meta = preprocess_ct.preprocess_series(ct_path, preprocess, ct_array, meta, identity=identity)
+
+    if mask is not None:
+        # as in the pre-processing the DSB2017 detector was trained with, everything but the lungs is padding
+        zoom = spacing / np.asarray(preprocess.spacing, dtype=float)
+        ct_array = filter_lungs(ct_array, resample.resample(mask, zoom, order=0, backend='nearest'))
+
     ct_array = ct_array[np.newaxis, ...]
+    logging.info("identify: pre-processed in {:.2f}s".format(time.perf_counter() - start))
+    start = time.perf_counter()
 
     imgT, coords, nzhw = split_data(ct_array, split_comber=split_comber)
     results = []
@@ -520,6 +555,8 @@ def predict(ct_path, model_path=None):
 
     results = np.concatenate(results, 0)
     results = split_comber.combine(results, nzhw=nzhw)
+    logging.info("identify: ran the detector on {} chunks in {:.2f}s".format(len(imgT), time.perf_counter() - start))
+    start = time.perf_counter()
     pbb = GetPBB()
     # First index of proposals is the propabillity. Then x, y z, and radius
     proposals, _ = pbb(results, ismask=True)
@@ -538,4 +575,5 @@ def predict(ct_path, model_path=None):
 
     # Rescale back to image space coordinates
     proposals[:, 1:4] /= spacing[np.newaxis]
+    logging.info("identify: post-processed {} proposals in {:.2f}s".format(len(proposals), time.perf_counter() - start))
     return [{"x": int(p[3]), "y": int(p[2]), "z": int(p[1]), "p_nodule": float(p[0])} for p in proposals]
@@ -5,11 +5,13 @@ An API for a trained identification model to make predictions for where the
 centroids of nodules are in the DICOM image.
 """
 
+import logging
 import os
-
-import SimpleITK as sitk
+import time
 
 from config import Config
+from src.preprocess import load_ct
+from src.preprocess.errors import SeriesNotFoundException
 from . import prediction
 from .src import gtr123_model
 
@@ -41,19 +43,21 @@ def predict(dicom_path):
              'z': int,
              'p_nodule': float}
     """
-    reader = sitk.ImageSeriesReader()
-    if dicom_path.endswith('.mhd'):
-        if not os.path.isfile(dicom_path):
-            message = "The path {} does not exist"
-            raise ValueError(message.format(dicom_path))
-    else:
-        filenames = reader.GetGDCMSeriesFileNames(dicom_path)
-        if not filenames:
-            message = "The path {} doesn't contain any .mhd or .dcm files"
-            raise ValueError(message.format(dicom_path))
+    if dicom_path.endswith('.mhd') and not os.path.isfile(dicom_path):
+        message = "The path {} does not exist"
+        raise ValueError(message.format(dicom_path))
+
+    # the series is enumerated and read once here and handed down the pipeline
+    start = time.perf_counter()
+    try:
+        ct_array, meta, identity = load_ct.load_ct(dicom_path, identity=True)
+    except SeriesNotFoundException:
+        message = "The path {} doesn't contain any .mhd or .dcm files"
+        raise ValueError(message.format(dicom_path))
+    logging.info("identify: loaded {} in {:.2f}s".format(dicom_path, time.perf_counter() - start))
 
     # all required preprocssing and prediction is implemented in gtr123_model
-    result = gtr123_model.predict(dicom_path)
+    result = gtr123_model.predict(dicom_path, ct_array=ct_array, meta=meta, identity=identity)
     return result
 
 
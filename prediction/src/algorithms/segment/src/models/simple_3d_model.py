@@ -4,9 +4,9 @@ from keras.callbacks import ModelCheckpoint
 from keras.engine import Input, Model
 from keras.layers import Conv3D, MaxPooling3D, UpSampling3D, Activation
 from keras.optimizers import Adam
-from scipy.ndimage import zoom
 
 from .segmentation_model import SegmentationModel
+from .....preprocess import resample
 
 
 class Simple3DModel(SegmentationModel):
@@ -47,13 +47,17 @@ class Simple3DModel(SegmentationModel):
         X_rescaled = np.zeros((X.shape[0], *self.input_shape))
         y_rescaled = np.zeros((X.shape[0], *self.input_shape))
         for i in range(X.shape[0]):
-            X_rescaled[i, ..., 0] = zoom(
+            X_rescaled[i, ..., 0] = resample.resample(
                 X[i, ..., 0],
-                np.array(self.input_shape[:-1]) / np.array(X.shape[1:-1])
+                np.array(self.input_shape[:-1]) / np.array(X.shape[1:-1]),
+                order=3
             )
-            y_rescaled[i, ..., 0] = zoom(
+            # the labels are rescaled by the nearest voxel, so that they stay binary
+            y_rescaled[i, ..., 0] = resample.resample(
                 y[i, ..., 0],
-                np.array(self.input_shape[:-1]) / np.array(y.shape[1:-1])
+                np.array(self.input_shape[:-1]) / np.array(y.shape[1:-1]),
+                order=0,
+                backend='nearest'
             )
         model_checkpoint = ModelCheckpoint(self.best_model_path, monitor='loss', verbose=1, save_best_only=True)
         self.model.fit(X_rescaled, y_rescaled, callbacks=[model_checkpoint], epochs=10)
@@ -63,14 +67,16 @@ class Simple3DModel(SegmentationModel):
 
         # Scale the bigger 3D input images to the desired smaller shape
         X_rescaled = np.zeros((1, *self.input_shape))
-        X_rescaled[0, ..., 0] = zoom(
+        X_rescaled[0, ..., 0] = resample.resample(
             X[0, ..., 0],
-            np.array(self.input_shape[:-1]) / np.array(X.shape[1:-1])
+            np.array(self.input_shape[:-1]) / np.array(X.shape[1:-1]),
+            order=3
         )
 
         X_predicted = self.model.predict(X_rescaled)
-        y_predicted[0, ..., 0] = zoom(
+        y_predicted[0, ..., 0] = resample.resample(
             X_predicted[0, ..., 0],
-            np.array(X.shape[1:-1]) / np.array(self.input_shape[:-1])
+            np.array(X.shape[1:-1]) / np.array(self.input_shape[:-1]),
+            order=3
         )
         return y_predicted
@@ -9,7 +9,7 @@ import scipy.ndimage
 
 from ...algorithms.segment.src.models.simple_3d_model import Simple3DModel
 from ...preprocess.load_ct import load_ct, MetaData
-from ...preprocess.preprocess_ct import mm_coordinates_to_voxel
+from ...preprocess.preprocess_ct import mm_to_voxel
 from ...preprocess.lung_segmentation import DATA_SHAPE
 
 
@@ -84,12 +84,12 @@ def calculate_volume(segment_path, centroids, ct_path=None):
         meta = load_ct(ct_path, voxel=False)
         meta = MetaData(meta)
 
-    coords = [[centroid['z'], centroid['y'], centroid['x']] for centroid in centroids]
+    coords = np.array([[centroid['z'], centroid['y'], centroid['x']] for centroid in centroids])
 
     if ct_path:
-        coords = [mm_coordinates_to_voxel(coord, meta) for coord in coords]
+        coords = mm_to_voxel(coords, meta)
 
-    labels = [mask[coord[0], coord[1], coord[2]] for coord in coords]
+    labels = mask[tuple(coords.T)]
 
     volumes = np.bincount(mask.flatten())
     volumes = volumes[labels].tolist()
@@ -0,0 +1,77 @@
+"""
+Benchmark of `improved_lung_segmentation` end to end.
+
+Usage::
+
+    python -m src.benchmarks.improved_segmentation [PATH [PATH ...]] [--repeat N]
+
+Segments every CT scan at `PATH`, loaded by `load_ct` and converted to
+Hounsfield units by `PreprocessCT`, and reports the best wall time along with
+the number of voxels of the lungs and the trachea. A synthetic chest volume
+with a trachea is used if no path is given, e.g. for the full-size test scans::
+
+    python -m src.benchmarks.improved_segmentation ../images_full/LIDC-IDRI-*/*/*
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.benchmarks.lung_mask_coarse import synthetic_chest
+from src.preprocess import load_ct, preprocess_ct
+from src.preprocess.improved_lung_segmentation import improved_lung_segmentation
+
+
+def synthetic_patient(shape=(100, 256, 256)):
+    """
+    A synthetic chest whose trachea runs from the apex of the lungs to the
+    last slice, branching into a bronchus to either lung. The first slices
+    are soft tissue only, like the abdomen below the lungs of a scan.
+
+    Args:
+        shape (tuple[int]): the shape of the volume in (z, y, x) order.
+
+    Returns:
+        np.ndarray: the volume in Hounsfield units.
+    """
+    volume, _ = synthetic_chest(shape)
+    depth, rows, cols = shape
+    y, x = np.mgrid[:rows, :cols]
+    trachea = (y - rows // 2) ** 2 + (x - cols // 2) ** 2 < (rows * .03) ** 2
+    volume[int(depth * .6):, trachea] = -1000
+    bronchi = (abs(y - rows // 2) < rows * .02) & (abs(x - cols // 2) < cols * .3)
+    volume[int(depth * .6):int(depth * .6) + 3, bronchi] = -1000
+    volume[:int(depth * .05)] = np.maximum(volume[:int(depth * .05)], 40)
+    return volume
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark improved_lung_segmentation end to end.')
+    parser.add_argument('paths', nargs='*', help='the CT scans, a synthetic chest if none is given')
+    parser.add_argument('--repeat', type=int, default=1, help='the number of runs per scan')
+    args = parser.parse_args(argv)
+
+    print('{:>40} {:>16} {:>10} {:>10} {:>10}'.format('scan', 'shape', 'time [s]', 'lungs', 'trachea'))
+
+    for path in args.paths or [None]:
+        if path is None:
+            patient = synthetic_patient()
+            name = 'synthetic'
+        else:
+            patient, _ = preprocess_ct.PreprocessCT(to_hu=True)(*load_ct.load_ct(path))
+            name = path[-40:]
+
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            lungs, _, _, trachea = improved_lung_segmentation(patient)
+            timings.append(time.perf_counter() - start)
+
+        shape = 'x'.join(str(length) for length in patient.shape)
+        print('{:>40} {:>16} {:>10.3f} {:>10} {:>10}'.format(name, shape, min(timings), np.count_nonzero(lungs),
+                                                             np.count_nonzero(trachea)))
+
+
+if __name__ == '__main__':
+    main()
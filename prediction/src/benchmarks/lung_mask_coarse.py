@@ -0,0 +1,123 @@
+"""
+Benchmark of the coarse-to-fine against the full-resolution lung mask.
+
+Usage::
+
+    python -m src.benchmarks.lung_mask_coarse [PATH [PATH ...]] [--factors N [N ...]] [--repeat N]
+
+Extracts the lung mask of every CT scan at `PATH`, loaded by `load_ct`, at full
+resolution and coarse-to-fine for every downsampling factor, and reports the
+Dice coefficient against the full-resolution mask together with the speedup.
+A synthetic chest volume is used if no path is given, e.g. for the test scans::
+
+    python -m src.benchmarks.lung_mask_coarse ../images_full/LIDC-IDRI-*/*/*
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from src.preprocess import load_ct
+from src.preprocess.extract_lungs import extract_lungs, extract_lungs_coarse
+
+
+def synthetic_chest(shape=(100, 256, 256)):
+    """
+    A CT-like chest: two lungs of air with vessels in a body of soft tissue,
+    surrounded by air.
+
+    Args:
+        shape (tuple[int]): the shape of the volume in (z, y, x) order.
+
+    Returns:
+        np.ndarray: the volume in Hounsfield units.
+        np.ndarray: the spacing in (z, y, x) order.
+    """
+    random = np.random.RandomState(0)
+    depth, rows, cols = shape
+    y, x = np.mgrid[:rows, :cols] / np.array([rows, cols], dtype=float)[:, np.newaxis, np.newaxis]
+    volume = np.full(shape, -1000, dtype=np.int16)
+    volume[:, ((y - .5) / .42) ** 2 + ((x - .5) / .46) ** 2 < 1] = 40
+
+    for z in range(depth):
+        # the lungs narrow towards the apex
+        scale = np.sqrt(1 - (z / float(depth)) ** 2)
+        for center in (.31, .69):
+            volume[z, ((y - .5) / (.31 * scale)) ** 2 + ((x - center) / (.15 * scale)) ** 2 < 1] = -850
+
+    vessels = random.rand(*shape) < 2e-3
+    volume[vessels] = 60
+    volume += random.randint(-60, 60, size=shape).astype(np.int16)
+    return volume, np.array([2.5, 1.4, 1.4])
+
+
+def dice(first, second):
+    """
+    Dice coefficient of two masks.
+
+    Args:
+        first (np.ndarray): a boolean mask.
+        second (np.ndarray): a boolean mask of the same shape.
+
+    Returns:
+        float: 1 for identical masks, 0 for disjoint ones.
+    """
+    total = first.sum() + second.sum()
+    if not total:
+        return 1.
+
+    return 2. * np.logical_and(first, second).sum() / total
+
+
+def measure(extract, repeat):
+    """
+    Measure the wall time of a mask extraction.
+
+    Args:
+        extract (callable): extracts the mask, without any arguments.
+        repeat (int): the number of runs, the best wall time is reported.
+
+    Returns:
+        np.ndarray: the mask.
+        float: the wall time in seconds.
+    """
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mask = extract()
+        timings.append(time.perf_counter() - start)
+
+    return mask, min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the coarse-to-fine lung mask.')
+    parser.add_argument('paths', nargs='*', help='the CT scans, a synthetic chest if none is given')
+    parser.add_argument('--factors', type=int, nargs='+', default=[2, 3, 4], help='the downsampling factors')
+    parser.add_argument('--repeat', type=int, default=1, help='the number of runs per measurement')
+    args = parser.parse_args(argv)
+
+    print('{:>40} {:>7} {:>10} {:>8} {:>8}'.format('scan', 'factor', 'time [s]', 'speedup', 'dice'))
+
+    for path in args.paths or [None]:
+        if path is None:
+            image, spacing = synthetic_chest()
+            name = 'synthetic'
+        else:
+            image, meta = load_ct.load_ct(path)
+            image, spacing = np.asarray(image), np.array(load_ct.MetaData(meta).spacing)
+            name = path[-40:]
+
+        full, reference = measure(lambda: extract_lungs(image, spacing), args.repeat)
+        print('{:>40} {:>7} {:>10.3f} {:>8.2f} {:>8.4f}'.format(name, 1, reference, 1., 1.))
+
+        for factor in args.factors:
+            mask, timing = measure(lambda: extract_lungs_coarse(image, spacing, factor=factor), args.repeat)
+            speedup = reference / timing
+            print('{:>40} {:>7} {:>10.3f} {:>8.2f} {:>8.4f}'.format(name, factor, timing, speedup, dice(full, mask)))
+
+
+if __name__ == '__main__':
+    main()
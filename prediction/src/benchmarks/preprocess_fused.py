@@ -0,0 +1,95 @@
+"""
+Benchmark of the fused against the unfused voxel-wise steps of PreprocessCT.
+
+Usage::
+
+    python -m src.benchmarks.preprocess_fused [--shape Z Y X] [--repeat N]
+
+Reports the wall time and the peak memory traced by `tracemalloc` for a
+synthetic CT volume in both the float32 layout returned by `load_ct` for
+rescaled DICOM series and the raw int16 layout. Re-sampling is left out, as
+it is the same for both modes.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from src.preprocess.load_ct import MetaData
+from src.preprocess.preprocess_ct import PreprocessCT
+
+# the pre-processing of the gtr123 models, without re-sampling
+PARAMS = dict(clip_lower=-1200., clip_upper=600., min_max_normalize=True, scale=255, dtype='uint8')
+
+
+def synthetic_volume(shape, dtype):
+    """
+    A CT-like volume: air around a body of soft tissue with random noise.
+
+    Args:
+        shape (tuple[int]): the shape of the volume in (z, y, x) order.
+        dtype (str): the data-type of the voxels.
+
+    Returns:
+        np.ndarray
+    """
+    random = np.random.RandomState(0)
+    volume = np.full(shape, -1000, dtype=dtype)
+    z, y, x = shape
+    volume[:, y // 8: -y // 8, x // 8: -x // 8] = 40
+    volume += random.randint(-100, 100, size=shape[1:]).astype(dtype)
+    return volume
+
+
+def measure(preprocess, volume, meta, repeat):
+    """
+    Measure the wall time and peak memory of pre-processing a copy of `volume`.
+
+    Args:
+        preprocess (PreprocessCT): the pre-processing to measure.
+        volume (np.ndarray): the volume, it isn't modified.
+        meta (MetaData): the meta information of the volume.
+        repeat (int): the number of runs, the best wall time is reported.
+
+    Returns:
+        float, int: the wall time in seconds and the peak memory in bytes.
+    """
+    timings, peaks = [], []
+
+    for _ in range(repeat):
+        voxel_data = volume.copy()
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        preprocess(voxel_data, MetaData(meta))
+        timings.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+        del voxel_data
+
+    return min(timings), max(peaks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the fused mode of PreprocessCT.')
+    parser.add_argument('--shape', type=int, nargs=3, default=[400, 512, 512], help='the volume shape (z, y, x)')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs per measurement')
+    args = parser.parse_args(argv)
+
+    meta = {'spacing': [1., 1., 1.], 'origin': [0., 0., 0.], 'slope': 1., 'intercept': 0.}
+    print('{:>8} {:>8} {:>10} {:>14}'.format('input', 'mode', 'time [s]', 'peak [MiB]'))
+
+    for dtype in ['float32', 'int16']:
+        volume = synthetic_volume(tuple(args.shape), dtype)
+
+        for fused in [False, True]:
+            timing, peak = measure(PreprocessCT(fused=fused, **PARAMS), volume, meta, args.repeat)
+            mode = 'fused' if fused else 'unfused'
+            print('{:>8} {:>8} {:>10.3f} {:>14.1f}'.format(dtype, mode, timing, peak / 1024 ** 2))
+
+
+if __name__ == '__main__':
+    main()
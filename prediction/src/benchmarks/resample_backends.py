@@ -0,0 +1,76 @@
+"""
+Micro-benchmark of the backends of `src.preprocess.resample`.
+
+Usage::
+
+    python -m src.benchmarks.resample_backends [--sizes N [N ...]] [--zoom Z Y X] [--repeat N]
+
+Re-samples synthetic cubic int16 CT volumes of every size with every backend
+and every interpolation order the backend supports, and reports the best wall
+time. The 'scipy' backend is reported for both one and
+`Config.PREPROCESS_WORKERS` threads.
+"""
+
+import argparse
+import time
+
+from config import Config
+from src.benchmarks.preprocess_fused import synthetic_volume
+from src.preprocess import resample
+
+# the orders every backend supports
+ORDERS = {
+    'scipy': [0, 1, 3],
+    'cv2': [0, 1, 3],
+    'nearest': [0],
+}
+
+
+def measure(volume, zoom, order, backend, workers, repeat):
+    """
+    Measure the wall time of re-sampling `volume`.
+
+    Args:
+        volume (np.ndarray): the volume to re-sample.
+        zoom (sequence[float]): the zoom factor along the axes.
+        order (int): the order of the interpolation.
+        backend (str): the key of the backend in `resample.BACKENDS`.
+        workers (int): the number of threads.
+        repeat (int): the number of runs, the best wall time is reported.
+
+    Returns:
+        float: the wall time in seconds.
+    """
+    timings = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resample.resample(volume, zoom, order=order, backend=backend, workers=workers)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the re-sampling backends.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 128, 256], help='the edges of the cubic volumes')
+    parser.add_argument('--zoom', type=float, nargs=3, default=[2.5, .7, .7], help='the zoom factor (z, y, x)')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs per measurement')
+    args = parser.parse_args(argv)
+
+    print('{:>6} {:>8} {:>8} {:>6} {:>10}'.format('size', 'backend', 'workers', 'order', 'time [s]'))
+
+    for size in args.sizes:
+        volume = synthetic_volume((size, size, size), 'int16')
+
+        for backend in sorted(resample.BACKENDS):
+            workers = [1, Config.PREPROCESS_WORKERS] if backend == 'scipy' else [1]
+
+            for threads in sorted(set(workers)):
+                for order in ORDERS[backend]:
+                    timing = measure(volume, args.zoom, order, backend, threads, args.repeat)
+                    print('{:>6} {:>8} {:>8} {:>6} {:>10.3f}'.format(size, backend, threads, order, timing))
+
+
+if __name__ == '__main__':
+    main()
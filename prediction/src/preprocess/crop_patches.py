@@ -2,7 +2,42 @@ import itertools
 import numpy as np
 import scipy.ndimage
 
-from src.preprocess.preprocess_ct import mm_coordinates_to_voxel
+from src.preprocess.preprocess_ct import mm_to_voxel
+
+
+def _crop_padded(ct_array, start, patch_shape, padding_size, padded_shape, pad_value):
+    """
+    Crop `ct_array[start:start + patch_shape]` as if `ct_array` was padded by
+    `padding_size` at both ends of all dimensions.
+
+    Args:
+        ct_array (np.ndarray | src.preprocess.lazy_volume.LazyVolume): a CT scan.
+        start (list[int]): the first index of the patch within the padded CT scan.
+        patch_shape (np.ndarray): the desired shape of the patch.
+        padding_size (np.ndarray): the padding size for each dimension.
+        padded_shape (np.ndarray): the shape of the padded CT scan.
+        pad_value (int): value with which the padding is filled.
+
+    Returns:
+        np.ndarray: the cropped patch, truncated at the borders of the padded CT scan.
+    """
+    # ranges of the padded indices, with the very same semantics as slicing the padded array
+    ranges = [range(length)[begin:begin + size] for length, begin, size in zip(padded_shape, start, patch_shape)]
+    patch = np.full([len(indices) for indices in ranges], pad_value, dtype=ct_array.dtype)
+
+    source, target = [], []
+    for indices, padding, length in zip(ranges, padding_size, ct_array.shape):
+        begin = max(indices.start - padding, 0)
+        end = min(indices.stop - padding, length)
+        if end <= begin:
+            # the patch lies entirely within the padding
+            return patch
+
+        source.append(slice(begin, end))
+        target.append(slice(begin - indices.start + padding, end - indices.start + padding))
+
+    patch[tuple(target)] = ct_array[tuple(source)]
+    return patch
 
 
 def crop_patch(ct_array, patch_shape=None, centroids=None, stride=None, pad_value=0):
@@ -11,7 +46,8 @@ def crop_patch(ct_array, patch_shape=None, centroids=None, stride=None, pad_valu
     CT scan.
 
     Args:
-        ct_array (np.ndarray): a numpy ndarray representation of a CT scan
+        ct_array (np.ndarray | src.preprocess.lazy_volume.LazyVolume): a numpy ndarray
+            representation of a CT scan, only the neighbourhoods of the centroids are read.
         patch_shape (int, list[int]): a desired shape of a patch. If int will be provided,
             then patch will be a cube-shaped.
         centroids (list[dict]): A list of centroids of the form::
@@ -38,21 +74,17 @@ def crop_patch(ct_array, patch_shape=None, centroids=None, stride=None, pad_valu
     # array with padding size for each dimension
     padding_size = np.ceil(patch_shape / 2.).astype(np.int)
 
-    # array with left and right padding for each dimension
-    padding_array = np.stack([padding_size, padding_size], axis=1)
-
-    # adding paddings at both ends of all dimensions
-    ct_array = np.pad(ct_array, padding_array, mode='constant', constant_values=pad_value)
+    # the shape the CT scan would have if it was padded at both ends of all dimensions
+    padded_shape = np.array(ct_array.shape) + 2 * padding_size
 
     for centroid in centroids:
-        # cropping a patch with selected centroid in the center of it
-        patch = ct_array[centroid[0]: centroid[0] + patch_shape[0],
-                         centroid[1]: centroid[1] + patch_shape[1],
-                         centroid[2]: centroid[2] + patch_shape[2]]
+        # cropping a patch with selected centroid in the center of it, only the
+        # patch itself is padded, so that just its neighbourhood is ever read
+        patch = _crop_padded(ct_array, centroid, patch_shape, padding_size, padded_shape, pad_value)
 
         if stride:
-            normstart = np.array(centroid) / np.array(ct_array.shape) - 0.5
-            normsize = np.array(patch_shape) / np.array(ct_array.shape)
+            normstart = np.array(centroid) / padded_shape - 0.5
+            normsize = np.array(patch_shape) / padded_shape
 
             xx, yy, zz = np.meshgrid(np.linspace(normstart[0], normstart[0] + normsize[0], patch_shape[0] // stride),
                                      np.linspace(normstart[1], normstart[1] + normsize[1], patch_shape[1] // stride),
@@ -72,7 +104,8 @@ def patches_from_ct(ct_array, meta, patch_shape=None, centroids=None, stride=Non
     This is just a wrapper over crop_patch generator.
 
     Args:
-        ct_array (np.ndarray): a numpy ndarray representation of a CT scan
+        ct_array (np.ndarray | src.preprocess.lazy_volume.LazyVolume): a numpy ndarray
+            representation of a CT scan
         patch_shape (int | list[int]): the size of
             If int will be provided, then patch will be a cube.
         centroids (list[dict]): A list of centroids of the form::
@@ -93,10 +126,10 @@ def patches_from_ct(ct_array, meta, patch_shape=None, centroids=None, stride=Non
     if centroids is None:
         centroids = []
 
-    centroids = [[centroid[axis] for axis in 'zyx'] for centroid in centroids]
+    centroids = np.array([[centroid[axis] for axis in 'zyx'] for centroid in centroids]).reshape(-1, 3)
 
     # scale the coordinates according to spacing
-    centroids = [mm_coordinates_to_voxel(centroid, meta) for centroid in centroids]
+    centroids = mm_to_voxel(centroids, meta)
 
     patch_generator = crop_patch(ct_array, patch_shape, centroids, stride, pad_value)
     patches = itertools.islice(patch_generator, len(centroids))
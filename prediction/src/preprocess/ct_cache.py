@@ -0,0 +1,174 @@
+"""
+Persistent on-disk cache of decoded CT volumes.
+
+Every entry consists of a `<key>.npy` file with the voxel data, which is opened
+as a memory-map on a cache hit, and a `<key>.json` file with the serialized
+`MetaData`. Entries are keyed by the identity of the files the series was loaded
+from (paths, sizes and modification times), so that a changed series never hits
+a stale entry. The cache is bounded in size, the least recently used entries are
+evicted first.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from config import Config
+
+
+def series_key(paths):
+    """
+    Compute the identity of a CT series from the files it consists of.
+
+    Args:
+        paths (list[str]): paths to the files of the series.
+
+    Returns:
+        str: hex digest which changes whenever any file is added, removed or modified.
+    """
+    digest = hashlib.sha1()
+
+    for path in sorted(os.path.abspath(path) for path in paths):
+        stat = os.stat(path)
+        digest.update('{}:{}:{}\n'.format(path, stat.st_size, stat.st_mtime_ns).encode())
+
+    return digest.hexdigest()
+
+
+def _entry_paths(key, cache_dir):
+    return os.path.join(cache_dir, key + '.npy'), os.path.join(cache_dir, key + '.json')
+
+
+def get(key, voxel=True, cache_dir=None):
+    """
+    Look up a cached CT series.
+
+    Args:
+        key (str): the series identity, as returned by `series_key`.
+        voxel (bool): whether to return or not to return voxel data of the CT scan.
+        cache_dir (str): the cache directory. If None is set (default),
+            then `Config.CT_CACHE_DIR` will be used.
+
+    Returns:
+        None | dict | [np.memmap, dict]: None on a cache miss. Otherwise the serialized
+            meta data, preceded by the copy-on-write memory-mapped voxel data if `voxel` is set.
+    """
+    if cache_dir is None:
+        cache_dir = Config.CT_CACHE_DIR
+
+    voxel_path, meta_path = _entry_paths(key, cache_dir)
+
+    # The meta data are written last, so that its presence marks a complete entry
+    try:
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+    if not voxel:
+        return meta
+
+    try:
+        # Copy-on-write: in-place pre-processing never touches the cached file
+        voxel_data = np.load(voxel_path, mmap_mode='c')
+    except (OSError, ValueError):
+        return None
+
+    # Mark the entry as recently used for the eviction policy. The opened mapping stays valid
+    # if a concurrent eviction removes the file meanwhile, the entry is just not renewed then
+    try:
+        os.utime(voxel_path)
+    except OSError:
+        pass
+
+    return [voxel_data, meta]
+
+
+def put(key, voxel_data, meta, cache_dir=None, max_bytes=None):
+    """
+    Store a decoded CT series and evict the least recently used entries if
+    the cache outgrows `max_bytes`.
+
+    Args:
+        key (str): the series identity, as returned by `series_key`.
+        voxel_data (np.ndarray): the decoded voxel data.
+        meta (dict): the serialized meta data.
+        cache_dir (str): the cache directory. If None is set (default),
+            then `Config.CT_CACHE_DIR` will be used.
+        max_bytes (int): the size limit of the cache. If None is set (default),
+            then `Config.CT_CACHE_MAX_BYTES` will be used.
+    """
+    if cache_dir is None:
+        cache_dir = Config.CT_CACHE_DIR
+
+    if max_bytes is None:
+        max_bytes = Config.CT_CACHE_MAX_BYTES
+
+    os.makedirs(cache_dir, exist_ok=True)
+    voxel_path, meta_path = _entry_paths(key, cache_dir)
+
+    # Write into temporary files first, so that concurrent readers never see partial entries
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as voxel_file:
+        np.save(voxel_file, np.ascontiguousarray(voxel_data))
+    os.replace(voxel_file.name, voxel_path)
+
+    with tempfile.NamedTemporaryFile('w', dir=cache_dir, suffix='.tmp', delete=False) as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(meta_file.name, meta_path)
+
+    evict(max_bytes, cache_dir=cache_dir, keep=key)
+
+
+def _list_entries(cache_dir):
+    entries = []
+
+    for name in os.listdir(cache_dir):
+        key, ext = os.path.splitext(name)
+        if ext != '.npy':
+            continue
+
+        voxel_path, meta_path = _entry_paths(key, cache_dir)
+        try:
+            size = os.path.getsize(voxel_path) + os.path.getsize(meta_path)
+            last_used = os.path.getmtime(voxel_path)
+        except OSError:
+            continue
+
+        entries.append((last_used, size, key))
+
+    return entries
+
+
+def evict(max_bytes, cache_dir=None, keep=None):
+    """
+    Remove the least recently used entries until the cache fits into `max_bytes`.
+
+    Args:
+        max_bytes (int): the size limit of the cache.
+        cache_dir (str): the cache directory. If None is set (default),
+            then `Config.CT_CACHE_DIR` will be used.
+        keep (str): the key of an entry which should never be evicted.
+    """
+    if cache_dir is None:
+        cache_dir = Config.CT_CACHE_DIR
+
+    entries = _list_entries(cache_dir)
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, key in sorted(entries):
+        if total <= max_bytes:
+            break
+
+        if key == keep:
+            continue
+
+        for path in _entry_paths(key, cache_dir):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        total -= size
@@ -8,3 +8,9 @@ class EmptyDicomSeriesException(Exception):
             args = ('The specified path does not contain dcm-files. Please ensure that '
                     'the path points to a folder containing a DICOM-series.', )
         Exception.__init__(self, *args)
+
+
+class SeriesNotFoundException(ValueError):
+    """
+    Exception that is raised when the given path contains neither a DICOM-series nor a MetaImage file.
+    """
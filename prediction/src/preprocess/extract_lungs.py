@@ -1,3 +1,7 @@
+import ctypes
+import logging
+import multiprocessing
+
 import numpy as np
 import scipy.ndimage
 
@@ -5,30 +9,23 @@ from scipy.ndimage.morphology import binary_dilation, generate_binary_structure
 from skimage import measure
 from skimage.morphology import convex_hull_image
 
+from config import Config
 
-def binarize_per_slice(image, spacing, intensity_th=-600, sigma=1, area_th=30, eccen_th=0.99, bg_patch_size=10):
-    """
-
-    :param image:
-    :param spacing:
-    :param intensity_th: Anything below this threshold is considered air or lung
-    :param sigma:
-    :param area_th:
-    :param eccen_th:
-    :param bg_patch_size:
-    :return:
-    """
-    bw = np.zeros(image.shape, dtype=bool)
 
-    # prepare a mask, with all corner values set to nan
-    image_size = image.shape[1]
+def _circular_nan_mask(image_size):
+    # a mask of the slices' inscribed circle, with all the corner values set to nan
     grid_axis = np.linspace(-image_size / 2 + 0.5, image_size / 2 - 0.5, image_size)
     x, y = np.meshgrid(grid_axis, grid_axis)
     d = (x ** 2 + y ** 2) ** 0.5
     nan_mask = (d < image_size / 2).astype(float)
     nan_mask[nan_mask == 0] = np.nan
+    return nan_mask
+
 
-    for i in range(image.shape[0]):
+def _binarize_slices(image, bw, start, stop, spacing, nan_mask, intensity_th, sigma, area_th, eccen_th,
+                     bg_patch_size):
+    # binarize the slices [start, stop) of `image` into `bw`
+    for i in range(start, stop):
         # Check if corner pixels are identical, if so the slice  before Gaussian filtering
         if len(np.unique(image[i, 0:bg_patch_size, 0:bg_patch_size])) == 1:
             current_bw = scipy.ndimage.filters.gaussian_filter(np.multiply(image[i].astype('float32'), nan_mask), sigma,
@@ -40,16 +37,92 @@ def binarize_per_slice(image, spacing, intensity_th=-600, sigma=1, area_th=30, e
         # select proper components
         label = measure.label(current_bw)
         properties = measure.regionprops(label)
-        valid_label = set()
+        valid_label = np.zeros(label.max() + 1, dtype=bool)
 
         for prop in properties:
             if prop.area * spacing[1] * spacing[2] > area_th and prop.eccentricity < eccen_th:
-                valid_label.add(prop.label)
+                valid_label[prop.label] = True
 
-        current_bw = np.in1d(label, list(valid_label)).reshape(label.shape)
-        bw[i] = current_bw
+        bw[i] = valid_label[label]
 
-    return bw
+
+# the shared input and output of the worker processes of `binarize_per_slice`
+_binarize_shared = {}
+
+# the fewest slices worth a worker process, smaller volumes are binarized in the current process
+MIN_SLICES_PER_WORKER = 16
+
+
+def _init_binarize_worker(image_buffer, bw_buffer, shape, dtype, kwargs):
+    _binarize_shared['image'] = np.frombuffer(image_buffer, dtype=dtype).reshape(shape)
+    _binarize_shared['bw'] = np.frombuffer(bw_buffer, dtype=bool).reshape(shape)
+    _binarize_shared['kwargs'] = kwargs
+
+
+def _binarize_chunk(bounds):
+    _binarize_slices(_binarize_shared['image'], _binarize_shared['bw'], *bounds, **_binarize_shared['kwargs'])
+
+
+def _pool_context():
+    # the calling process may hold threads or a CUDA context, which must not be forked,
+    # hence the workers are started from a clean process
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def binarize_per_slice(image, spacing, intensity_th=-600, sigma=1, area_th=30, eccen_th=0.99, bg_patch_size=10,
+                       workers=None):
+    """
+    Binarize every slice into the air and lung components of proper area and eccentricity.
+
+    The slices are independent of each other, hence they are binarized in chunks
+    on a pool of processes, which share the input and the output volume instead
+    of pickling them. The processes are started by forkserver or spawn rather
+    than forked, and volumes of fewer than `MIN_SLICES_PER_WORKER` slices per
+    process are binarized in the current process.
+
+    :param image:
+    :param spacing:
+    :param intensity_th: Anything below this threshold is considered air or lung
+    :param sigma:
+    :param area_th:
+    :param eccen_th:
+    :param bg_patch_size:
+    :param workers: the number of processes. If None is set (default),
+        then `Config.EXTRACT_LUNGS_WORKERS` will be used.
+    :return:
+    """
+    if workers is None:
+        workers = Config.EXTRACT_LUNGS_WORKERS
+
+    image = np.ascontiguousarray(image)
+    kwargs = {'spacing': spacing, 'nan_mask': _circular_nan_mask(image.shape[1]), 'intensity_th': intensity_th,
+              'sigma': sigma, 'area_th': area_th, 'eccen_th': eccen_th, 'bg_patch_size': bg_patch_size}
+
+    workers = min(workers, len(image) // MIN_SLICES_PER_WORKER)
+    if workers <= 1:
+        bw = np.zeros(image.shape, dtype=bool)
+        _binarize_slices(image, bw, 0, len(image), **kwargs)
+        return bw
+
+    context = _pool_context()
+    image_buffer = context.RawArray(ctypes.c_char, image.nbytes)
+    np.frombuffer(image_buffer, dtype=image.dtype).reshape(image.shape)[...] = image
+    bw_buffer = context.RawArray(ctypes.c_char, int(np.prod(image.shape)))
+
+    # a few chunks per process balance the load without too many tasks
+    chunk = -(-len(image) // (4 * workers))
+    chunks = [(start, min(start + chunk, len(image))) for start in range(0, len(image), chunk)]
+
+    pool = context.Pool(workers, _init_binarize_worker,
+                        (image_buffer, bw_buffer, image.shape, image.dtype, kwargs))
+    try:
+        pool.map(_binarize_chunk, chunks)
+    finally:
+        pool.terminate()
+
+    # the shared buffer outlives the pool as the base of the returned array
+    return np.frombuffer(bw_buffer, dtype=bool).reshape(image.shape)
 
 
 def _fill_hole(bw):
@@ -61,40 +134,109 @@ def _fill_hole(bw):
     return bw
 
 
-def _merge_background_labels(label, cut_num):
+def _background_labels(label, cut_num):
     mid = int(label.shape[2] / 2)
-    bg_label = {label[0, 0, 0], label[0, 0, -1], label[0, -1, 0], label[0, -1, -1],
-                label[-1 - cut_num, 0, 0], label[-1 - cut_num, 0, -1], label[-1 - cut_num, -1, 0],
-                label[-1 - cut_num, -1, -1],
-                label[0, 0, mid], label[0, -1, mid], label[-1 - cut_num, 0, mid], label[-1 - cut_num, -1, mid]}
-    for l in bg_label:
-        label[label == l] = 0
-    return label
+    return {label[0, 0, 0], label[0, 0, -1], label[0, -1, 0], label[0, -1, -1],
+            label[-1 - cut_num, 0, 0], label[-1 - cut_num, 0, -1], label[-1 - cut_num, -1, 0],
+            label[-1 - cut_num, -1, -1],
+            label[0, 0, mid], label[0, -1, mid], label[-1 - cut_num, 0, mid], label[-1 - cut_num, -1, mid]}
+
 
+def _remove_large_objects(label, spacing, area_th, dist_th, depth=None, cache=None):
+    # the label volume may only hold the top `depth` slices of a volume, the slices below are empty
+    if depth is None:
+        depth = label.shape[0]
 
-def _remove_large_objects(label, spacing, area_th, dist_th):
     # prepare a distance map for further analysis
     x_axis = np.linspace(-label.shape[1] / 2 + 0.5, label.shape[1] / 2 - 0.5, label.shape[1]) * spacing[1]
     y_axis = np.linspace(-label.shape[2] / 2 + 0.5, label.shape[2] / 2 - 0.5, label.shape[2]) * spacing[2]
     x, y = np.meshgrid(x_axis, y_axis)
     d = (x ** 2 + y ** 2) ** 0.5
+    max_d = np.max(d)
     vols = measure.regionprops(label)
     valid_label = set()
     # select components based on their area and distance to center axis on all slices
     for vol in vols:
-        single_vol = label == vol.label
-        slice_area = np.zeros(label.shape[0])
-        min_distance = np.zeros(label.shape[0])
-        for i in range(label.shape[0]):
-            slice_area[i] = np.sum(single_vol[i]) * np.prod(spacing[1:3])
-            min_distance[i] = np.min(single_vol[i] * d + (1 - single_vol[i]) * np.max(d))
-
-        if np.average([min_distance[i] for i in range(label.shape[0]) if slice_area[i] > area_th]) < dist_th:
+        # only the bounding box of a component is inspected, the slices outside of it are empty
+        z0, r0, c0, z1, r1, c1 = vol.bbox
+        single_vol = vol.image
+
+        # the components of a volume cut at some slice are subsets of those of the volume cut at fewer slices, a
+        # component is thus identified among all the cuts by its first voxel together with its area
+        first = np.unravel_index(np.argmax(single_vol), single_vol.shape)
+        key = (z0 + first[0], r0 + first[1], c0 + first[2], vol.area)
+
+        if cache is None or key not in cache:
+            slice_area = np.zeros(depth)
+            min_distance = np.full(depth, max_d)
+            slice_area[z0:z1] = single_vol.sum(axis=(1, 2)) * np.prod(spacing[1:3])
+            min_distance[z0:z1] = np.where(single_vol, d[r0:r1, c0:c1], max_d).min(axis=(1, 2))
+            central = np.average(min_distance[slice_area > area_th]) < dist_th
+            if cache is None:
+                cache = {}
+            cache[key] = central
+
+        if cache[key]:
             valid_label.add(vol.label)
     return valid_label
 
 
-def all_slice_analysis(bw, spacing, cut_num=0, vol_limit=[0.68, 8.2], area_th=6e3, dist_th=62):
+def label_components(bw):
+    """
+    Label the components of a binary volume once for all the cut_num of `all_slice_analysis`.
+
+    :param bw: Binary volume, created on a per-slice basis
+    :return: The labels with connectivity 1 and the slices of the components, see scipy.ndimage.find_objects
+    """
+    label = measure.label(bw, connectivity=1)
+    return label, scipy.ndimage.find_objects(label)
+
+
+def _cut_labels(labels, depth):
+    # the labels of the top `depth` slices only, equal to labelling them anew up to the numbering: the components
+    # which reach the slices below are split into their pieces, which are labelled within their bounding box
+    label, objects = labels
+    reach = np.unique(label[depth:])
+    reach = reach[reach > 0]
+    if not reach.size:
+        return label[:depth]
+
+    top = min(objects[index - 1][0].start for index in reach)
+    if top >= depth:
+        return label[:depth]
+
+    box = (slice(top, depth),) + tuple(slice(min(objects[index - 1][axis].start for index in reach),
+                                             max(objects[index - 1][axis].stop for index in reach))
+                                       for axis in (1, 2))
+    label = label[:depth].copy()
+    window = label[box]
+    cut = np.isin(window, reach)
+    window[cut] = measure.label(cut, connectivity=1)[cut] + len(objects)
+    return label
+
+
+def _fill_back(bw, bw0, cut_num):
+    # bw1 is bw with removed slices, bw2 is a dilated version of bw, part of their intersection is returned as
+    # final mask
+    bw1 = np.copy(bw)
+    bw1[-cut_num:] = bw0[-cut_num:]
+    bw2 = np.copy(bw)
+    bw2 = scipy.ndimage.binary_dilation(bw2, iterations=cut_num)
+    bw3 = bw1 & bw2
+    label = measure.label(bw, connectivity=1)
+    label3 = measure.label(bw3, connectivity=1)
+    l_list = set(np.unique(label)) - {0}
+    valid_l3 = set()
+    for l in l_list:
+        indices = np.nonzero(label == l)
+        l3 = label3[indices[0][0], indices[1][0], indices[2][0]]
+        if l3 > 0:
+            valid_l3.add(l3)
+    return np.in1d(label3, list(valid_l3)).reshape(label3.shape)
+
+
+def all_slice_analysis(bw, spacing, cut_num=0, vol_limit=[0.68, 8.2], area_th=6e3, dist_th=62, cache=None,
+                       labels=None, fill_back=True):
     """
 
     Args:
@@ -104,52 +246,46 @@ def all_slice_analysis(bw, spacing, cut_num=0, vol_limit=[0.68, 8.2], area_th=6e
         vol_limit:
         area_th:
         dist_th:
+        cache: Dictionary of the components already analysed for other cut_num of the same bw, filled in place
+        labels: The components of bw as returned by label_components, shared between the calls for several
+            cut_num. If None is set (default), then the slices left by cut_num will be labelled
+        fill_back: Whether to fill back the parts of the removed top layers. If not, the removed layers are empty
+            and the components of the mask are otherwise the same
 
     Returns:
 
     """
-    # in some cases, several top layers need to be removed first
-    if cut_num > 0:
-        bw0 = np.copy(bw)
-        bw[-cut_num:] = False
-
-    label = measure.label(bw, connectivity=1)
-
-    # remove components access to corners
-    label = _merge_background_labels(label, cut_num)
+    # in some cases, several top layers need to be removed first, only the slices below them are labelled and the
+    # binary volume is left unchanged
+    depth = bw.shape[0] - cut_num
+    if labels is None:
+        label = measure.label(bw[:depth], connectivity=1)
+    else:
+        label = _cut_labels(labels, depth)
 
-    # select components based on volume
-    properties = measure.regionprops(label)
-    for prop in properties:
-        if prop.area * spacing.prod() < vol_limit[0] * 1e6 or prop.area * spacing.prod() > vol_limit[1] * 1e6:
-            label[label == prop.label] = 0
+    # remove components access to corners and select components based on volume, through a single lookup table
+    lookup = np.arange(label.max() + 1)
+    lookup[list(_background_labels(label, 0))] = 0
+    volume = np.bincount(label.ravel()) * spacing.prod()
+    lookup[(volume < vol_limit[0] * 1e6) | (volume > vol_limit[1] * 1e6)] = 0
 
-    if len(np.unique(label)) == 1:
+    if not lookup.any():
+        bw = np.copy(bw)
+        bw[depth:] = False
         return bw, 0
 
-    valid_label = _remove_large_objects(label, spacing, area_th=area_th, dist_th=dist_th)
+    label = lookup[label]
+    valid_label = _remove_large_objects(label, spacing, area_th=area_th, dist_th=dist_th, depth=bw.shape[0],
+                                        cache=cache)
 
-    bw = np.in1d(label, list(valid_label)).reshape(label.shape)
+    valid = np.zeros(len(lookup), dtype=bool)
+    valid[list(valid_label)] = True
+    bw0, bw = bw, np.zeros(bw.shape, dtype=bool)
+    bw[:depth] = valid[label]
 
     # fill back the parts removed earlier
-    if cut_num > 0:
-        # bw1 is bw with removed slices, bw2 is a dilated version of bw, part of their intersection is returned as
-        # final mask
-        bw1 = np.copy(bw)
-        bw1[-cut_num:] = bw0[-cut_num:]
-        bw2 = np.copy(bw)
-        bw2 = scipy.ndimage.binary_dilation(bw2, iterations=cut_num)
-        bw3 = bw1 & bw2
-        label = measure.label(bw, connectivity=1)
-        label3 = measure.label(bw3, connectivity=1)
-        l_list = set(np.unique(label)) - {0}
-        valid_l3 = set()
-        for l in l_list:
-            indices = np.nonzero(label == l)
-            l3 = label3[indices[0][0], indices[1][0], indices[2][0]]
-            if l3 > 0:
-                valid_l3.add(l3)
-        bw = np.in1d(label3, list(valid_l3)).reshape(label3.shape)
+    if cut_num > 0 and fill_back:
+        bw = _fill_back(bw, bw0, cut_num)
 
     return bw, len(valid_label)
 
@@ -230,31 +366,101 @@ def two_lung_only(bw, spacing, max_iter=22, max_ratio=4.8):
     return bw1, bw2, bw
 
 
-def extract_lungs(image, spacing):
+def extract_lungs(image, spacing, workers=None):
     """
 
     :param image: Dicom image loaded as numpy array
     :param spacing: Pixel spacing
+    :param workers: Number of processes which binarize the slices, see binarize_per_slice
     :return: Dicom image numpy
     """
 
     spacing = np.array(spacing)
 
-    bw = binarize_per_slice(image, spacing)
+    bw0 = binarize_per_slice(image, spacing, workers=workers)
     flag = 0
     cut_num = 0
     cut_step = 2
-    bw0 = np.copy(bw)
-    while flag == 0 and cut_num < bw.shape[0]:
-        bw = np.copy(bw0)
-        bw, flag = all_slice_analysis(bw, spacing, cut_num=cut_num, vol_limit=[0.68, 7.5])
+    iterations = 0
+    # the volume is labelled once, only the components reaching the removed top layers are labelled again for every
+    # cut_num, and the components analysed for a cut_num are reused for the following ones
+    labels = label_components(bw0)
+    cache = {}
+    while flag == 0 and cut_num < bw0.shape[0]:
+        bw, flag = all_slice_analysis(bw0, spacing, cut_num=cut_num, vol_limit=[0.68, 7.5], cache=cache,
+                                      labels=labels, fill_back=False)
         cut_num = cut_num + cut_step
+        iterations = iterations + 1
+
+    cut_num = cut_num - cut_step
+    logging.info('extract_lungs: {} top layers removed after {} iteration(s)'.format(cut_num, iterations))
+
+    # filling back leaves the result of a failed analysis unchanged, hence only a final successful one is filled back
+    if flag and cut_num > 0:
+        bw = _fill_back(bw, bw0, cut_num)
 
     bw = _fill_hole(bw)
     bw1, bw2, bw = two_lung_only(bw, spacing)
     return bw
 
 
+def _downsample_slices(image, factor):
+    # average the blocks of factor x factor pixels of every slice, the slices are padded by their edges
+    rows, cols = image.shape[1:]
+    pad = ((0, 0), (0, -rows % factor), (0, -cols % factor))
+    padded = np.pad(image.astype('float32'), pad, mode='edge')
+    blocks = padded.reshape(padded.shape[0], padded.shape[1] // factor, factor, padded.shape[2] // factor, factor)
+    return blocks.mean(axis=(2, 4))
+
+
+def _upsample_slices(bw, factor, shape):
+    # repeat every pixel of the slices factor x factor times, cropped to shape
+    rows = np.arange(shape[1]) // factor
+    cols = np.arange(shape[2]) // factor
+    return bw[:, rows[:, np.newaxis], cols]
+
+
+def extract_lungs_coarse(image, spacing, factor=2, band=None, intensity_th=-600, sigma=1, workers=None):
+    """
+    Extract the lungs from slices downsampled by `factor`, then refine the
+    boundary of the mask at full resolution: within `band` pixels of it, a
+    voxel belongs to the lungs if it is below `intensity_th` after the
+    Gaussian smoothing of `binarize_per_slice`.
+
+    :param image: Dicom image loaded as numpy array
+    :param spacing: Pixel spacing
+    :param factor: Factor by which the rows and columns are downsampled, the slices are kept
+    :param band: Width in pixels of the refined band on either side of the boundary, factor by default
+    :param intensity_th: Intensity threshold of the refinement
+    :param sigma: Standard deviation of the Gaussian smoothing of the refinement
+    :param workers: Number of processes which binarize the slices, see binarize_per_slice
+    :return: Dicom image numpy
+    """
+
+    spacing = np.array(spacing, dtype=float)
+    if factor <= 1:
+        return extract_lungs(image, spacing, workers=workers)
+
+    if band is None:
+        band = factor
+
+    coarse = extract_lungs(_downsample_slices(image, factor), spacing * [1, factor, factor], workers=workers)
+    bw = _upsample_slices(coarse, factor, image.shape)
+
+    # the band around the boundary within every slice
+    struct = np.zeros((3, 3, 3), dtype=bool)
+    struct[1] = generate_binary_structure(2, 1)
+    interior = scipy.ndimage.binary_erosion(bw, structure=struct, iterations=band)
+    boundary = binary_dilation(bw, structure=struct, iterations=band) & ~interior
+
+    bw = interior
+    for i in np.flatnonzero(boundary.any(axis=(1, 2))):
+        smoothed = scipy.ndimage.filters.gaussian_filter(image[i].astype('float32'), sigma, truncate=2.0)
+        bw[i] |= boundary[i] & (smoothed < intensity_th)
+
+    return _fill_2d_hole(bw)
+
+
 def process_mask(mask):
     convex_mask = np.copy(mask)
     for i_layer in range(convex_mask.shape[0]):
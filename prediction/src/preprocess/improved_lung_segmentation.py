@@ -1,3 +1,6 @@
+import ctypes
+import logging
+
 import numpy as np
 import scipy.ndimage
 import skimage
@@ -9,6 +12,9 @@ import skimage.transform
 import skimage.segmentation
 import itertools
 
+from config import Config
+from .extract_lungs import _pool_context
+
 BRONCHIAL_THRESHOLD = -950
 INITIAL_THRESHOLD = -950
 RADIUS_BALL = 5
@@ -17,7 +23,34 @@ MIN_LUNGS_THRESHOLD = -1040
 STEP = 64
 
 
-def region_growing(img, seed, minthr, maxthr, structure=None):
+def _expand_box(box, shape, region, margin):
+    """
+    Expand the faces of a bounding box which are reached by a region grown
+    within it, except for the faces on the border of the volume.
+
+    Args:
+        box (tuple[slice]): the bounding box within the volume.
+        shape (tuple[int]): the shape of the volume.
+        region (np.ndarray[bool]): the region grown within the bounding box.
+        margin (int): the number of voxels the reached faces are moved by.
+
+    Returns:
+        tuple[slice] | None: the expanded bounding box, None if the region reaches no face.
+    """
+    expanded = []
+    reached = False
+    for axis, (bounds, length) in enumerate(zip(box, shape)):
+        start, stop = bounds.start, bounds.stop
+        if start > 0 and region.take(0, axis=axis).any():
+            start, reached = max(start - margin, 0), True
+        if stop < length and region.take(-1, axis=axis).any():
+            stop, reached = min(stop + margin, length), True
+        expanded.append(slice(start, stop))
+
+    return tuple(expanded) if reached else None
+
+
+def region_growing(img, seed, minthr, maxthr, structure=None, out=None, margin=16, max_size=None):
     """
     Region growing.
 
@@ -25,24 +58,67 @@ def region_growing(img, seed, minthr, maxthr, structure=None):
     Code was taken from:
     https://github.com/loli/medpy/wiki/Basic-image-manipulation
 
+    Only a bounding box around the seeds is labelled, whose faces are moved
+    outwards for as long as the region reaches them, so that the work is
+    proportional to the grown region rather than to the whole image.
+
     Args:
-        img: An image that is a numpy ndarray.
+        img: An image that is a numpy ndarray, left unchanged.
         seed: A seed binary image of the same shape that contains a True-value at each seed point.
         minthr: A minimal threshold value.
         maxthr: A maximum threshold value.
         structure: A structure element that describes the connectedness / neighbourhood
+        out: A binary image of the same shape the region is written to, allocated if None is set.
+        margin: The initial number of voxels by which the bounding box is expanded, doubled on each expansion.
+        max_size: A number of voxels at which the growing stops, the region is then only partially grown.
 
     Returns:
         region: The obtained segmentation region.
     """
-    img[seed] = minthr
-    thrimg = (img < maxthr) & (img >= minthr)
-    lmap, _ = scipy.ndimage.label(thrimg, structure=structure)
-    lids = np.unique(lmap[seed])
-    region = np.zeros(img.shape, np.bool)
-    for lid in lids:
-        region |= lmap == lid
-    return region
+    if out is None:
+        out = np.zeros(img.shape, np.bool_)
+    else:
+        out[...] = False
+
+    seed = seed.astype(np.bool_, copy=False)
+    boxes = scipy.ndimage.find_objects(seed.view(np.uint8))
+    if not boxes:
+        return out
+
+    # the seeds are part of the region only if they meet the thresholds once set to minthr in the data-type of the
+    # image, otherwise they are left out of the thresholded image and the region is its background, which is not
+    # bounded
+    seed_value = np.array(minthr).astype(img.dtype)
+    seeded = minthr <= seed_value < maxthr
+    if seeded:
+        box = tuple(slice(max(bounds.start - margin, 0), min(bounds.stop + margin, length))
+                    for bounds, length in zip(boxes[0], img.shape))
+    else:
+        box = tuple(slice(0, length) for length in img.shape)
+
+    while True:
+        window = img[box]
+        seed_window = seed[box]
+        thrimg = (window < maxthr) & (window >= minthr)
+        if seeded:
+            thrimg |= seed_window
+        else:
+            thrimg &= ~seed_window
+
+        lmap, _ = scipy.ndimage.label(thrimg, structure=structure)
+        region = np.isin(lmap, np.unique(lmap[seed_window]))
+
+        # the region grown within the bounding box is a part of the whole region
+        if max_size is not None and np.count_nonzero(region) >= max_size:
+            break
+
+        expanded = _expand_box(box, img.shape, region, margin)
+        if expanded is None:
+            break
+        box, margin = expanded, margin * 2
+
+    out[box] = region
+    return out
 
 
 def extract_bronchial(ct_slice, xy_spacing=1.):
@@ -183,14 +259,18 @@ def growing_bronchis(patient, seeds, initial_threshold=INITIAL_THRESHOLD,
     """
 
     seeds = seeds.astype(np.bool_)
-    seeds = region_growing(patient.copy(), seeds, MIN_BRONCHIAL_THRESHOLD, initial_threshold)
+    seeds = region_growing(patient, seeds, MIN_BRONCHIAL_THRESHOLD, initial_threshold)
     volume = np.count_nonzero(seeds)
+    # the buffer the region of the next threshold is grown into, swapped with the seeds when accepted
+    labeled = np.zeros(patient.shape, np.bool_)
 
     lungs_thresh = skimage.filters.threshold_otsu(patient[patient.shape[0] // 2])
 
     ret = None
     while True:
-        labeled = region_growing(patient.copy(), seeds, MIN_BRONCHIAL_THRESHOLD, initial_threshold + step)
+        # an explosion is known as soon as the region doubled
+        labeled = region_growing(patient, seeds, MIN_BRONCHIAL_THRESHOLD, initial_threshold + step, out=labeled,
+                                 max_size=volume * 2)
         new_volume = np.count_nonzero(labeled)
         if new_volume >= volume * 2:
             if step == 4:
@@ -205,7 +285,7 @@ def growing_bronchis(patient, seeds, initial_threshold=INITIAL_THRESHOLD,
 
         initial_threshold += step
         volume = new_volume
-        seeds = labeled
+        seeds, labeled = labeled, seeds
 
         if initial_threshold >= lungs_thresh:
             if ret is None:
@@ -238,8 +318,8 @@ def grow_lungs(patient, seeds):
     lungs_seeds = patient * seeds == patient[seeds].min()
     lungs_seeds = lungs_seeds.astype(np.bool_)
     threshold = skimage.filters.threshold_otsu(patient[patient.shape[0] // 2])
-    lungs_seeds = region_growing(patient.copy(), lungs_seeds, MIN_LUNGS_THRESHOLD, threshold)
-    return scipy.ndimage.morphology.binary_opening(lungs_seeds - scipy.ndimage.morphology.binary_opening(seeds))
+    lungs_seeds = region_growing(patient, lungs_seeds, MIN_LUNGS_THRESHOLD, threshold)
+    return scipy.ndimage.morphology.binary_opening(lungs_seeds & ~scipy.ndimage.morphology.binary_opening(seeds))
 
 
 def remove_trash(labeled_matrix):
@@ -364,7 +444,46 @@ def separate_new_slice(new_slice, prev_slice, slice_num):
     return intersect
 
 
-def separate_lungs3d(file_):
+def _propagate(lungs, separated, reference, slice_nums):
+    """
+    Propagate the separation of a reference slice over the adjacent slices,
+    each separated slice being the reference of the next one.
+
+    Args:
+        lungs (np.ndarray): the segmented lungs, the slices along the axis 1 in the order of propagation.
+        separated (np.ndarray[int]): the output of the separated slices, in the same order, filled in place.
+        reference (np.ndarray[int]): the separated slice adjacent to the first one.
+        slice_nums (sequence[int]): the numbers of the slices.
+    """
+    cur_slice = reference
+    for i, slice_num in enumerate(slice_nums):
+        cur_slice = separate_new_slice(lungs[:, i, :].astype(int), cur_slice, slice_num)
+        separated[:, i, :] = cur_slice
+
+
+def _propagations(lungs, separated, start):
+    # the arguments of `_propagate` forward and backward from the reference slice, the backward slices reversed
+    return [(lungs[:, start + 1:, :], separated[:, start + 1:, :], separated[:, start, :],
+             range(start + 1, lungs.shape[1])),
+            (lungs[:, :start, :][:, ::-1], separated[:, :start, :][:, ::-1], separated[:, start, :],
+             range(start - 1, -1, -1))]
+
+
+# the shared input and output of the worker processes of `separate_lungs3d`
+_separate_shared = {}
+
+
+def _init_separate_worker(lungs_buffer, separated_buffer, shape, dtype):
+    _separate_shared['lungs'] = np.frombuffer(lungs_buffer, dtype=dtype).reshape(shape)
+    _separate_shared['separated'] = np.frombuffer(separated_buffer, dtype=int).reshape(shape)
+
+
+def _propagate_shared(direction):
+    index, start = direction
+    _propagate(*_propagations(_separate_shared['lungs'], _separate_shared['separated'], start)[index])
+
+
+def separate_lungs3d(file_, workers=None):
     """
     The main idea of the algorithm is to select reference binary image
     of the lungs in a one slice which further will be propagated over
@@ -373,41 +492,58 @@ def separate_lungs3d(file_):
     slices from previous step, as new reference images until lungs are
     not separated.
 
+    The propagation forward and backward from the reference slice are
+    independent of each other and may run in two processes, which share
+    the input and the output volume instead of pickling them.
+
     Args:
         file_: A label of the segmented lungs.
+        workers: The number of processes, the propagation runs in the current process if less than 2.
+            If None is set (default), then `Config.SEPARATE_LUNGS_WORKERS` will be used.
 
     Returns:
         The masks of segmented and separated lungs.
     """
+    if workers is None:
+        workers = Config.SEPARATE_LUNGS_WORKERS
+
     interval = np.int(file_.shape[1] * 0.1)
     start_slice_ind = -1
     start_slice = []
-    with open('output_nrt', 'w') as f:
-        print("finding start slice")
-        for i in (range(file_.shape[1] // 2 - interval, file_.shape[1] // 2 + interval)):
-            if if_separate(file_[:, i, :]):
-                start_slice_ind = i
-                break
-        f.write(str(start_slice_ind))
-        if start_slice_ind == -1:
-            start_slice = separate_lungs(file_[:, file_.shape[1] // 2, :], file_.shape[1] // 2)
-            start_slice_ind = file_.shape[1] // 2
-        else:
-            start_slice = define_lungs(skimage.measure.label(file_[:, start_slice_ind, :], connectivity=1))
-        cur_slice = start_slice
-        ret = file_.astype(int)
+    logging.debug('separate_lungs3d: finding start slice')
+    for i in (range(file_.shape[1] // 2 - interval, file_.shape[1] // 2 + interval)):
+        if if_separate(file_[:, i, :]):
+            start_slice_ind = i
+            break
+    logging.debug('separate_lungs3d: start slice {}'.format(start_slice_ind))
+    if start_slice_ind == -1:
+        start_slice = separate_lungs(file_[:, file_.shape[1] // 2, :], file_.shape[1] // 2)
+        start_slice_ind = file_.shape[1] // 2
+    else:
+        start_slice = define_lungs(skimage.measure.label(file_[:, start_slice_ind, :], connectivity=1))
+
+    logging.debug('separate_lungs3d: moving forward and backward')
+    if workers < 2:
+        ret = np.empty(file_.shape, dtype=int)
         ret[:, start_slice_ind, :] = start_slice
-        print("moving forward")
-        for i in (range(start_slice_ind + 1, file_.shape[1])):
-            new_slice = separate_new_slice(file_[:, i, :].astype(int), cur_slice, i)
-            ret[:, i, :] = new_slice
-            cur_slice = new_slice
-        cur_slice = start_slice
-        print("moving backward")
-        for i in (range(start_slice_ind - 1, -1, -1)):
-            new_slice = separate_new_slice(file_[:, i, :].astype(int), cur_slice, i)
-            ret[:, i, :] = new_slice
-            cur_slice = new_slice
+        for propagation in _propagations(file_, ret, start_slice_ind):
+            _propagate(*propagation)
+        return extract_lungs(ret)
+
+    file_ = np.ascontiguousarray(file_)
+    context = _pool_context()
+    lungs_buffer = context.RawArray(ctypes.c_char, file_.nbytes)
+    np.frombuffer(lungs_buffer, dtype=file_.dtype).reshape(file_.shape)[...] = file_
+    ret_buffer = context.RawArray(ctypes.c_char, int(np.prod(file_.shape)) * np.dtype(int).itemsize)
+    ret = np.frombuffer(ret_buffer, dtype=int).reshape(file_.shape)
+    ret[:, start_slice_ind, :] = start_slice
+
+    pool = context.Pool(2, _init_separate_worker, (lungs_buffer, ret_buffer, file_.shape, file_.dtype))
+    try:
+        pool.map(_propagate_shared, [(0, start_slice_ind), (1, start_slice_ind)])
+    finally:
+        pool.terminate()
+
     return extract_lungs(ret)
 
 
@@ -598,7 +734,7 @@ def costal_surface(lung, z_coords, max_coor, combined):
         else:
             roi = (lung[coord] > max_coor) * (lung[coord] != 0)
 
-        erroneus[coord] = skimage.morphology.convex_hull_object(roi) - roi
+        erroneus[coord] = skimage.morphology.convex_hull_object(roi) & ~roi
 
     erroneus = erroneus * (1 - (combined != 0))
     skm_ball = skimage.morphology.ball(RADIUS_BALL)
@@ -0,0 +1,116 @@
+"""
+Convert a tree of CT series into the chunked volume store.
+
+Usage::
+
+    python -m src.preprocess.ingest [--root ROOT] [--store STORE] [--workers N]
+
+Every series matching the `LIDC_WILDCARD` layout below ROOT is decoded once
+and written to the same relative path below STORE, see
+`src.preprocess.volume_store`. Series which are already stored completely are
+skipped, hence an interrupted run can simply be restarted.
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from config import Config, LIDC_WILDCARD
+from . import volume_store
+from .load_ct import load_ct, MetaData
+
+
+def find_series(root):
+    """
+    Find the series directories of a tree laid out as `LIDC_WILDCARD`.
+
+    Args:
+        root (str): the top-level image directory.
+
+    Returns:
+        list[str]: the directories which contain .dcm files.
+    """
+    paths = glob.glob(os.path.join(root, *LIDC_WILDCARD))
+    return sorted(path for path in paths if os.path.isdir(path) and glob.glob(os.path.join(path, '*.dcm')))
+
+
+def ingest_series(path, target, chunk_depth=None):
+    """
+    Decode a single series into the store, unless it is already stored.
+
+    Args:
+        path (str): the directory of the series.
+        target (str): the directory of the stored volume.
+        chunk_depth (int): the number of slices per chunk, see `volume_store.write`.
+
+    Returns:
+        bool: whether the series was written.
+    """
+    if volume_store.is_stored(target):
+        return False
+
+    voxel_data, meta = load_ct(path, cache=False, index=False)
+    volume_store.write(target, voxel_data, MetaData(meta).to_dict(), chunk_depth=chunk_depth)
+    return True
+
+
+def ingest(root, store=None, workers=None, chunk_depth=None):
+    """
+    Convert every series below `root` into the store on a process pool.
+
+    Args:
+        root (str): the top-level image directory.
+        store (str): the directory of the store. If None is set (default),
+            then `Config.VOLUME_STORE_DIR` will be used.
+        workers (int): the number of processes. If None is set (default),
+            then the number of CPUs will be used.
+        chunk_depth (int): the number of slices per chunk, see `volume_store.write`.
+
+    Returns:
+        dict: the number of `written`, `skipped` and `failed` series.
+    """
+    if store is None:
+        store = Config.VOLUME_STORE_DIR
+
+    series = find_series(root)
+    targets = [os.path.join(store, os.path.relpath(path, root)) for path in series]
+    counts = {'written': 0, 'skipped': 0, 'failed': 0}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(ingest_series, path, target, chunk_depth) for path, target in zip(series, targets)]
+
+        for path, future in zip(series, futures):
+            try:
+                written = future.result()
+            except Exception:
+                # a broken series must not abort the whole run
+                logging.exception('Exception ingesting {}'.format(path))
+                counts['failed'] += 1
+                continue
+
+            counts['written' if written else 'skipped'] += 1
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert a tree of CT series into the chunked volume store.')
+    parser.add_argument('--root', default=Config.FULL_DICOM_PATHS, help='the top-level image directory')
+    parser.add_argument('--store', default=Config.VOLUME_STORE_DIR, help='the directory of the store')
+    parser.add_argument('--workers', type=int, default=None, help='the number of processes')
+    parser.add_argument('--chunk-depth', type=int, default=Config.VOLUME_STORE_CHUNK_DEPTH,
+                        help='the number of slices per chunk')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    counts = ingest(args.root, store=args.store, workers=args.workers, chunk_depth=args.chunk_depth)
+    logging.info('{written} series written, {skipped} already stored, {failed} failed'.format(**counts))
+    # a non-zero exit status makes the failures visible to batch jobs
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
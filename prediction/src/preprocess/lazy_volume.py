@@ -0,0 +1,208 @@
+import abc
+import operator
+from collections import OrderedDict
+
+import dicom
+import numpy as np
+
+
+def sort_slices(datasets):
+    """
+    Sort DICOM datasets along the normal of their image plane, i.e. in the
+    order in which their slices are stacked into a volume.
+
+    Args:
+        datasets (list[dicom.dataset.Dataset]): slices of a single series.
+
+    Returns:
+        list[dicom.dataset.Dataset]: the sorted slices.
+    """
+    orientation = np.array(datasets[0].ImageOrientationPatient, dtype=np.float64)
+    normal = np.cross(orientation[:3], orientation[3:])
+    positions = [np.dot(normal, np.array(ds.ImagePositionPatient, dtype=np.float64)) for ds in datasets]
+    order = np.argsort(positions, kind='mergesort')
+    return [datasets[i] for i in order]
+
+
+def pixel_dtype(dataset):
+    """
+    The data-type of the pixel data of a DICOM dataset, derived from its header.
+
+    Args:
+        dataset (dicom.dataset.Dataset): a slice, the pixel data need not be read.
+
+    Returns:
+        np.dtype
+    """
+    kind = 'i' if dataset.PixelRepresentation else 'u'
+    return np.dtype('{}{}'.format(kind, dataset.BitsAllocated // 8))
+
+
+def slice_pixels(dataset):
+    """
+    The pixel data of a DICOM dataset, read straight from its buffer where possible.
+
+    Args:
+        dataset (dicom.dataset.Dataset): a slice along with its pixel data.
+
+    Returns:
+        np.ndarray: the (rows, columns) pixel data, a read-only view of the buffer
+            unless the pixel data are compressed.
+    """
+    rows, columns = int(dataset.Rows), int(dataset.Columns)
+    dtype = pixel_dtype(dataset)
+    if not dataset.is_little_endian:
+        dtype = dtype.newbyteorder('>')
+
+    pixel_data = dataset.PixelData
+    if getattr(dataset, 'SamplesPerPixel', 1) == 1 and len(pixel_data) == rows * columns * dtype.itemsize:
+        return np.frombuffer(pixel_data, dtype=dtype).reshape(rows, columns)
+
+    # encapsulated, i.e. compressed, pixel data have to be decoded
+    return dataset.pixel_array
+
+
+def rescale_parameters(datasets):
+    """
+    The rescaling which `dicom_numpy.combine_slices` applies to the slices of a series.
+
+    Args:
+        datasets (list[dicom.dataset.Dataset]): the sorted slices of a series.
+
+    Returns:
+        None | (float, float): the slope and intercept, None if the voxels are not rescaled.
+    """
+    if not hasattr(datasets[0], 'RescaleSlope') and not hasattr(datasets[0], 'RescaleIntercept'):
+        return None
+
+    # dicom_numpy takes the values of the last slice
+    return float(getattr(datasets[-1], 'RescaleSlope', 1)), float(getattr(datasets[-1], 'RescaleIntercept', 0))
+
+
+class SlicedVolume(abc.ABC):
+    """
+    Base class of volumes which are read slice by slice along the z-axis.
+
+    Supports numpy-style indexing where the first index addresses the z-axis,
+    only the slices touched by an index are read by `read_slice`, which has to
+    be implemented by subclasses along with the `shape` and `dtype` attributes.
+    Subclasses lacking `read_slice` cannot be instantiated.
+
+    Attributes:
+        shape (tuple[int]): the shape of the volume in (z, y, x) order.
+        dtype (np.dtype): the data-type of the voxels.
+    """
+
+    shape = None
+    dtype = None
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @abc.abstractmethod
+    def read_slice(self, index):
+        """
+        Read a single slice.
+
+        Args:
+            index (int): the non-negative index of the slice along the z-axis.
+
+        Returns:
+            np.ndarray: the pixel data of the slice, which must not be modified.
+        """
+
+    def _stack(self, indices):
+        volume = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        for i, index in enumerate(indices):
+            volume[i] = self.read_slice(index)
+        return volume
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        if not key or key[0] is Ellipsis:
+            return np.asarray(self)[key]
+
+        z_key, rest = key[0], key[1:]
+
+        if isinstance(z_key, slice):
+            return self._stack(range(*z_key.indices(self.shape[0])))[(slice(None),) + rest]
+
+        if np.ndim(z_key) == 0:
+            index = operator.index(z_key)
+            if not -self.shape[0] <= index < self.shape[0]:
+                raise IndexError('index {} is out of bounds for axis 0 with size {}'.format(index, self.shape[0]))
+            return np.array(self.read_slice(index % self.shape[0])[rest])
+
+        indices = np.arange(self.shape[0])[np.asarray(z_key)]
+        return self._stack(indices.ravel()).reshape(indices.shape + self.shape[1:])[(Ellipsis,) + rest]
+
+    def __array__(self, dtype=None):
+        volume = self._stack(range(self.shape[0]))
+        if dtype is not None:
+            volume = volume.astype(dtype, copy=False)
+        return volume
+
+
+class LazyVolume(SlicedVolume):
+    """
+    A CT volume which decodes its DICOM slices only when they are accessed.
+
+    Only the slices touched by an index are read from disk, see `SlicedVolume`.
+    The most recently decoded slices are kept in a small cache, so that
+    overlapping neighbourhoods are decoded once. The voxels are rescaled exactly
+    as `load_dicom` does it.
+
+    Args:
+        datasets (list[dicom.dataset.FileDataset]): the slices of the series read
+            with `stop_before_pixels`, they must have been read from files.
+        cache_size (int): the number of decoded slices to keep.
+
+    Returns:
+        preprocess.lazy_volume.LazyVolume
+    """
+
+    def __init__(self, datasets, cache_size=32):
+        if not datasets:
+            raise ValueError('The datasets should contain at least one slice')
+
+        self.datasets = sort_slices(datasets)
+        self.shape = (len(self.datasets), int(self.datasets[0].Rows), int(self.datasets[0].Columns))
+        self.rescale = rescale_parameters(self.datasets)
+        self.dtype = pixel_dtype(self.datasets[0]) if self.rescale is None else np.dtype(np.float32)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def read_slice(self, index):
+        """
+        Decode a single slice, served from the slice cache where possible.
+
+        Args:
+            index (int): the index of the slice along the z-axis.
+
+        Returns:
+            np.ndarray: the read-only pixel data of the slice.
+        """
+        pixels = self._cache.get(index)
+
+        if pixels is None:
+            dataset = dicom.read_file(self.datasets[index].filename)
+            pixels = slice_pixels(dataset)
+            if self.rescale is not None:
+                slope, intercept = self.rescale
+                pixels = pixels.astype(np.float32) * slope + intercept
+            pixels = np.asarray(pixels, dtype=self.dtype)
+            pixels.setflags(write=False)
+
+            self._cache[index] = pixels
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(index)
+
+        return pixels
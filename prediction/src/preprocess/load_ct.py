@@ -1,16 +1,59 @@
 import os
 import glob
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
 
 import SimpleITK
 import dicom
 import dicom_numpy
+import numpy as np
 
-from .errors import EmptyDicomSeriesException
+from config import Config
+from . import ct_cache, series_index, volume_store
+from .errors import EmptyDicomSeriesException, SeriesNotFoundException
+from .lazy_volume import LazyVolume, pixel_dtype, rescale_parameters, slice_pixels, sort_slices
 
 
-def read_dicom_files(file_pattern):
+def parallel_read(reader, paths, workers=None):
+    """
+    Apply `reader` to every path on a thread pool, preserving the order of `paths`.
+
+    Reading a DICOM series is dominated by file I/O, especially on network
+    mounted volumes, hence threads are enough to overlap the reads.
+
+    Args:
+        reader (callable): function which takes a path and returns the loaded object.
+        paths (list[str]): paths of the files to read.
+        workers (int): the number of threads to use. If None is set (default),
+            then `Config.DICOM_READ_WORKERS` will be used.
+
+    Returns:
+        list: the objects returned by `reader` in the order of `paths`.
+    """
+    if workers is None:
+        workers = Config.DICOM_READ_WORKERS
+
+    paths = list(paths)
+    if workers <= 1 or len(paths) <= 1:
+        return [reader(path) for path in paths]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as executor:
+        # executor.map re-raises the first exception raised by `reader`
+        return list(executor.map(reader, paths))
+
+
+def read_dicom_files(file_pattern, workers=None, stop_before_pixels=False, paths=None):
+    reader = dicom.read_file
+    if stop_before_pixels:
+        # Only the headers are parsed, the pixel data is neither read nor decoded
+        reader = functools.partial(dicom.read_file, stop_before_pixels=True)
+
+    if paths is None:
+        paths = glob.glob(file_pattern)
+
     try:
-        files = [dicom.read_file(fn) for fn in glob.glob(file_pattern)]
+        files = parallel_read(reader, paths, workers=workers)
 
         if len(files) == 0:
             raise EmptyDicomSeriesException
@@ -21,9 +64,105 @@ def read_dicom_files(file_pattern):
     return sorted(files, key=lambda x: float(x.SliceLocation))
 
 
-def _extract_voxel_data(datasets):
+# Attributes which have to be equal among all the slices of a series
+INVARIANT_SLICE_ATTRIBUTES = [
+    'Modality',
+    'SOPClassUID',
+    'SeriesInstanceUID',
+    'Rows',
+    'Columns',
+    'ImageOrientationPatient',
+    'PixelSpacing',
+    'PixelRepresentation',
+    'BitsAllocated',
+    'BitsStored',
+    'HighBit',
+    'RescaleSlope',
+    'RescaleIntercept',
+]
+
+
+def validate_slices(datasets):
+    """
+    Ensure that DICOM slices form an evenly spaced grid, performing the same
+    checks as `dicom_numpy.combine_slices`.
+
+    Args:
+        datasets (list[dicom.dataset.Dataset]): the slices of a series.
+
+    Raises:
+        dicom_numpy.DicomImportException: if the slices don't form a grid.
+    """
+    if not datasets:
+        raise dicom_numpy.DicomImportException('Must provide at least one DICOM dataset')
+
+    for name in INVARIANT_SLICE_ATTRIBUTES:
+        expected = getattr(datasets[0], name, None)
+        for dataset in datasets[1:]:
+            value = getattr(dataset, name, None)
+            if value != expected:
+                message = 'All slices must have the same value for "{}": {} != {}'
+                raise dicom_numpy.DicomImportException(message.format(name, value, expected))
+
+    orientation = np.array(datasets[0].ImageOrientationPatient, dtype=np.float64)
+    row_cosine, column_cosine = orientation[:3], orientation[3:]
+
+    if not np.isclose(np.dot(row_cosine, column_cosine), 0., rtol=0, atol=1e-4):
+        message = 'Non-orthogonal direction cosines: {}, {}'
+        raise dicom_numpy.DicomImportException(message.format(row_cosine, column_cosine))
+
+    for name, cosine in [('row', row_cosine), ('column', column_cosine)]:
+        if not np.isclose(np.linalg.norm(cosine), 1., rtol=0, atol=1e-4):
+            message = "The {} direction cosine's magnitude is not 1: {}"
+            raise dicom_numpy.DicomImportException(message.format(name, cosine))
+
+    normal = np.cross(row_cosine, column_cosine)
+    positions = sorted(np.dot(normal, np.array(ds.ImagePositionPatient, dtype=np.float64)) for ds in datasets)
+    spacings = np.diff(positions)
+
+    if len(spacings) and not np.allclose(spacings, spacings[0], atol=0, rtol=1e-5):
+        logging.warning('The slice spacing is non-uniform. Slice spacings:\n{}'.format(spacings))
+
+    if len(spacings) and not np.allclose(spacings, spacings[0], atol=0, rtol=1e-1):
+        raise dicom_numpy.DicomImportException('It appears there are missing slices')
+
+
+def assemble_slices(datasets):
+    """
+    Stack DICOM slices into a C-contiguous volume in (z, y, x) order.
+
+    The volume is allocated once and filled slice by slice straight from the
+    pixel buffers. The voxels equal those of `dicom_numpy.combine_slices`
+    transposed into (z, y, x) order, including its rescaling into float32.
+
+    Args:
+        datasets (list[dicom.dataset.Dataset]): the validated slices of a series.
+
+    Returns:
+        np.ndarray: the voxel data of the series.
+    """
+    datasets = sort_slices(datasets)
+    rescale = rescale_parameters(datasets)
+    dtype = pixel_dtype(datasets[0]) if rescale is None else np.float32
+
+    voxel_data = np.empty((len(datasets), int(datasets[0].Rows), int(datasets[0].Columns)), dtype=dtype)
+    for index, dataset in enumerate(datasets):
+        voxel_data[index] = slice_pixels(dataset)
+
+    if rescale is not None:
+        # in place, hence without any temporary volume
+        slope, intercept = rescale
+        voxel_data *= slope
+        voxel_data += intercept
+
+    return voxel_data
+
+
+def _extract_voxel_data(datasets, lazy=False):
     try:
-        voxel_ndarray, ijk_to_xyz = dicom_numpy.combine_slices(datasets)
+        validate_slices(datasets)
+        # the lazy volume is validated up front just as well, its slices are decoded on access
+        voxel_ndarray = LazyVolume(datasets) if lazy else assemble_slices(datasets)
     except dicom_numpy.DicomImportException as e:
         print('Exception extracting voxel data: ', e)
         raise e
@@ -31,10 +170,10 @@ def _extract_voxel_data(datasets):
         print('Exception extracting voxel data: ', e)
         raise dicom_numpy.DicomImportException('Invalid dicom.dataset.Dataset among datasets! ', e)
 
-    return voxel_ndarray.T
+    return voxel_ndarray
 
 
-def load_dicom(path, voxel=True):
+def load_dicom(path, voxel=True, lazy=False, files=None):
     """
     Function that orchestrates the loading of dicom datafiles of a dicom series
     into a numpy-array.
@@ -43,28 +182,114 @@ def load_dicom(path, voxel=True):
         path (str): contains the path to the folder containing the dcm-files of
                     a series.
         voxel (bool): whether to return or not to return voxel data of the CT
-                      scan
+                      scan. If False, only the headers of the dcm-files are read.
+        lazy (bool): whether to defer decoding the pixel data of the slices
+                     until they are accessed, see `LazyVolume`.
+        files (list[str]): the dcm-files of the series, if they are already
+                           known. If None is set (default), `path` is listed.
 
     Returns:
-        voxel_data (np.ndarray): numpy-array containing the 3D-representation
-                                 of the DICOM-series.
+        voxel_data (np.ndarray | LazyVolume): numpy-array containing the 3D-representation
+                                              of the DICOM-series.
         files (list[dicom.dataset.FileDataset]): DICOM-meta data.
     """
 
     file_pattern = os.path.join(path, '*.dcm')
-    meta = read_dicom_files(file_pattern)
+    meta = read_dicom_files(file_pattern, stop_before_pixels=not voxel or lazy, paths=files)
 
     if voxel:
-        voxel_data = _extract_voxel_data(meta)
+        voxel_data = _extract_voxel_data(meta, lazy=lazy)
         meta = [voxel_data, meta]
 
     return meta
 
 
+# MetaImage element types which map directly onto numpy data-types
+METAIMAGE_DTYPES = {
+    'MET_CHAR': 'i1',
+    'MET_UCHAR': 'u1',
+    'MET_SHORT': 'i2',
+    'MET_USHORT': 'u2',
+    'MET_INT': 'i4',
+    'MET_UINT': 'u4',
+    'MET_FLOAT': 'f4',
+    'MET_DOUBLE': 'f8',
+}
+
+
+def read_metaimage_header(path):
+    """
+    Parse the `key = value` pairs of a .mhd header.
+
+    Args:
+        path (str): the path to the .mhd file.
+
+    Returns:
+        dict[str, str]: the header fields.
+    """
+    header = {}
+
+    with open(path, 'rb') as mhd_file:
+        for line in mhd_file:
+            key, sep, value = line.decode('latin-1').partition('=')
+            if not sep:
+                continue
+
+            header[key.strip()] = value.strip()
+
+            # ElementDataFile is always the last field of a header
+            if key.strip() == 'ElementDataFile':
+                break
+
+    return header
+
+
+def _metaimage_meta(header):
+    ndim = int(header.get('NDims', 3))
+    spacing = header.get('ElementSpacing', header.get('ElementSize', ' '.join(['1'] * ndim)))
+    origin = header.get('Offset', header.get('Origin', header.get('Position', ' '.join(['0'] * ndim))))
+
+    # the default axes order which is used is: (z, y, x)
+    return {'spacing': tuple(float(axis) for axis in spacing.split())[::-1],
+            'origin': tuple(float(axis) for axis in origin.split())[::-1],
+            # MetaImage files are read and written directly as float values
+            'slope': 1.,
+            'intercept': 0.}
+
+
+def _memmap_metaimage(path, header):
+    data_file = header.get('ElementDataFile', '')
+    compressed = header.get('CompressedData', 'False').lower() == 'true'
+    dtype = METAIMAGE_DTYPES.get(header.get('ElementType'))
+    channels = int(header.get('ElementNumberOfChannels', 1))
+
+    # Compressed, multi-file and embedded data are left to SimpleITK
+    if compressed or dtype is None or channels != 1 or data_file in ('', 'LOCAL', 'LIST') or '%' in data_file:
+        return None
+
+    msb = header.get('BinaryDataByteOrderMSB', header.get('ElementByteOrderMSB', 'False'))
+    dtype = np.dtype(('>' if msb.lower() == 'true' else '<') + dtype)
+
+    # the default axes order which is used is: (z, y, x)
+    shape = tuple(int(axis) for axis in header['DimSize'].split())[::-1]
+    data_file = os.path.join(os.path.dirname(path), data_file)
+
+    offset = int(header.get('HeaderSize', 0))
+    if offset == -1:
+        # the data is stored at the tail of the file
+        offset = os.path.getsize(data_file) - int(np.prod(shape)) * dtype.itemsize
+
+    # Copy-on-write: in-place pre-processing never touches the file on disk
+    return np.memmap(data_file, dtype=dtype, mode='c', offset=offset, shape=shape)
+
+
 def load_metaimage(path, voxel=True):
     """
     Function that load a MetaImage files.
 
+    Uncompressed data are memory-mapped and the meta-information is parsed from
+    the .mhd header directly. SimpleITK is used for any other MetaImage files.
+
     Args:
         path (str): the path directly to the .mhd file itself, .raw
             file related to that .mhd should lie in the same directory.
@@ -72,9 +297,21 @@ def load_metaimage(path, voxel=True):
 
     Returns:
         voxel_data (np.ndarray): numpy-array containing the 3D-representation of a MetaImage file.
-        itkimage (SimpleITK.SimpleITK.Image): containing the meta-information of a MetaImage file.
+            A copy-on-write np.memmap if the data is uncompressed.
+        meta (MetaData | SimpleITK.SimpleITK.Image): containing the meta-information of a MetaImage file,
+            SimpleITK.SimpleITK.Image if it was read by SimpleITK.
     """
 
+    if isinstance(path, str) and path[-4:].lower() == '.mhd' and os.path.isfile(path):
+        header = read_metaimage_header(path)
+
+        if not voxel:
+            return MetaData(_metaimage_meta(header))
+
+        voxel_data = _memmap_metaimage(path, header)
+        if voxel_data is not None:
+            return [voxel_data, MetaData(_metaimage_meta(header))]
+
     meta = SimpleITK.ReadImage(path)
 
     if voxel:
@@ -84,7 +321,7 @@ def load_metaimage(path, voxel=True):
     return meta
 
 
-def load_ct(path, voxel=True):
+def load_ct(path, voxel=True, cache=None, lazy=False, index=None, identity=False):
     """
     Function that orchestrates the loading of DICOM or MetaImage datafiles into
     a numpy-array.
@@ -92,30 +329,179 @@ def load_ct(path, voxel=True):
     Args:
         path (str): contains the path to the folder containing either dcm-files of a series
             or .mhd/.raw files of MetaImage format. It also may can contain a path directly to
-            a .mhd file itself.
+            a .mhd file itself, or a path to a volume of the chunked volume store.
         voxel (bool): whether to return or not to return  voxel data of the CT scan
+        cache (bool): whether to use the on-disk volume cache, see `src.preprocess.ct_cache`.
+            If None is set (default), then `Config.CT_CACHE_ENABLED` will be used.
+        lazy (bool): whether to decode only the parts of the voxel data which are accessed.
+            DICOM-series are returned as a `LazyVolume`, stored volumes as a `StoredVolume`,
+            uncompressed MetaImage files and cached series are memory-mapped regardless.
+        index (bool): whether to locate the series through the series index instead of
+            listing `path`, see `src.preprocess.series_index`. If None is set (default),
+            then `Config.SERIES_INDEX_ENABLED` will be used.
+        identity (bool): whether to also return the `series_identity` of the series, computed
+            from the files found while loading it, so that they are not listed again.
 
     Returns:
-        voxel_data (np.ndarray): numpy-array containing the 3D-representation of either
-            DICOM-series or MetaImage file.
-        meta (list[dicom.dataset.FileDataset] | SimpleITK.SimpleITK.Image): meta-information
-            of a MetaImage file or DICOM-series in its original format.
+        voxel_data (np.ndarray | LazyVolume | StoredVolume): numpy-array containing the 3D-representation of either
+            DICOM-series or MetaImage file. Memory-mapped if it was read from the cache
+            or from an uncompressed MetaImage file.
+        meta (list[dicom.dataset.FileDataset] | SimpleITK.SimpleITK.Image | MetaData): meta-information
+            of a DICOM-series in its original format, MetaData for uncompressed MetaImage files
+            or if the cache is used. MetaData if only the meta-information is served from the index
+            or if the CT scan is read from the volume store.
+        identity (str): the identity of the series, only if `identity` is set.
     """
+    if volume_store.is_stored(path):
+        # already decoded by src.preprocess.ingest, neither the cache nor the index are needed
+        stored = volume_store.load(path, voxel=voxel, lazy=lazy)
+        key = ct_cache.series_key(volume_store.stored_files(path)) if identity else None
+        if not voxel:
+            return _identified(MetaData(stored), voxel, key)
+        return _identified([stored[0], MetaData(stored[1])], voxel, key)
+
+    if index is None:
+        index = Config.SERIES_INDEX_ENABLED
+
+    if cache is None:
+        cache = Config.CT_CACHE_ENABLED
+
+    record = series_index.lookup(path) if index else None
+    if record is not None and not voxel and not identity:
+        return MetaData(record['meta'])
+
+    dicom_pattern, mhd_pattern = _find_series(path, record)
+    key = ct_cache.series_key(_series_files(dicom_pattern, mhd_pattern)) if cache or identity else None
+
+    if record is not None and not voxel:
+        loaded = MetaData(record['meta'])
+    elif cache:
+        loaded = _load_cached(key, path, dicom_pattern, mhd_pattern, voxel, lazy)
+    else:
+        loaded = _load_uncached(path, dicom_pattern, mhd_pattern, voxel, lazy)
+
+    return _identified(loaded, voxel, key if identity else None)
+
+
+def _identified(loaded, voxel, key):
+    # the loaded series followed by its identity, if it is requested
+    if key is None:
+        return loaded
+
+    return (loaded if voxel else [loaded]) + [key]
+
+
+def _find_series(path, record=None):
+    if record is not None:
+        if record['format'] == 'dicom':
+            return record['files'], None
+        return [], record['files'][0]
+
     dicom_pattern = os.path.join(path, '*.dcm')
     dicom_pattern = glob.glob(dicom_pattern)
     mhd_pattern = os.path.join(path, '*.mhd')
     mhd_pattern = [path] + glob.glob(mhd_pattern)
     mhd_pattern = next(filter(lambda x: x[-4:].lower() == '.mhd', mhd_pattern), None)
 
-    if dicom_pattern:
-        meta = load_dicom(path, voxel=voxel)
-    elif mhd_pattern:
-        meta = load_metaimage(mhd_pattern, voxel=voxel)
-    else:
+    if not dicom_pattern and not mhd_pattern:
         message = "Neither path {} nor {} contain any .mhd or .dcm files"
-        raise ValueError(message.format(dicom_pattern, mhd_pattern))
+        raise SeriesNotFoundException(message.format(dicom_pattern, mhd_pattern))
 
-    return meta
+    return dicom_pattern, mhd_pattern
+
+
+def _series_files(dicom_pattern, mhd_pattern):
+    if dicom_pattern:
+        return dicom_pattern
+
+    # the .mhd header along with its .raw/.zraw data file
+    return glob.glob(os.path.splitext(mhd_pattern)[0] + '.*')
+
+
+def series_identity(path):
+    """
+    Identify the CT series stored at a path without reading it.
+
+    Args:
+        path (str): a path accepted by `load_ct`.
+
+    Returns:
+        str: a key which changes whenever any file of the series is added, removed or modified.
+    """
+    if volume_store.is_stored(path):
+        return ct_cache.series_key(volume_store.stored_files(path))
+
+    return ct_cache.series_key(_series_files(*_find_series(path)))
+
+
+def _load_uncached(path, dicom_pattern, mhd_pattern, voxel, lazy=False):
+    if dicom_pattern:
+        return load_dicom(path, voxel=voxel, lazy=lazy, files=dicom_pattern)
+
+    return load_metaimage(mhd_pattern, voxel=voxel)
+
+
+def _load_cached(key, path, dicom_pattern, mhd_pattern, voxel, lazy=False):
+    cached = ct_cache.get(key, voxel=voxel)
+
+    if cached is not None:
+        if not voxel:
+            return MetaData(cached)
+        return [cached[0], MetaData(cached[1])]
+
+    if not voxel:
+        # A cache entry requires the voxel data, hence nothing is stored here
+        return MetaData(_load_uncached(path, dicom_pattern, mhd_pattern, voxel))
+
+    if lazy:
+        # Storing an entry would decode the whole series, which is what lazy loading avoids
+        voxel_data, meta = _load_uncached(path, dicom_pattern, mhd_pattern, voxel, lazy)
+        return [voxel_data, MetaData(meta)]
+
+    voxel_data, meta = _load_uncached(path, dicom_pattern, mhd_pattern, voxel)
+    meta = MetaData(meta)
+    ct_cache.put(key, voxel_data, meta.to_dict())
+    return [voxel_data, meta]
+
+
+def to_hu(voxel_data, slopes, intercepts, padding=None):
+    """
+    Convert the voxels' values into Hounsfield units with the rescaling of every slice.
+
+    The values of a slice become `int16(slope * value) + int16(intercept)`.
+    The slopes are applied in float64 slab by slab, unless all of them are 1,
+    in which case the intercepts are merely added in the voxels' data-type.
+
+    Args:
+        voxel_data (np.ndarray): the voxels in (z, y, x) order, modified in place if possible.
+        slopes (sequence[float]): the rescale slope of every slice.
+        intercepts (sequence[float]): the rescale intercept of every slice.
+        padding: the value of the voxels outside of the scanned area, which are set to 0.
+            If None is set (default), then no voxels will be replaced.
+
+    Returns:
+        np.ndarray: the voxels in Hounsfield units, int16 if any slope isn't 1.
+    """
+    if padding is not None:
+        voxel_data[voxel_data == padding] = 0
+
+    axes = (-1,) + (1,) * (voxel_data.ndim - 1)
+    slopes = np.asarray(slopes, dtype=np.float64).reshape(axes)
+    intercepts = np.asarray(intercepts, dtype=np.float64).astype(np.int16).reshape(axes)
+
+    if (slopes != 1).any():
+        result = voxel_data if voxel_data.dtype == np.int16 else np.empty(voxel_data.shape, dtype=np.int16)
+        depth = Config.PREPROCESS_SLAB_DEPTH
+
+        for start in range(0, len(voxel_data), depth):
+            stop = start + depth
+            # truncated into int16, just like `astype`
+            result[start:stop] = np.multiply(slopes[start:stop], voxel_data[start:stop], dtype=np.float64)
+
+        voxel_data = result
+
+    voxel_data += intercepts
+    return voxel_data
 
 
 class MetaData:
@@ -127,15 +513,21 @@ class MetaData:
 
 
     Args:
-        meta (list[dicom.dataset.FileDataset] | SimpleITK.SimpleITK.Image): CT's meta information
-            from one of the primary formats.
+        meta (list[dicom.dataset.FileDataset] | SimpleITK.SimpleITK.Image | dict): CT's meta information
+            from one of the primary formats, or as serialized by `MetaData.to_dict`.
 
     Attributes:
-        meta (list[dicom.dataset.FileDataset] | SimpleITK.SimpleITK.Image): preserved CT's meta information
+        meta (list[dicom.dataset.FileDataset] | SimpleITK.SimpleITK.Image | dict): preserved CT's meta information
             in original format.
         origin (list[float]): the origin of the CT scan in mm.
         spacing (list[float]): voxel size along the axes in mm,
             might be changed by some spatial deformation such as re-sampling.
+        slope (float): the rescale slope of the first slice.
+        intercept (float): the rescale intercept of the first slice.
+        slopes (list[float]): the rescale slope of every slice in the order of the voxel data,
+            None if the slope of the first slice applies to all of them.
+        intercepts (list[float]): the rescale intercept of every slice in the order of the voxel data,
+            None if the intercept of the first slice applies to all of them.
 
     Returns:
         preprocess.load_dicom.MetaData
@@ -154,6 +546,17 @@ class MetaData:
     def extract_intercept_dcm(self):
         return float(self.meta[0].RescaleIntercept)
 
+    def extract_rescale_dcm(self):
+        try:
+            # the order in which the slices are stacked into the voxel data
+            datasets = sort_slices(self.meta)
+        except AttributeError:
+            datasets = self.meta
+
+        slopes = [float(getattr(dataset, 'RescaleSlope', 1)) for dataset in datasets]
+        intercepts = [float(getattr(dataset, 'RescaleIntercept', 0)) for dataset in datasets]
+        return slopes, intercepts
+
     def extract_spacing_mhd(self):
         # the default axes order which is used is: (z, y, x)
         return self.meta.GetSpacing()[::-1]
@@ -169,11 +572,60 @@ class MetaData:
         self.meta = meta_instance.meta
         self.spacing = meta_instance.spacing
         self.origin = meta_instance.origin
+        self.slope = meta_instance.slope
+        self.intercept = meta_instance.intercept
+        self.slopes = meta_instance.slopes
+        self.intercepts = meta_instance.intercepts
+
+    def dict_constructor(self, meta_dict):
+        self.spacing = meta_dict['spacing']
+        self.origin = meta_dict['origin']
+        self.slope = meta_dict['slope']
+        self.intercept = meta_dict['intercept']
+        self.slopes = meta_dict.get('slopes')
+        self.intercepts = meta_dict.get('intercepts')
+
+    def to_dict(self):
+        """
+        Serialize the standardised meta information into JSON compatible types.
+
+        Returns:
+            dict: spacing, origin, slope and intercept of the CT, along with the slopes
+                and intercepts of the slices if they vary.
+        """
+        meta = {'spacing': [float(axis) for axis in self.spacing],
+                'origin': [float(axis) for axis in self.origin],
+                'slope': float(self.slope),
+                'intercept': float(self.intercept)}
+
+        if self.slopes is not None and len(set(zip(self.slopes, self.intercepts))) > 1:
+            meta['slopes'] = [float(slope) for slope in self.slopes]
+            meta['intercepts'] = [float(intercept) for intercept in self.intercepts]
+
+        return meta
+
+    def rescale_vectors(self, depth):
+        """
+        The rescale slope and intercept of every slice.
+
+        Args:
+            depth (int): the number of slices of the voxel data.
+
+        Returns:
+            np.ndarray[float], np.ndarray[float]: the slopes and the intercepts. Unless the meta data
+                describe exactly `depth` slices, the ones of the first slice are repeated.
+        """
+        if self.slopes is not None and len(self.slopes) == depth:
+            return np.asarray(self.slopes, dtype=np.float64), np.asarray(self.intercepts, dtype=np.float64)
+
+        return np.full(depth, self.slope, dtype=np.float64), np.full(depth, self.intercept, dtype=np.float64)
 
     def __init__(self, meta):
         self.meta = meta
         self.spacing = None
         self.origin = None
+        self.slopes = None
+        self.intercepts = None
 
         dicom_meta = False
 
@@ -188,6 +640,7 @@ class MetaData:
             self.origin = self.extract_origin_dicom()
             self.slope = self.extract_slope_dcm()
             self.intercept = self.extract_intercept_dcm()
+            self.slopes, self.intercepts = self.extract_rescale_dcm()
         elif mhd_meta:
             # list of methods for MetaImage meta
             self.spacing = self.extract_spacing_mhd()
@@ -198,5 +651,7 @@ class MetaData:
 
         elif isinstance(self.meta, MetaData):
             self.non_copy_constructor(meta)
+        elif isinstance(self.meta, dict):
+            self.dict_constructor(meta)
         else:
             raise ValueError('The meta should be either list[dicom.dataset.FileDataset] or SimpleITK.SimpleITK.Image')
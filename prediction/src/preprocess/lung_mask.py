@@ -0,0 +1,140 @@
+"""
+Lung masks of CT series shared between the algorithms.
+
+A mask is computed once per series, method and spacing by `get_lung_mask` and,
+if `Config.LUNG_MASK_CACHE_ENABLED` is set, kept in a persistent on-disk cache,
+bit-packed to one bit per voxel. The cache is managed by `src.preprocess.ct_cache`
+in its own directory, so it is bounded in size and evicts the least recently
+used masks first.
+"""
+
+import functools
+import hashlib
+import json
+
+import numpy as np
+
+from config import Config
+from . import ct_cache, load_ct, resample
+from .extract_lungs import extract_lungs, extract_lungs_coarse
+
+
+def _extract_lungs(voxel_data, spacing, workers, factor=1):
+    # the 3D mask of `extract_lungs`, computed coarse-to-fine if `factor` is greater than 1
+    if factor > 1:
+        return extract_lungs_coarse(voxel_data, spacing, factor=factor, workers=workers)
+
+    return extract_lungs(voxel_data, spacing, workers=workers)
+
+
+def _per_slice(voxel_data, spacing, workers):
+    # the 2D masks of the slices by `get_segmented_lungs`, as used by the nodule detection of Julian de Wit
+    from .lung_segmentation import segment_slices
+
+    return segment_slices(voxel_data, workers=workers)
+
+
+# the methods computing the masks, called with the voxel data in HU, the spacing and the number of processes
+METHODS = {
+    'extract_lungs': _extract_lungs,
+    'extract_lungs_coarse2': functools.partial(_extract_lungs, factor=2),
+    'extract_lungs_coarse3': functools.partial(_extract_lungs, factor=3),
+    'extract_lungs_coarse4': functools.partial(_extract_lungs, factor=4),
+    'per_slice': _per_slice,
+}
+
+
+def mask_key(identity, method, spacing=None, derivation=None):
+    """
+    Compute the cache key of a lung mask.
+
+    Args:
+        identity (str): the identity of the series, see `src.preprocess.load_ct.series_identity`.
+        method (str): the key of the method in `METHODS`.
+        spacing (sequence[float]): the spacing the mask is computed at, None for the native one.
+        derivation (str): how the voxel data the mask is computed from were derived from the series,
+            besides re-sampling them to `spacing`. None if they were not.
+
+    Returns:
+        str: hex digest of the series identity, the method, the spacing and the derivation.
+    """
+    if spacing is not None:
+        spacing = ['{:.6g}'.format(axis) for axis in spacing]
+
+    return hashlib.sha1(json.dumps([identity, method, spacing, derivation]).encode()).hexdigest()
+
+
+def _load(ct_path, spacing):
+    # the voxel data of a series in HU, re-sampled to `spacing` if it is given
+    voxel_data, meta = load_ct.load_ct(ct_path)
+    voxel_data = np.asarray(voxel_data)
+    native = load_ct.MetaData(meta).spacing
+
+    if spacing is None:
+        return voxel_data, native
+
+    zoom = [float(axis) / target for axis, target in zip(native, spacing)]
+    return resample.resample(voxel_data, zoom, order=1), spacing
+
+
+def get_lung_mask(ct_path, method='extract_lungs', spacing=None, voxel_data=None, identity=None, derivation=None,
+                  workers=None, cache=None, cache_dir=None, max_bytes=None):
+    """
+    Return the lung mask of a CT series, computed on a cache miss.
+
+    Args:
+        ct_path (str): a path accepted by `src.preprocess.load_ct.load_ct`.
+        method (str): the key of the method in `METHODS`.
+        spacing (sequence[float]): the spacing in mm along the (z, y, x) axes the mask is computed at.
+            The series is re-sampled to it if it is loaded, its native spacing is used if None is set.
+        voxel_data (np.ndarray): the voxel data of `ct_path` in HU at `spacing`, if already at hand,
+            so that the series is not loaded again. It is not altered.
+        identity (str): the identity of `ct_path`, e.g. as returned by `load_ct(identity=True)`.
+            If None is set (default), then it will be computed by `load_ct.series_identity` on a lookup.
+        derivation (str): how `voxel_data` was derived from the series besides re-sampling it
+            to `spacing`, e.g. rotated, see `mask_key`.
+        workers (int): the number of processes of the method, None for its default.
+        cache (bool): whether to look up and store the mask in the cache. If None is set (default),
+            then `Config.LUNG_MASK_CACHE_ENABLED` will be used.
+        cache_dir (str): the cache directory. If None is set (default),
+            then `Config.LUNG_MASK_CACHE_DIR` will be used.
+        max_bytes (int): the size limit of the cache. If None is set (default),
+            then `Config.LUNG_MASK_CACHE_MAX_BYTES` will be used.
+
+    Returns:
+        np.ndarray[bool]: the lung mask in (z, y, x) order.
+    """
+    if method not in METHODS:
+        raise ValueError('Unknown lung mask method {!r}, expected one of {}'.format(method, sorted(METHODS)))
+
+    if voxel_data is not None and spacing is None:
+        raise ValueError('The spacing of voxel_data is required')
+
+    if cache is None:
+        cache = Config.LUNG_MASK_CACHE_ENABLED
+
+    if cache_dir is None:
+        cache_dir = Config.LUNG_MASK_CACHE_DIR
+
+    if max_bytes is None:
+        max_bytes = Config.LUNG_MASK_CACHE_MAX_BYTES
+
+    key = None
+    if cache:
+        key = mask_key(identity or load_ct.series_identity(ct_path), method, spacing, derivation)
+        cached = ct_cache.get(key, cache_dir=cache_dir)
+        if cached is not None:
+            packed, meta = cached
+            shape = tuple(meta['shape'])
+            return np.unpackbits(packed)[:int(np.prod(shape))].reshape(shape).view(np.bool_)
+
+    if voxel_data is None:
+        voxel_data, spacing = _load(ct_path, spacing)
+
+    mask = np.asarray(METHODS[method](np.asarray(voxel_data), np.array(spacing, dtype=float), workers), dtype=np.bool_)
+
+    if cache:
+        meta = {'method': method, 'spacing': [float(axis) for axis in spacing], 'shape': list(mask.shape)}
+        ct_cache.put(key, np.packbits(mask), meta, cache_dir=cache_dir, max_bytes=max_bytes)
+
+    return mask
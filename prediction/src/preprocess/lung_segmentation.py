@@ -2,6 +2,7 @@ import logging
 import math
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import cv2
 import dicom
@@ -9,10 +10,13 @@ import numpy
 import scipy
 from dicom.errors import InvalidDicomError
 from skimage.filters import roberts
-from skimage.measure import label, regionprops
+from skimage.measure import label
 from skimage.morphology import disk, binary_erosion, binary_closing
 from skimage.segmentation import clear_border
 
+from . import lung_mask, resample
+from .load_ct import parallel_read, to_hu
+
 try:
     from ...config import Config
 except ValueError:
@@ -23,6 +27,9 @@ except ValueError:
 # (282 + 66) / 0.9 = 386 voxels. Therefore, 512 voxels for z-axis should be enough for all cases.
 DATA_SHAPE = (512, 512, 512, 1)
 
+# the uint8 volumes written by save_lung_segments into the directory of a patient
+SEGMENTS_FILES = {'images': 'images.npy', 'masks': 'masks.npy'}
+
 
 def get_z_range(dicom_path):
     """
@@ -45,14 +52,123 @@ def get_z_range(dicom_path):
     return min_z, max_z
 
 
-def save_lung_segments(dicom_path, patient_id):
+def lung_segments_path(patient_id, kind, base_dir=None):
+    """
+    The path of a volume written by `save_lung_segments`.
+
+    Args:
+        patient_id (str): SeriesInstanceUID of the patient.
+        kind (str): 'images' or 'masks'.
+        base_dir (str): the directory of the patients. If None is set (default),
+            then `Config.EXTRACTED_IMAGE_DIR` will be used.
+
+    Returns:
+        str
+    """
+    return os.path.join(base_dir or Config.EXTRACTED_IMAGE_DIR, patient_id, SEGMENTS_FILES[kind])
+
+
+def load_lung_segments(patient_id, kind, base_dir=None):
+    """
+    Memory-map a volume written by `save_lung_segments`.
+
+    Args:
+        patient_id (str): SeriesInstanceUID of the patient.
+        kind (str): 'images' or 'masks'.
+        base_dir (str): the directory of the patients. If None is set (default),
+            then `Config.EXTRACTED_IMAGE_DIR` will be used.
+
+    Returns:
+        numpy.memmap | None: the read-only uint8 volume in (z, y, x) order, None if it does not exist.
+    """
+    path = lung_segments_path(patient_id, kind, base_dir)
+    if not os.path.isfile(path):
+        return None
+
+    return numpy.load(path, mmap_mode='r')
+
+
+def _to_uint8(image):
+    # the conversion of cv2.imwrite, rounding half to even and saturating
+    return numpy.clip(numpy.rint(image), 0, 255).astype(numpy.uint8)
+
+
+def _segment_chunk(images):
+    # the masks of consecutive slices, run by the processes of segment_slices
+    masks = numpy.zeros(images.shape, dtype=bool)
+    for index, image in enumerate(images):
+        masks[index] = get_segmented_lungs(image.copy())[1]
+
+    return masks
+
+
+def segment_slices(images, workers=None):
+    """
+    Segment the lungs of every slice of a volume by `get_segmented_lungs`.
+
+    Args:
+        images (np.ndarray): the slices in (z, y, x) order and in Hounsfield units. They are not altered.
+        workers (int): the number of processes segmenting the slices, the slices are segmented in the current
+            process if less than 2. If None is set (default), then `Config.LUNG_SEGMENTS_WORKERS` will be used.
+
+    Returns:
+        np.ndarray[bool]: the masks in (z, y, x) order.
+    """
+    if workers is None:
+        workers = Config.LUNG_SEGMENTS_WORKERS
+
+    if workers < 2 or len(images) < 2:
+        return _segment_chunk(images)
+
+    # a few chunks of slices per process balance the load
+    bounds = numpy.linspace(0, len(images), min(len(images), workers * 4) + 1).astype(int)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        chunks = executor.map(_segment_chunk, [images[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])
+                                               if stop > start])
+        return numpy.concatenate(list(chunks))
+
+
+def _write_segments(images, masks, target_dir, png=False):
+    """
+    Write slices and their lung masks into the volumes of `target_dir`.
+
+    Args:
+        images (np.ndarray): the slices in (z, y, x) order and in Hounsfield units.
+        masks (np.ndarray[bool]): the lung masks of the slices.
+        target_dir (str): the directory of the volumes, also the prefix of the paths of the PNG images.
+        png (bool): whether to also write every slice and mask as PNG images.
+    """
+    volumes = {kind: numpy.lib.format.open_memmap(os.path.join(target_dir, name), mode='w+', dtype=numpy.uint8,
+                                                  shape=images.shape)
+               for kind, name in SEGMENTS_FILES.items()}
+
+    for index, (org_img, mask) in enumerate(zip(images, masks)):
+        org_img = normalize_hu(org_img)
+        volumes['images'][index] = _to_uint8(org_img * 255)
+        volumes['masks'][index] = _to_uint8(mask * 255)
+
+        if png:
+            img_path = '{}img_{}_i.png'.format(target_dir, str(index).rjust(4, '0'))
+            cv2.imwrite(img_path, org_img * 255)
+            cv2.imwrite(img_path.replace("_i.png", "_m.png"), mask * 255)
+
+    for volume in volumes.values():
+        volume.flush()
+
+
+def save_lung_segments(dicom_path, patient_id, workers=None, png=None):
     """
     Write the converted scan images and related lung masks to
-    EXTRACTED_IMAGE_DIR.
+    EXTRACTED_IMAGE_DIR, as one uint8 volume each, see `load_lung_segments`.
+    The masks are provided by `src.preprocess.lung_mask.get_lung_mask`.
 
     Args:
         dicom_path: a path to a DICOM directory
         patient_id: SeriesInstanceUID of the patient
+        workers: the number of processes segmenting the slices, the slices are segmented in the current process
+            if less than 2. If None is set (default), then `Config.LUNG_SEGMENTS_WORKERS` will be used.
+        png: whether to also write every slice and mask as PNG images, for debugging. If None is set (default),
+            then `Config.LUNG_SEGMENTS_PNG` will be used.
 
     Returns:
         Original patient images (z, x, y),
@@ -77,18 +193,19 @@ def save_lung_segments(dicom_path, patient_id):
     if not invert_order:
         image = numpy.flipud(image)
 
-    for index, org_img in enumerate(image):
-        patient_dir = target_dir
-        os.makedirs(patient_dir, exist_ok=True)
-        img_path = '{}img_{}_i.png'.format(patient_dir, str(index).rjust(4, '0'))
-        # if there exists slope,rotation image with corresponding degree
-        if cos_degree > 0.0:
-            org_img = cv_flip(org_img, org_img.shape[1], org_img.shape[0], cos_degree)
-        img, mask = get_segmented_lungs(org_img.copy())
-        org_img = normalize_hu(org_img)
-        cv2.imwrite(img_path, org_img * 255)
-        cv2.imwrite(img_path.replace("_i.png", "_m.png"), mask * 255)
+    if png is None:
+        png = Config.LUNG_SEGMENTS_PNG
 
+    # if there exists slope,rotation image with corresponding degree
+    rotated = image
+    if cos_degree > 0.0:
+        rotated = numpy.stack([cv_flip(img, img.shape[1], img.shape[0], cos_degree) for img in image])
+
+    # the slices are re-sampled by cv2 and may be rotated, unlike those of a series loaded by the provider
+    derivation = 'save_lung_segments, rotated by {}'.format(cos_degree)
+    masks = lung_mask.get_lung_mask(dicom_path, 'per_slice', spacing=[TARGET_VOXEL_MM] * 3, voxel_data=rotated,
+                                    derivation=derivation, workers=workers)
+    _write_segments(rotated, masks, target_dir, png)
     return original_image, image
 
 
@@ -102,15 +219,14 @@ def load_patient(src_dir):
     Returns:
         Array of dicom.dataset.FileDataset
     """
-    slices = []
-
-    for s in os.listdir(src_dir):
+    def read_slice(path):
         try:
-            dicom_slice = dicom.read_file(os.path.join(src_dir, s))
+            return dicom.read_file(path)
         except InvalidDicomError:
-            logging.error("{} is no valid DICOM".format(s))
-        else:
-            slices.append(dicom_slice)
+            logging.error("{} is no valid DICOM".format(os.path.basename(path)))
+
+    paths = [os.path.join(src_dir, s) for s in os.listdir(src_dir)]
+    slices = [s for s in parallel_read(read_slice, paths) if s is not None]
     slices.sort(key=lambda x: int(x.InstanceNumber))
 
     try:
@@ -125,21 +241,22 @@ def load_patient(src_dir):
 
 
 def get_pixels_hu(slices):
-    image = numpy.stack([s.pixel_array for s in slices])
-    image = image.astype(numpy.int16)
-    image[image == -2000] = 0
-
-    for slice_number in range(len(slices)):
-        intercept = slices[slice_number].RescaleIntercept
-        slope = slices[slice_number].RescaleSlope
+    """
+    Stack the slices of a patient into an int16 volume in Hounsfield units.
 
-        if slope != 1:
-            image[slice_number] = slope * image[slice_number].astype(numpy.float64)
-            image[slice_number] = image[slice_number].astype(numpy.int16)
+    Args:
+        slices (list[dicom.dataset.FileDataset]): the slices in the order of the volume.
 
-        image[slice_number] += numpy.int16(intercept)
+    Returns:
+        numpy.ndarray: the volume in (z, y, x) order.
+    """
+    image = numpy.empty((len(slices),) + slices[0].pixel_array.shape, dtype=numpy.int16)
+    for slice_number, s in enumerate(slices):
+        image[slice_number] = s.pixel_array
 
-    return numpy.array(image, dtype=numpy.int16)
+    slopes = [s.RescaleSlope for s in slices]
+    intercepts = [s.RescaleIntercept for s in slices]
+    return to_hu(image, slopes, intercepts, padding=-2000)
 
 
 def normalize_hu(image):
@@ -168,17 +285,15 @@ def get_segmented_lungs(im):
     cleared = clear_border(binary)
     # Step 3: Label the image.
     label_image = label(cleared)
-    # Step 4: Keep the labels with 2 largest areas.
-    areas = [r.area for r in regionprops(label_image)]
-    areas.sort()
+    # Step 4: Keep the labels with 2 largest areas, through a lookup table of the labels.
+    areas = numpy.bincount(label_image.ravel())
+    keep = numpy.ones(len(areas), dtype=bool)
+    keep[0] = False
 
-    if len(areas) > 2:
-        for region in regionprops(label_image):
-            if region.area < areas[-2]:
-                for coordinates in region.coords:
-                    label_image[coordinates[0], coordinates[1]] = 0
+    if len(areas) > 3:
+        keep[areas < numpy.sort(areas[1:])[-2]] = False
 
-    binary = label_image > 0
+    binary = keep[label_image]
     # Step 5: Erosion operation with a disk of radius 2.
     # This operation is seperate the lung nodules attached to the blood vessels.
     selem = disk(2)
@@ -203,34 +318,20 @@ def cv_flip(img, cols, rows, degree):
 
 
 def rescale_patient_images(images_zyx, org_spacing_xyz, target_voxel_mm, is_mask_image=False):
-    resize_x = 1.0
-    resize_y = org_spacing_xyz[2] / target_voxel_mm
-    interpolation = cv2.INTER_NEAREST if is_mask_image else cv2.INTER_LINEAR
-    res = cv2.resize(images_zyx, dsize=None, fx=resize_x, fy=resize_y,
-                     interpolation=interpolation)  # opencv assumes y, x, channels umpy array, so y = z pfff
-
-    res = res.swapaxes(0, 2)
-    res = res.swapaxes(0, 1)
-
-    resize_x = org_spacing_xyz[0] / target_voxel_mm
-    resize_y = org_spacing_xyz[1] / target_voxel_mm
-
-    # cv2 can handle max 512 channels..
-    if res.shape[2] > 512:
-        res = res.swapaxes(0, 2)
-        res1 = res[:256]
-        res2 = res[256:]
-        res1 = res1.swapaxes(0, 2)
-        res2 = res2.swapaxes(0, 2)
-        res1 = cv2.resize(res1, dsize=None, fx=resize_x, fy=resize_y, interpolation=interpolation)
-        res2 = cv2.resize(res2, dsize=None, fx=resize_x, fy=resize_y, interpolation=interpolation)
-        res1 = res1.swapaxes(0, 2)
-        res2 = res2.swapaxes(0, 2)
-        res = numpy.vstack([res1, res2])
-        res = res.swapaxes(0, 2)
-    else:
-        res = cv2.resize(res, dsize=None, fx=resize_x, fy=resize_y, interpolation=interpolation)
-
-    res = res.swapaxes(0, 2)
-    res = res.swapaxes(2, 1)
-    return res
+    """
+    Re-sample a CT volume or a mask to isotropic voxels.
+
+    Args:
+        images_zyx (np.ndarray): the volume in (z, y, x) order.
+        org_spacing_xyz (sequence[float]): the spacing of the volume in (x, y, z) order.
+        target_voxel_mm (float): the desired spacing along all the axes.
+        is_mask_image (bool): whether the volume is a mask, which is re-sampled by the nearest voxel.
+
+    Returns:
+        np.ndarray: the re-sampled volume in (z, y, x) order.
+    """
+    zoom = [org_spacing_xyz[axis] / target_voxel_mm for axis in (2, 1, 0)]
+    if is_mask_image:
+        return resample.resample(images_zyx, zoom, order=0, backend='nearest')
+
+    return resample.resample(images_zyx, zoom, order=1, backend='cv2')
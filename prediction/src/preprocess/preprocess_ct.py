@@ -1,9 +1,10 @@
-import warnings
+import threading
+from collections import OrderedDict
 
 import numpy as np
-import scipy.ndimage
 
-from . import load_ct
+from config import Config
+from . import load_ct, resample
 
 
 class Params:
@@ -31,13 +32,20 @@ class Params:
             If None is set (default), then no scaling will applied.
         dtype (str): the desired data-type of a returned array. Should be a valid key from `np.typeDict`
             If None is set (default), then no casting will applied.
+        to_hu (bool): whether to convert the voxels' values into Hounsfield units. The default value is False.
+        fused (bool): whether to perform to_hu, clipping, normalization, scaling and casting
+            in one pass over z-slabs with float32 intermediates. The default value is False.
+        workers (int): the number of threads used by re-sampling.
+            If None is set (default), then `Config.PREPROCESS_WORKERS` will be used.
+        backend (str): the re-sampling backend, a key from `resample.BACKENDS`. The default value is 'scipy'.
 
     Returns:
         preprocess.preprocess_dicom.Params
     """
 
     def __init__(self, clip_lower=None, clip_upper=None, spacing=False, order=0,  # noqa: C901
-                 ndim=3, min_max_normalize=False, scale=None, dtype=None, to_hu=False):
+                 ndim=3, min_max_normalize=False, scale=None, dtype=None, to_hu=False, fused=False, workers=None,
+                 backend='scipy'):
         if not isinstance(clip_lower, (int, float)) and (clip_lower is not None):
             raise TypeError('The clip_lower should be int or float')
         if not isinstance(clip_upper, (int, float)) and (clip_upper is not None):
@@ -76,6 +84,35 @@ class Params:
             raise TypeError('The to_hu should be bool or int')
         self.to_hu = to_hu
 
+        if not isinstance(fused, (bool, int)):
+            raise TypeError('The fused should be bool or int')
+        self.fused = fused
+
+        if not isinstance(workers, int) and (workers is not None):
+            raise TypeError('The workers should be int')
+        if (workers is not None) and workers < 1:
+            raise ValueError('The workers should be greater than 0')
+        self.workers = workers
+
+        if backend not in resample.BACKENDS:
+            raise ValueError('The backend should be a valid key from `resample.BACKENDS`')
+        self.backend = backend
+
+    def key(self):
+        """
+        Hashable representation of the parameters.
+
+        Returns:
+            tuple: equal for any two instances which pre-process a CT identically.
+                The number of `workers` does not change the result, hence is left out.
+        """
+        spacing = self.spacing
+        if isinstance(spacing, (list, tuple, np.ndarray)):
+            spacing = tuple(np.asarray(spacing).tolist())
+
+        return (self.clip_lower, self.clip_upper, spacing, self.order, self.ndim,
+                self.min_max_normalize, self.scale, self.dtype, self.to_hu, self.fused, self.backend)
+
 
 class PreprocessCT(Params):
     """
@@ -102,6 +139,12 @@ class PreprocessCT(Params):
             If None is set (default), then no scaling will applied.
         dtype (str): the desired data-type of a returned array. Should be from `np.typeDict.keys()`
             If None is set (default), then no casting will applied.
+        fused (bool): whether to perform the voxel-wise steps in a single pass over z-slabs
+            with float32 intermediates, see `PreprocessCT._fused_intensity`.
+        workers (int): the number of threads used by re-sampling, see `preprocess.resample.zoom`.
+            If None is set (default), then `Config.PREPROCESS_WORKERS` will be used.
+        backend (str): the re-sampling backend, see `preprocess.resample.resample`.
+            The default value is 'scipy'.
 
     Returns:
         preprocess.preprocess_dicom.PreprocessCT
@@ -110,18 +153,137 @@ class PreprocessCT(Params):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def __call__(self, voxel_data, meta):  # noqa: C901
+    def __call__(self, voxel_data, meta):
         if not isinstance(meta, load_ct.MetaData):
             meta = load_ct.MetaData(meta)
 
-        if self.to_hu:
-            voxel_data[voxel_data == voxel_data[0, 0, 0]] = 0
+        if not isinstance(voxel_data, np.ndarray):
+            # e.g. a LazyVolume, the whole volume is required from here on
+            voxel_data = np.asarray(voxel_data)
+
+        # the rescaling of every slice
+        hu = meta.rescale_vectors(len(voxel_data)) if self.to_hu else None
+
+        if self.fused:
+            voxel_data = self._fused_intensity(voxel_data, hu)
+        else:
+            voxel_data = self._intensity(voxel_data, hu)
+
+        # `spacing` is the shape of a voxel in real-world units
+        if self.spacing:
+            zoom_fctr = meta.spacing / np.asarray(self.spacing)
+            voxel_data = resample.resample(voxel_data, zoom_fctr, order=self.order, backend=self.backend,
+                                           workers=self.workers)
+
+        # No more need to store the redundant spacing in `meta`
+        meta.spacing = self.spacing
+
+        if self.dtype:
+            voxel_data = voxel_data.astype(dtype=self.dtype, copy=False)
 
-            if meta.slope != 1:
-                voxel_data = meta.slope * voxel_data.astype(np.float64)
-                voxel_data = voxel_data.astype(np.int16)
+        return voxel_data, meta
+
+    def stream(self, volume, meta, out=None, max_bytes=None):
+        """
+        Pre-process a CT scan window by window of z-slices within a bounded amount of memory.
+
+        The volume is read as consecutive windows of slices, each of which is
+        pre-processed on its own, re-sampled into the respective output slices
+        and written to `out`, so that neither the input nor any intermediate is
+        held as a whole. The windows of the re-sampling overlap by a halo of
+        slices. Min-max normalization without both clip bounds needs an
+        additional pass over the volume. The result is identical to
+        `PreprocessCT.__call__`, but only the orders 0 and 1 of the 'scipy'
+        backend can be streamed.
+
+        Args:
+            volume (np.ndarray | src.preprocess.lazy_volume.SlicedVolume): the CT voxels
+                in (z, y, x) order, e.g. as returned by `load_ct(..., lazy=True)`. It isn't modified.
+            meta (src.preprocess.load_ct.MetaData): meta information of the CT scan.
+            out (np.ndarray | str): the preallocated array of the output shape to write into,
+                or the path of a .npy file to create as a memory-mapped output.
+                If None is set (default), then a new array will be allocated.
+            max_bytes (int): the approximate ceiling of the working memory, besides `out`.
+                If None is set (default), then `Config.PREPROCESS_STREAM_MAX_BYTES` will be used.
+
+        Returns:
+            np.ndarray: the pre-processed CT voxels, `out` if it was an array.
+            src.preprocess.load_ct.MetaData: the updated meta information.
+        """
+        if not isinstance(meta, load_ct.MetaData):
+            meta = load_ct.MetaData(meta)
 
-            voxel_data += np.int16(meta.intercept)
+        if max_bytes is None:
+            max_bytes = Config.PREPROCESS_STREAM_MAX_BYTES
+
+        if self.spacing and (self.order > 1 or self.backend != 'scipy'):
+            raise ValueError('Only the orders 0 and 1 of the scipy backend can be streamed')
+
+        shape = tuple(volume.shape)
+        output_shape = shape
+        if self.spacing:
+            zoom_fctr = meta.spacing / np.asarray(self.spacing)
+            output_shape = resample.zoom_output_shape(shape, zoom_fctr)
+            factors = resample.zoom_factors(shape, output_shape)
+
+        depth = self._stream_depth(shape, output_shape, max_bytes)
+        corner = _read_window(volume, 0, 1)[0, 0, 0] if self.to_hu else None
+        hu = meta.rescale_vectors(shape[0]) if self.to_hu else None
+        bounds = self._stream_bounds(volume, hu, corner, depth) if self.min_max_normalize else None
+        intensity = self._fused_intensity if self.fused else self._intensity
+
+        for start in range(0, output_shape[0], depth):
+            stop = min(start + depth, output_shape[0])
+            first, last = start, stop
+            if self.spacing:
+                first, last = resample.window_bounds(start, stop, factors[0], shape[0])
+
+            slab = intensity(_read_window(volume, first, last), _hu_window(hu, first, last), corner=corner,
+                             bounds=bounds)
+            if self.spacing:
+                window, slab = slab, np.empty((stop - start,) + output_shape[1:], dtype=slab.dtype)
+                resample.zoom_window(window, first, factors, start, slab, order=self.order)
+                del window
+
+            if out is None or isinstance(out, str):
+                out = _allocate_output(out, output_shape, np.dtype(self.dtype) if self.dtype else slab.dtype)
+            out[start:stop] = slab
+
+        if isinstance(out, np.memmap):
+            out.flush()
+
+        # No more need to store the redundant spacing in `meta`
+        meta.spacing = self.spacing
+
+        return out, meta
+
+    def _stream_depth(self, shape, output_shape, max_bytes):
+        # the number of output slices per window: each of them takes coordinates, interpolated and cast voxels
+        # of 40 bytes each, along with its share of raw and pre-processed input slices of up to 16 bytes a voxel
+        input_slice = 16 * int(np.prod(shape[1:]))
+        output_slice = 40 * int(np.prod(output_shape[1:])) + input_slice * shape[0] / max(output_shape[0], 1)
+        halo = 5 * input_slice
+        return max(int((max_bytes - halo) // output_slice), 1)
+
+    def _stream_bounds(self, volume, hu, corner, depth):
+        # the bounds of the min-max normalization of the whole volume, scanned window by window
+        starts = range(0, len(volume), depth)
+        windows = ((_read_window(volume, start, start + depth), _hu_window(hu, start, start + depth))
+                   for start in starts)
+
+        if self.fused:
+            return self._bounds(self._fused_slab(window, corner, window_hu, np.empty(window.shape, dtype=np.float32))
+                                for window, window_hu in windows)
+
+        return self._bounds(self._clip(window, window_hu, corner) for window, window_hu in windows)
+
+    def _clip(self, voxel_data, hu, corner=None):
+        # to_hu and clipping, `hu` holds the slopes and intercepts of the slices,
+        # `corner` is the padding value of the whole volume
+        if self.to_hu:
+            if corner is None:
+                corner = voxel_data[0, 0, 0]
+            voxel_data = load_ct.to_hu(voxel_data, *hu, padding=corner)
 
         # Instead of np.clip usage in order to avoid np.max | np.min calculation in case of None
         if self.clip_lower is not None:
@@ -129,54 +291,332 @@ class PreprocessCT(Params):
         if self.clip_upper is not None:
             voxel_data[voxel_data > self.clip_upper] = self.clip_upper
 
+        return voxel_data
+
+    def _intensity(self, voxel_data, hu, corner=None, bounds=None):
+        voxel_data = self._clip(voxel_data, hu, corner)
+
         if self.min_max_normalize:
-            data_max = self.clip_upper
-            data_min = self.clip_lower
-            if data_max is None:
-                data_max = voxel_data.max()
-            if data_min is None:
-                data_min = voxel_data.min()
+            if bounds is None:
+                bounds = self._bounds([voxel_data])
+            data_min, data_max = bounds
             voxel_data = (voxel_data - data_min) / float(data_max - data_min)
 
         if self.scale is not None:
             voxel_data *= self.scale
 
-        # `spacing` is the shape of a voxel in real-world units
-        if self.spacing:
-            zoom_fctr = meta.spacing / np.asarray(self.spacing)
-            with warnings.catch_warnings():
-                warnings.simplefilter("ignore")
-                voxel_data = scipy.ndimage.interpolation.zoom(voxel_data, zoom_fctr, order=self.order)
+        return voxel_data
 
-        # No more need to store the redundant spacing in `meta`
-        meta.spacing = self.spacing
+    def _fused_slab(self, slab, corner, hu, work):
+        # to_hu and clipping of a single slab, computed in the float32 `work` buffer
+        work[...] = slab
 
-        if self.dtype:
-            voxel_data = voxel_data.astype(dtype=self.dtype, copy=False)
+        if self.to_hu:
+            work[slab == corner] = 0
+            slopes, intercepts = hu
 
-        return voxel_data, meta
+            if (slopes != 1).any():
+                work *= slopes.astype(np.float32).reshape(-1, 1, 1)
+                np.trunc(work, out=work)
 
+            work += intercepts.astype(np.int16).reshape(-1, 1, 1)
 
-def mm_coordinates_to_voxel(coord, meta):
+        if self.clip_lower is not None:
+            np.maximum(work, self.clip_lower, out=work)
+        if self.clip_upper is not None:
+            np.minimum(work, self.clip_upper, out=work)
+
+        return work
+
+    def _bounds(self, slabs):
+        # the bounds of the min-max normalization, the clipped slabs are only scanned if a clip bound is missing
+        data_min, data_max = self.clip_lower, self.clip_upper
+        if data_min is not None and data_max is not None:
+            return data_min, data_max
+
+        minima, maxima = [], []
+        for slab in slabs:
+            if data_min is None:
+                minima.append(slab.min())
+            if data_max is None:
+                maxima.append(slab.max())
+
+        if data_min is None:
+            data_min = min(minima)
+        if data_max is None:
+            data_max = max(maxima)
+
+        return data_min, data_max
+
+    def _fused_bounds(self, voxel_data, corner, hu, work):
+        depth = len(work)
+        slabs = ((voxel_data[start:start + depth], _hu_window(hu, start, start + depth))
+                 for start in range(0, len(voxel_data), depth))
+        return self._bounds(self._fused_slab(slab, corner, slab_hu, work[:len(slab)]) for slab, slab_hu in slabs)
+
+    def _fused_intensity(self, voxel_data, hu, corner=None, bounds=None):
+        """
+        Perform to_hu, clipping, normalization, scaling and, unless re-sampling has to
+        happen in between, casting in a single pass over z-slabs.
+
+        The intermediates are float32 and only a slab-sized buffer is allocated besides
+        the result, which is written in place if the data-type allows it. The result is
+        identical to the unfused one for float32 input, otherwise it may differ by the
+        rounding error of float32.
+
+        Args:
+            voxel_data (np.ndarray): the CT voxels, modified in place if possible.
+            hu (tuple[np.ndarray]): the rescale slopes and intercepts of the slices, None unless `to_hu`.
+            corner: the padding value replaced by to_hu. If None is set (default),
+                then the first voxel of `voxel_data` will be used.
+            bounds (tuple): the bounds of the min-max normalization. If None is set (default),
+                then they will be computed from `voxel_data`.
+
+        Returns:
+            np.ndarray: the pre-processed CT voxels.
+        """
+        depth = Config.PREPROCESS_SLAB_DEPTH
+        if self.to_hu and corner is None:
+            corner = voxel_data[0, 0, 0]
+        work = np.empty((min(depth, len(voxel_data)),) + voxel_data.shape[1:], dtype=np.float32)
+
+        if self.min_max_normalize or self.scale is not None:
+            result_dtype = np.dtype(np.float32)
+        else:
+            result_dtype = voxel_data.dtype
+        if self.dtype and not self.spacing:
+            result_dtype = np.dtype(self.dtype)
+
+        if result_dtype == voxel_data.dtype and voxel_data.flags.writeable:
+            result = voxel_data
+        else:
+            result = np.empty(voxel_data.shape, dtype=result_dtype)
+
+        if self.min_max_normalize:
+            if bounds is None:
+                bounds = self._fused_bounds(voxel_data, corner, hu, work)
+            data_min, data_max = bounds
+
+        for start in range(0, len(voxel_data), depth):
+            slab = voxel_data[start:start + depth]
+            slab = self._fused_slab(slab, corner, _hu_window(hu, start, start + depth), work[:len(slab)])
+
+            if self.min_max_normalize:
+                slab -= data_min
+                slab /= float(data_max - data_min)
+
+            if self.scale is not None:
+                slab *= self.scale
+
+            result[start:start + len(slab)] = slab
+
+        return result
+
+
+def _hu_window(hu, start, stop):
+    # the rescale slopes and intercepts of the slices [start, stop)
+    if hu is None:
+        return None
+
+    return tuple(vector[start:stop] for vector in hu)
+
+
+def _read_window(volume, start, stop):
+    # a private copy of the slices [start, stop), which the pre-processing may modify in place
+    if isinstance(volume, np.ndarray):
+        return volume[start:stop].copy()
+
+    return np.asarray(volume[start:stop])
+
+
+def _allocate_output(path, shape, dtype):
+    # a new array, memory-mapped to a .npy file if a path is given
+    if path is None:
+        return np.empty(shape, dtype=dtype)
+
+    return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+
+class PreprocessedCache:
     """
-    Transfer coordinates in mm into voxel's location
+    Bounded, thread-safe, in-process memoization of pre-processed CT scans.
+
+    The least recently used entries are evicted once the cached arrays outgrow
+    the memory budget. Concurrent requests for the same key compute it once.
 
     Args:
-        coord (scalar | list[scalar]): coordinates in mm (real-world point).
+        max_bytes (int): the memory budget for the cached arrays.
+            If None is set (default), then `Config.PREPROCESSED_CACHE_MAX_BYTES` will be used.
+
+    Returns:
+        preprocess.preprocess_ct.PreprocessedCache
+    """
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = Config.PREPROCESSED_CACHE_MAX_BYTES
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, voxel_data, meta):
+        if voxel_data.nbytes > self.max_bytes or key in self._entries:
+            return
+
+        self._entries[key] = (voxel_data, meta)
+        self.nbytes += voxel_data.nbytes
+
+        while self.nbytes > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached entry for `key`, compute and cache it on a miss.
+
+        Args:
+            key (hashable): the cache key.
+            compute (callable): returns the (voxel_data, meta) pair to be cached.
+
+        Returns:
+            np.ndarray: the read-only pre-processed voxel data.
+            src.preprocess.load_ct.MetaData: a private copy of the meta information.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                # the lock of the key and the number of its waiters, shared until the last one leaves
+                pending = self._pending.setdefault(key, [threading.Lock(), 0])
+                pending[1] += 1
+
+        if entry is None:
+            try:
+                with pending[0]:
+                    # another waiter may have computed the entry meanwhile
+                    with self._lock:
+                        entry = self._lookup(key)
+
+                    if entry is None:
+                        voxel_data, meta = compute()
+                        # The array is shared between the callers, hence it must not be altered
+                        voxel_data.setflags(write=False)
+                        entry = (voxel_data, load_ct.MetaData(meta))
+
+                        with self._lock:
+                            self._store(key, *entry)
+            finally:
+                with self._lock:
+                    pending[1] -= 1
+                    if not pending[1]:
+                        del self._pending[key]
+
+        voxel_data, meta = entry
+        return voxel_data, load_ct.MetaData(meta)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+PREPROCESSED_CACHE = PreprocessedCache()
+
+
+def preprocess_series(ct_path, preprocess, voxel_data=None, meta=None, cache=None, identity=None):
+    """
+    Load and pre-process a CT series, memoized on the series identity and the
+    pre-processing parameters. So that the pre-processing is performed once per
+    series per process, even if several algorithms request it.
+
+    Args:
+        ct_path (str): a path accepted by `src.preprocess.load_ct.load_ct`.
+        preprocess (PreprocessCT): the pre-processing to apply.
+        voxel_data (np.ndarray): the already loaded voxel data of `ct_path`, if any.
+            It is modified in place by `preprocess` on a cache miss.
+        meta (list[dicom.dataset.FileDataset] | SimpleITK.SimpleITK.Image | MetaData):
+            the meta information accompanying `voxel_data`.
+        cache (PreprocessedCache): If None is set (default), then the process-wide cache is used.
+        identity (str): the `series_identity` of `ct_path`, e.g. as returned along with `voxel_data`
+            by `load_ct(identity=True)`. If None is set (default), then the series files will be listed.
+
+    Returns:
+        np.ndarray: the read-only pre-processed voxel data.
+        src.preprocess.load_ct.MetaData: meta information of the pre-processed CT scan.
+    """
+    if cache is None:
+        cache = PREPROCESSED_CACHE
+
+    def compute():
+        if voxel_data is None:
+            return preprocess(*load_ct.load_ct(ct_path))
+        return preprocess(voxel_data, meta)
+
+    if identity is None:
+        identity = load_ct.series_identity(ct_path)
+
+    key = (identity, preprocess.key())
+    return cache.get_or_compute(key, compute)
+
+
+def _axes_vectors(meta, ndim):
+    # the origin and spacing of the CT scan as vectors over `ndim` axes
+    origin = np.broadcast_to(np.asarray(meta.origin, dtype=np.float64), (ndim,))
+    spacing = np.broadcast_to(np.asarray(meta.spacing, dtype=np.float64), (ndim,))
+    return origin, spacing
+
+
+def mm_to_voxel(coords, meta):
+    """
+    Transfer coordinates in mm into voxels' locations, all the points at once.
+
+    Args:
+        coords (array_like): coordinates in mm (real-world points) of shape (N, ndim), or of a single point.
         meta (src.preprocess.load_ct.MetaData): meta information of the CT scan.
 
     Returns:
-        list[int]: the voxel location related to the coord.
+        np.ndarray[int]: the voxel locations related to the coords, of the same shape as `coords`.
     """
+    coords = np.asarray(coords, dtype=np.float64)
+    origin, spacing = _axes_vectors(meta, coords.shape[-1])
 
-    if np.isscalar(coord):
-        coord = [coord]
+    # N-dimensional array coordinates for the points in real world should be computed in the way below:
+    return np.rint((coords - origin) / spacing).astype(int)
 
-    coord = np.array(coord)
-    origin = scipy.ndimage._ni_support._normalize_sequence(meta.origin, len(coord))
-    spacing = scipy.ndimage._ni_support._normalize_sequence(meta.spacing, len(coord))
 
-    # N-dimensional array coordinates for the point in real world should be computed in the way below:
-    coord = np.rint((coord - np.array(origin)) / np.array(spacing))
+def voxel_to_mm(voxels, meta):
+    """
+    Transfer voxels' locations into coordinates in mm, the inverse of `mm_to_voxel`.
+
+    Args:
+        voxels (array_like): voxel locations of shape (N, ndim), or of a single voxel.
+        meta (src.preprocess.load_ct.MetaData): meta information of the CT scan.
 
-    return coord.astype(np.int)
+    Returns:
+        np.ndarray[float]: the coordinates in mm (real-world points), of the same shape as `voxels`.
+    """
+    voxels = np.asarray(voxels, dtype=np.float64)
+    origin, spacing = _axes_vectors(meta, voxels.shape[-1])
+    return voxels * spacing + origin
+
+
+def mm_coordinates_to_voxel(coord, meta):
+    """
+    Transfer coordinates in mm into voxel's location
+
+    Args:
+        coord (scalar | list[scalar]): coordinates in mm (real-world point).
+        meta (src.preprocess.load_ct.MetaData): meta information of the CT scan.
+
+    Returns:
+        np.ndarray[int]: the voxel location related to the coord, see `mm_to_voxel` for many points.
+    """
+    return mm_to_voxel(np.atleast_1d(coord), meta)
@@ -0,0 +1,259 @@
+"""
+Persistent index of the CT series stored in the image directories.
+
+The index is a SQLite database which records for every file its modification
+time and size along with the few header fields required to locate and describe
+its series. For every series it records the UID, the files sorted by slice
+location, the slice locations themselves and the meta data in the form of
+`MetaData.to_dict`. Updating a directory only re-reads the headers of the files
+which were added or modified since the last update, so that consulting the index
+costs a directory listing instead of parsing every header.
+"""
+
+import contextlib
+import json
+import os
+import sqlite3
+
+import dicom
+
+from config import Config
+from . import load_ct
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    header TEXT
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE TABLE IF NOT EXISTS series (
+    directory TEXT NOT NULL,
+    uid TEXT NOT NULL,
+    format TEXT NOT NULL,
+    files TEXT NOT NULL,
+    positions TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    PRIMARY KEY (directory, uid)
+);
+"""
+
+
+@contextlib.contextmanager
+def _connect(index_path):
+    if index_path is None:
+        index_path = Config.SERIES_INDEX_PATH
+
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    connection = sqlite3.connect(index_path, timeout=60)
+
+    try:
+        connection.executescript(SCHEMA)
+        # commits on success and rolls back on failure
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def read_header(path):
+    """
+    Read the header fields of a single file which are recorded in the index.
+
+    Args:
+        path (str): a path to a .dcm or .mhd file.
+
+    Returns:
+        dict | None: the recorded header fields, None if the file can't be indexed.
+    """
+    if path[-4:].lower() == '.mhd':
+        try:
+            meta = load_ct.MetaData(load_ct.load_metaimage(path, voxel=False))
+        except (OSError, RuntimeError, ValueError):
+            return None
+
+        uid = os.path.splitext(os.path.basename(path))[0]
+        return {'format': 'mhd', 'uid': uid, 'position': 0., 'meta': meta.to_dict()}
+
+    try:
+        dataset = dicom.read_file(path, stop_before_pixels=True)
+        meta = load_ct.MetaData([dataset])
+        return {'format': 'dicom',
+                'uid': str(dataset.SeriesInstanceUID),
+                'position': float(dataset.SliceLocation),
+                'meta': meta.to_dict()}
+    except (dicom.errors.InvalidDicomError, AttributeError, KeyError, ValueError):
+        return None
+
+
+def _list_files(directory):
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return {}
+
+    files = {}
+    for name in names:
+        if name[-4:].lower() not in {'.dcm', '.mhd'}:
+            continue
+
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+
+        if os.path.isfile(path):
+            files[path] = (stat.st_mtime_ns, stat.st_size)
+
+    return files
+
+
+def _group_series(directory, headers):
+    # DICOM series are only recorded if every .dcm file is indexable,
+    # so that broken series keep being reported by the loaders
+    broken_dicom = any(header is None for path, header in headers.items() if path[-4:].lower() == '.dcm')
+
+    grouped = {}
+    for path, header in headers.items():
+        if header is None or (broken_dicom and header['format'] == 'dicom'):
+            continue
+
+        grouped.setdefault((header['format'], header['uid']), []).append((header['position'], path, header))
+
+    for (file_format, uid), slices in sorted(grouped.items()):
+        slices.sort(key=lambda item: item[0])
+        # Just like read_dicom_files, the meta data are taken from the lowest slice
+        yield (directory, uid, file_format,
+               json.dumps([path for _, path, _ in slices]),
+               json.dumps([position for position, _, _ in slices]),
+               json.dumps(slices[0][2]['meta']))
+
+
+def update(directory, index_path=None):
+    """
+    Bring the index of a directory up to date, only the headers of added or
+    modified files are read.
+
+    Args:
+        directory (str): the directory which contains the files of a series.
+        index_path (str): the index database. If None is set (default),
+            then `Config.SERIES_INDEX_PATH` will be used.
+
+    Returns:
+        list[dict]: the series of the directory, see `series`.
+    """
+    directory = os.path.abspath(directory)
+    files = _list_files(directory)
+
+    with _connect(index_path) as connection:
+        rows = connection.execute('SELECT path, mtime_ns, size, header FROM files WHERE directory = ?', (directory,))
+        known = {path: ((mtime_ns, size), header) for path, mtime_ns, size, header in rows}
+
+        changed = [path for path, stat in files.items() if path not in known or known[path][0] != stat]
+        removed = [path for path in known if path not in files]
+
+        if changed or removed:
+            headers = load_ct.parallel_read(read_header, changed)
+
+            connection.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+            connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                   [(path, directory, files[path][0], files[path][1],
+                                     None if header is None else json.dumps(header))
+                                    for path, header in zip(changed, headers)])
+
+            headers = dict(zip(changed, headers))
+            headers.update((path, None if header is None else json.loads(header))
+                           for path, (_, header) in known.items() if path in files and path not in headers)
+
+            connection.execute('DELETE FROM series WHERE directory = ?', (directory,))
+            connection.executemany('INSERT INTO series VALUES (?, ?, ?, ?, ?, ?)', _group_series(directory, headers))
+
+        return _select_series(connection, directory)
+
+
+def _select_series(connection, directory):
+    rows = connection.execute('SELECT uid, format, files, positions, meta FROM series '
+                              'WHERE directory = ? ORDER BY uid', (directory,))
+
+    return [{'directory': directory,
+             'uid': uid,
+             'format': file_format,
+             'files': json.loads(files),
+             'positions': json.loads(positions),
+             'meta': json.loads(meta)}
+            for uid, file_format, files, positions, meta in rows]
+
+
+def series(directory, index_path=None):
+    """
+    The series recorded for a directory, without updating the index.
+
+    Args:
+        directory (str): the directory which contains the files of a series.
+        index_path (str): the index database. If None is set (default),
+            then `Config.SERIES_INDEX_PATH` will be used.
+
+    Returns:
+        list[dict]: the series of the form::
+            {'directory': str,
+             'uid': str,
+             'format': 'dicom' | 'mhd',
+             'files': list[str],
+             'positions': list[float],
+             'meta': dict}
+    """
+    with _connect(index_path) as connection:
+        return _select_series(connection, os.path.abspath(directory))
+
+
+def scan(root, index_path=None):
+    """
+    Update the index of every directory below `root`.
+
+    Args:
+        root (str): the top-level image directory.
+        index_path (str): the index database. If None is set (default),
+            then `Config.SERIES_INDEX_PATH` will be used.
+
+    Returns:
+        list[dict]: all the series found below `root`, see `series`.
+    """
+    found = []
+
+    for directory, _, names in os.walk(root, followlinks=True):
+        if any(name[-4:].lower() in {'.dcm', '.mhd'} for name in names):
+            found.extend(update(directory, index_path=index_path))
+
+    return found
+
+
+def lookup(path, index_path=None):
+    """
+    Find the single series stored at a path, as accepted by `load_ct.load_ct`.
+
+    Args:
+        path (str): a directory of a series or a path to a .mhd file.
+        index_path (str): the index database. If None is set (default),
+            then `Config.SERIES_INDEX_PATH` will be used.
+
+    Returns:
+        dict | None: the up to date series, see `series`. None if the path
+            doesn't contain exactly one indexable series.
+    """
+    if path[-4:].lower() == '.mhd':
+        path = os.path.abspath(path)
+        found = [record for record in update(os.path.dirname(path), index_path=index_path)
+                 if record['files'] == [path]]
+    else:
+        found = update(path, index_path=index_path)
+        # DICOM files take precedence over MetaImage files, just like in load_ct
+        dicom_series = [record for record in found if record['format'] == 'dicom']
+        found = dicom_series or found
+
+    if len(found) != 1:
+        return None
+
+    return found[0]
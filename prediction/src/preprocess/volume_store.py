@@ -0,0 +1,211 @@
+"""
+Chunked, compressed on-disk store of decoded CT volumes.
+
+Every series is stored in a directory of its own, which holds the voxel data
+split along the z-axis into slabs of `chunk_depth` slices, each in a compressed
+`chunk_<n>.npz` file, and a `meta.json` file with the shape, the data-type and
+the serialized `MetaData` of the volume. The `meta.json` file is written last,
+so that its presence marks a complete entry. Reading a stored volume only
+decompresses the slabs which are actually accessed.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from config import Config
+from .lazy_volume import SlicedVolume
+
+META_FILE = 'meta.json'
+
+
+def is_stored(path):
+    """
+    Check whether a path points to a complete volume of the store.
+
+    Args:
+        path (str): a path to a directory.
+
+    Returns:
+        bool
+    """
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def _chunk_path(path, chunk):
+    return os.path.join(path, 'chunk_{:05d}.npz'.format(chunk))
+
+
+def write(path, voxel_data, meta, chunk_depth=None):
+    """
+    Store a decoded CT volume, replacing any complete volume at `path`.
+
+    Args:
+        path (str): the directory of the stored volume.
+        voxel_data (np.ndarray): the decoded voxel data in (z, y, x) order.
+        meta (dict): the serialized meta data, see `MetaData.to_dict`.
+        chunk_depth (int): the number of slices per chunk. If None is set (default),
+            then `Config.VOLUME_STORE_CHUNK_DEPTH` will be used.
+    """
+    if chunk_depth is None:
+        chunk_depth = Config.VOLUME_STORE_CHUNK_DEPTH
+
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+
+    # Write into a temporary directory first, so that an interrupted write never leaves a partial volume
+    staging = tempfile.mkdtemp(dir=parent, prefix='.' + os.path.basename(path), suffix='.tmp')
+
+    try:
+        for chunk, start in enumerate(range(0, len(voxel_data), chunk_depth)):
+            np.savez_compressed(_chunk_path(staging, chunk), voxel=np.asarray(voxel_data[start:start + chunk_depth]))
+
+        header = {'shape': [int(axis) for axis in voxel_data.shape],
+                  'dtype': np.dtype(voxel_data.dtype).str,
+                  'chunk_depth': chunk_depth,
+                  'meta': meta}
+
+        with open(os.path.join(staging, META_FILE), 'w') as meta_file:
+            json.dump(header, meta_file)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(staging, path)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def read_header(path):
+    """
+    Read the description of a stored volume.
+
+    Args:
+        path (str): the directory of the stored volume.
+
+    Returns:
+        dict: the shape, data-type, chunk depth and serialized meta data of the volume.
+    """
+    with open(os.path.join(path, META_FILE)) as meta_file:
+        return json.load(meta_file)
+
+
+def stored_files(path):
+    """
+    The files a stored volume consists of.
+
+    Args:
+        path (str): the directory of the stored volume.
+
+    Returns:
+        list[str]: the paths of the chunks and of the meta data.
+    """
+    header = read_header(path)
+    chunks = -(-header['shape'][0] // header['chunk_depth'])
+    return [_chunk_path(path, chunk) for chunk in range(chunks)] + [os.path.join(path, META_FILE)]
+
+
+class StoredVolume(SlicedVolume):
+    """
+    A CT volume of the store, which decompresses its chunks only when they are accessed.
+
+    Supports the numpy-style indexing of `SlicedVolume`. The most recently
+    decompressed chunks are kept in a small cache.
+
+    Args:
+        path (str): the directory of the stored volume.
+        cache_size (int): the number of decompressed chunks to keep.
+
+    Attributes:
+        meta (dict): the serialized meta data of the CT scan.
+
+    Returns:
+        preprocess.volume_store.StoredVolume
+    """
+
+    def __init__(self, path, cache_size=4):
+        header = read_header(path)
+
+        self.path = path
+        self.shape = tuple(header['shape'])
+        self.dtype = np.dtype(header['dtype'])
+        self.chunk_depth = header['chunk_depth']
+        self.meta = header['meta']
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def read_chunk(self, chunk):
+        """
+        Decompress a single chunk, served from the chunk cache where possible.
+
+        Args:
+            chunk (int): the index of the chunk along the z-axis.
+
+        Returns:
+            np.ndarray: the read-only voxel data of the chunk.
+        """
+        voxel_data = self._cache.get(chunk)
+
+        if voxel_data is None:
+            with np.load(_chunk_path(self.path, chunk)) as chunk_file:
+                voxel_data = chunk_file['voxel']
+            voxel_data.setflags(write=False)
+
+            self._cache[chunk] = voxel_data
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(chunk)
+
+        return voxel_data
+
+    def read_slice(self, index):
+        return self.read_chunk(index // self.chunk_depth)[index % self.chunk_depth]
+
+    def _stack(self, indices):
+        indices = list(indices)
+        if indices and indices == list(range(indices[0], indices[0] + len(indices))):
+            # contiguous slabs are copied chunk by chunk
+            volume = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+            position = 0
+
+            while position < len(volume):
+                index = indices[position]
+                chunk, offset = divmod(index, self.chunk_depth)
+                count = min(self.chunk_depth - offset, len(volume) - position)
+                volume[position:position + count] = self.read_chunk(chunk)[offset:offset + count]
+                position += count
+
+            return volume
+
+        return super()._stack(indices)
+
+
+def load(path, voxel=True, lazy=False):
+    """
+    Load a volume of the store.
+
+    Args:
+        path (str): the directory of the stored volume.
+        voxel (bool): whether to return or not to return voxel data of the CT scan.
+        lazy (bool): whether to return a `StoredVolume` which reads only the accessed
+            chunks instead of the whole voxel data.
+
+    Returns:
+        voxel_data (np.ndarray | StoredVolume): the voxel data in (z, y, x) order.
+        meta (dict): the serialized meta data of the CT scan.
+    """
+    if not voxel:
+        return read_header(path)['meta']
+
+    volume = StoredVolume(path)
+
+    if lazy:
+        return [volume, volume.meta]
+
+    return [np.asarray(volume), volume.meta]
@@ -3,6 +3,8 @@ import glob
 import pytest
 import signal
 
+import numpy as np
+
 from config import Config
 
 from . import get_timeout
@@ -122,6 +124,21 @@ class TimeoutExit(BaseException):
     pass
 
 
+@pytest.fixture(scope='session')
+def chest():
+    # a synthetic CT scan in HU: a body of soft tissue with two lungs in air, slices with a padded corner among them.
+    # It is shared between the tests, hence read-only
+    y, x = np.mgrid[:128, :128]
+    image = np.full((40, 128, 128), -1000, dtype=np.int16)
+    image[:, ((y - 64) / 54.) ** 2 + ((x - 64) / 59.) ** 2 < 1] = 40
+    for center in (40, 88):
+        image[:, ((y - 64) / 40.) ** 2 + ((x - center) / 19.) ** 2 < 1] = -850
+    image += np.random.RandomState(0).randint(-60, 60, size=image.shape).astype(np.int16)
+    image[::3, :10, :10] = -2000
+    image.setflags(write=False)
+    yield image
+
+
 def _timeout(signum, frame):
     raise TimeoutExit("Runner timeout is reached, runner is terminating.")
 
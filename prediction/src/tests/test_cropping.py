@@ -4,7 +4,7 @@ import numpy as np
 
 from ..preprocess.crop_dicom import crop_dicom
 from ..preprocess.load_ct import load_ct
-from ..preprocess.crop_patches import patches_from_ct
+from ..preprocess.crop_patches import crop_patch, patches_from_ct
 from ..preprocess.preprocess_ct import PreprocessCT
 
 
@@ -44,6 +44,26 @@ def test_patches_from_ct(ct_path, luna_nodules):
     assert all(patch.shape == (12, 12, 12) for patch in patches)
 
 
+def test_crop_patch_lazy(dicom_path):
+    ct_array, _ = load_ct(dicom_path)
+    lazy_array, _ = load_ct(dicom_path, lazy=True)
+    centroids = [[0, 0, 0], [5, 200, 300], [len(ct_array) + 4, 511, 600], [-20, 3, 3]]
+
+    def padded_crop(array, centroid, size):
+        array = np.pad(array, size // 2, mode='constant', constant_values=-7)
+        return array[centroid[0]: centroid[0] + size,
+                     centroid[1]: centroid[1] + size,
+                     centroid[2]: centroid[2] + size]
+
+    for patches in (crop_patch(ct_array, 8, centroids, pad_value=-7),
+                    crop_patch(lazy_array, 8, centroids, pad_value=-7)):
+        for centroid, patch in zip(centroids, patches):
+            assert np.array_equal(patch, padded_crop(ct_array, centroid, 8))
+
+    _, coord = next(crop_patch(lazy_array, 8, centroids, stride=4))
+    assert coord.shape == (3, 2, 2, 2)
+
+
 def test_patches_on_multiple_centroids(dicom_paths):
     ct_path = dicom_paths[2]
     few_centroids = [{'x': 50, 'y': 50, 'z': 21}, {'x': 367, 'y': 349, 'z': 75}]
@@ -0,0 +1,85 @@
+import numpy as np
+
+from ..preprocess import extract_lungs
+
+
+def test_binarize_per_slice(monkeypatch, chest):
+    spacing = np.array([2.5, .7, .7])
+    bw = extract_lungs.binarize_per_slice(chest, spacing, workers=1)
+    assert bw.dtype == np.bool_
+    assert bw.shape == chest.shape
+    assert bw[:, 64, 40].all() and bw[:, 64, 88].all()
+    assert not bw[:, 64, 64].any()
+
+    # the slices binarized by a pool of processes are identical
+    monkeypatch.setattr(extract_lungs, 'MIN_SLICES_PER_WORKER', 1)
+    assert np.array_equal(extract_lungs.binarize_per_slice(chest, spacing, workers=3), bw)
+
+
+def test_remove_large_objects():
+    label = np.zeros((6, 64, 64), dtype=np.int64)
+    # a component around the center axis, one at the edge and one too small on every slice
+    label[1:5, 24:40, 24:40] = 1
+    label[0:6, 0:8, 0:8] = 2
+    label[2:3, 30:32, 30:32] = 3
+
+    valid = extract_lungs._remove_large_objects(label, np.array([1., 1., 1.]), area_th=10, dist_th=20)
+    assert valid == {1}
+
+
+def test_all_slice_analysis_cut():
+    bw = np.zeros((20, 64, 64), dtype=bool)
+    # a central component leaking to the corners through the top slices
+    bw[2:18, 24:40, 24:40] = True
+    bw[14:, 0:24, 30:32] = True
+    bw[14:, 0:2, :] = True
+    spacing = np.array([1., 1., 1.])
+    before = bw.copy()
+
+    cache = {}
+    _, flag = extract_lungs.all_slice_analysis(bw, spacing, cut_num=4, vol_limit=[1e-3, 1], area_th=10, dist_th=20,
+                                               cache=cache)
+    assert flag == 0
+    cut, flag = extract_lungs.all_slice_analysis(bw, spacing, cut_num=6, vol_limit=[1e-3, 1], area_th=10, dist_th=20,
+                                                 cache=cache)
+    assert flag == 1
+    assert np.array_equal(bw, before)
+    assert cut[2:14, 24:40, 24:40].all() and not cut[:, :2].any()
+
+    # the components analysed for the previous cut give the same mask
+    uncached, _ = extract_lungs.all_slice_analysis(bw, spacing, cut_num=6, vol_limit=[1e-3, 1], area_th=10,
+                                                   dist_th=20)
+    assert np.array_equal(cut, uncached)
+
+
+def test_extract_lungs_retries(chest):
+    spacing = np.array([5., 2.8, 2.8])
+    # both lungs leak to the outside through the top slices, which need to be removed first
+    image = chest.copy()
+    image[-9:, 60:68, :40] = -900
+    image[-9:, 60:68, 88:] = -900
+
+    # every cut labelled anew and filled back, as for a single call of all_slice_analysis
+    bw0 = extract_lungs.binarize_per_slice(image, spacing, workers=1)
+    flag, cut_num = 0, 0
+    while flag == 0 and cut_num < bw0.shape[0]:
+        bw, flag = extract_lungs.all_slice_analysis(bw0, spacing, cut_num=cut_num, vol_limit=[0.68, 7.5])
+        cut_num += 2
+    assert cut_num > 2
+    _, _, expected = extract_lungs.two_lung_only(extract_lungs._fill_hole(bw), spacing)
+
+    mask = extract_lungs.extract_lungs(image, spacing, workers=1)
+    assert mask[:, 64, 40].all() and mask[:, 64, 88].all()
+    assert np.array_equal(mask, expected)
+
+
+def test_extract_lungs_coarse(chest):
+    spacing = np.array([5., 2.8, 2.8])
+
+    full = extract_lungs.extract_lungs(chest, spacing)
+    assert full[:, 64, 40].all() and not full[:, 64, 64].any()
+
+    coarse = extract_lungs.extract_lungs_coarse(chest, spacing, factor=2)
+    assert coarse.shape == full.shape
+    dice = 2. * (full & coarse).sum() / (full.sum() + coarse.sum())
+    assert dice > 0.99
@@ -26,3 +26,13 @@ def test_identify_luna(metaimage_path, luna_nodule):
     first = predicted[0]
     dist = np.sqrt(np.sum([(first[s] - luna_nodule[s]) ** 2 for s in ["x", "y", "z"]]))
     assert dist < 10
+
+
+def test_identify_missing_series(tmpdir):
+    with pytest.raises(ValueError) as error:
+        trained_model.predict(str(tmpdir))
+    assert "doesn't contain any .mhd or .dcm files" in str(error.value)
+
+    with pytest.raises(ValueError) as error:
+        trained_model.predict(str(tmpdir.join('missing.mhd')))
+    assert "does not exist" in str(error.value)
@@ -1,6 +1,12 @@
+import os
+
+import numpy as np
+import scipy.ndimage
+
 from src.preprocess import load_ct, preprocess_ct
 
-from ..preprocess.improved_lung_segmentation import improved_lung_segmentation
+from ..preprocess.improved_lung_segmentation import improved_lung_segmentation, region_growing, \
+    separate_lungs3d
 
 
 def test_segmentation_over_LIDC(full_dicom_path):
@@ -25,3 +31,47 @@ def test_segmentation_over_LUNA(full_mhd_path):
     preprocess = preprocess_ct.PreprocessCT(to_hu=True)
     patient, _ = preprocess(*load_ct.load_ct(full_mhd_path))
     lung, lung_left, lung_right, trachea = improved_lung_segmentation(patient)
+
+
+def test_region_growing():
+    img = scipy.ndimage.gaussian_filter(np.random.RandomState(0).randn(40, 50, 60), 2) * 100
+    img = img.astype(np.int16)
+    seed = np.zeros(img.shape, dtype=bool)
+    seed[20, 25, 30] = seed[5, 5, 5] = True
+    before = img.copy()
+
+    # the components of the thresholded image which contain the seeds
+    thrimg = (img < 10) & (img >= -20)
+    thrimg[seed] = True
+    lmap, _ = scipy.ndimage.label(thrimg)
+    expected = np.isin(lmap, lmap[seed])
+
+    out = np.ones(img.shape, dtype=bool)
+    region = region_growing(img, seed, -20, 10, out=out, margin=2)
+    assert region is out
+    assert np.array_equal(region, expected)
+    assert np.array_equal(img, before)
+
+    # stops once the region reached max_size voxels
+    assert np.count_nonzero(region_growing(img, seed, -20, 10, margin=2, max_size=10)) < expected.sum()
+
+
+def test_separate_lungs3d(tmpdir):
+    z, y, x = np.mgrid[:40, :40, :40] / 40.
+    lungs = np.zeros(z.shape, dtype=bool)
+    for center in (.3, .7):
+        lungs |= ((z - .5) / .4) ** 2 + ((y - .5) / .35) ** 2 + ((x - center) / .2) ** 2 < 1
+    # a bridge joining the lungs on the coronal slices around the middle
+    lungs |= (abs(z - .5) < .05) & (abs(y - .5) < .3) & (abs(x - .5) < .25)
+
+    with tmpdir.as_cwd():
+        left, right = separate_lungs3d(lungs, workers=2)
+        assert not os.listdir(str(tmpdir))
+
+    assert np.array_equal((left + right).astype(bool), lungs)
+    assert not (left & right).any()
+    assert left[20, 20, 12] and right[20, 20, 28]
+
+    # the same separation in the current process
+    for separated, expected in zip(separate_lungs3d(lungs, workers=1), (left, right)):
+        assert np.array_equal(separated, expected)
@@ -8,10 +8,12 @@ import dicom_numpy
 import numpy as np
 import pytest
 
-from ..preprocess import errors
+from config import Config
+from ..preprocess import ct_cache, errors
+from ..preprocess.lazy_volume import LazyVolume, SlicedVolume, sort_slices
 from ..preprocess.load_ct import (
     read_dicom_files, _extract_voxel_data, load_dicom, load_ct, load_metaimage,
-    MetaData)
+    series_identity, MetaData, to_hu)
 
 
 def test_read_files(dicom_path):
@@ -29,6 +31,15 @@ def test_read_files(dicom_path):
         read_dicom_files(os.path.join('.', '*.dcm'))
 
 
+def test_read_files_parallel(dicom_path):
+    pattern = os.path.join(dicom_path, '*.dcm')
+    serial = read_dicom_files(pattern, workers=1)
+    parallel = read_dicom_files(pattern, workers=4)
+
+    assert len(serial) == len(parallel)
+    assert [f.SliceLocation for f in serial] == [f.SliceLocation for f in parallel]
+
+
 def test_extract_voxel_data(dicom_path):
     files = read_dicom_files(os.path.join(dicom_path, '*.dcm'))
     dicom_array = _extract_voxel_data(files)
@@ -40,6 +51,26 @@ def test_extract_voxel_data(dicom_path):
         _extract_voxel_data([dicom.dataset.Dataset()])
 
 
+def test_extract_voxel_data_matches_combine_slices(dicom_path):
+    files = read_dicom_files(os.path.join(dicom_path, '*.dcm'))
+    dicom_array = _extract_voxel_data(files)
+    expected = dicom_numpy.combine_slices(files)[0].T
+
+    assert dicom_array.flags.c_contiguous
+    assert dicom_array.dtype == expected.dtype
+    assert np.array_equal(dicom_array, expected)
+
+    # the order in which the slices are passed doesn't matter
+    assert np.array_equal(_extract_voxel_data(files[::-1]), expected)
+
+    with pytest.raises(dicom_numpy.DicomImportException):
+        _extract_voxel_data(files[:1] + files[2:5] + files[6:])
+
+    files[1].PixelSpacing = [2 * float(spacing) for spacing in files[1].PixelSpacing]
+    with pytest.raises(dicom_numpy.DicomImportException):
+        _extract_voxel_data(files)
+
+
 def test_load_dicom(dicom_path):
     dicom_array, meta = load_dicom(dicom_path)
     assert isinstance(dicom_array, np.ndarray)
@@ -52,8 +83,13 @@ def test_load_metaimage(ct_path, dicom_path):
     path = glob.glob(os.path.join(ct_path, '*.mhd'))[0]
     ct_array, meta = load_metaimage(path)
 
-    assert isinstance(ct_array, np.ndarray)
-    assert isinstance(meta, SimpleITK.SimpleITK.Image)
+    assert isinstance(ct_array, np.memmap)
+    assert isinstance(meta, MetaData)
+
+    itk_image = SimpleITK.ReadImage(path)
+    assert np.array_equal(ct_array, SimpleITK.GetArrayFromImage(itk_image))
+    assert meta.spacing == itk_image.GetSpacing()[::-1]
+    assert meta.origin == itk_image.GetOrigin()[::-1]
 
     path = glob.glob(os.path.join(dicom_path, '*.dcm'))
 
@@ -68,6 +104,39 @@ def test_load_metaimage(ct_path, dicom_path):
         assert 'PNGImageIO failed to read header for file' in str(e)
 
 
+@pytest.mark.parametrize('element_type, dtype', [('MET_SHORT', '<i2'), ('MET_FLOAT', '<f4')])
+def test_load_metaimage_memmap(tmpdir, element_type, dtype):
+    voxel_data = np.arange(4 * 5 * 6).reshape(4, 5, 6).astype(dtype)
+    voxel_data.tofile(str(tmpdir.join('scan.raw')))
+    tmpdir.join('scan.mhd').write('\n'.join([
+        'ObjectType = Image',
+        'NDims = 3',
+        'BinaryData = True',
+        'BinaryDataByteOrderMSB = False',
+        'CompressedData = False',
+        'Offset = -176.5 -20.25 506.8',
+        'ElementSpacing = 0.625 0.75 2.5',
+        'DimSize = 6 5 4',
+        'ElementType = {}'.format(element_type),
+        'ElementDataFile = scan.raw']))
+
+    path = str(tmpdir.join('scan.mhd'))
+    ct_array, meta = load_metaimage(path)
+    itk_image = SimpleITK.ReadImage(path)
+
+    assert isinstance(ct_array, np.memmap)
+    assert ct_array.dtype == SimpleITK.GetArrayFromImage(itk_image).dtype
+    assert np.array_equal(ct_array, SimpleITK.GetArrayFromImage(itk_image))
+    assert meta.spacing == itk_image.GetSpacing()[::-1]
+    assert meta.origin == itk_image.GetOrigin()[::-1]
+
+    # in-place pre-processing must not change the file on disk
+    ct_array[:] = 0
+    assert np.array_equal(load_metaimage(path)[0], voxel_data)
+
+    assert load_metaimage(path, voxel=False).spacing == meta.spacing
+
+
 def test_load_ct(ct_path, dicom_path):
     ct_array, meta = load_ct(dicom_path)
     assert isinstance(ct_array, np.ndarray)
@@ -75,7 +144,7 @@ def test_load_ct(ct_path, dicom_path):
 
     ct_array, meta = load_ct(ct_path)
     assert isinstance(ct_array, np.ndarray)
-    assert isinstance(meta, SimpleITK.SimpleITK.Image)
+    assert isinstance(meta, MetaData)
 
     try:
         load_ct('.')
@@ -83,6 +152,61 @@ def test_load_ct(ct_path, dicom_path):
         assert 'contain any .mhd or .dcm files' in str(e)
 
 
+def test_load_ct_identity(tmpdir, monkeypatch, dicom_path):
+    monkeypatch.setattr(Config, 'CT_CACHE_DIR', str(tmpdir))
+    expected = series_identity(dicom_path)
+
+    ct_array, meta, identity = load_ct(dicom_path, identity=True)
+    assert identity == expected
+    assert np.array_equal(ct_array, load_ct(dicom_path)[0])
+
+    header, identity = load_ct(dicom_path, voxel=False, identity=True)
+    assert identity == expected
+    for _ in range(2):
+        _, _, identity = load_ct(dicom_path, cache=True, identity=True)
+        assert identity == expected
+
+
+def test_load_ct_lazy(dicom_path):
+    voxel_data, _ = load_ct(dicom_path)
+    lazy_data, meta = load_ct(dicom_path, lazy=True)
+
+    assert isinstance(lazy_data, LazyVolume)
+    assert lazy_data.shape == voxel_data.shape
+    assert lazy_data.dtype == voxel_data.dtype
+    assert len(lazy_data) == len(voxel_data)
+    assert MetaData(meta).spacing == MetaData(load_ct(dicom_path, voxel=False)).spacing
+
+    assert np.array_equal(lazy_data[3], voxel_data[3])
+    assert np.array_equal(lazy_data[-1], voxel_data[-1])
+    assert np.array_equal(lazy_data[2:7, 100:120, 5], voxel_data[2:7, 100:120, 5])
+    assert np.array_equal(lazy_data[::-3], voxel_data[::-3])
+    assert np.array_equal(lazy_data[[4, 0, 4]], voxel_data[[4, 0, 4]])
+    assert np.array_equal(lazy_data[..., 7], voxel_data[..., 7])
+    assert np.array_equal(np.asarray(lazy_data), voxel_data)
+
+    # Slices are cached and never modified by the caller
+    patch = lazy_data[1:3]
+    patch[:] = 0
+    assert np.array_equal(lazy_data[1:3], voxel_data[1:3])
+
+    with pytest.raises(IndexError):
+        lazy_data[len(voxel_data)]
+
+    # a volume which cannot read its slices is rejected up front
+    class Incomplete(SlicedVolume):
+        shape = voxel_data.shape
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+    # the headers are validated as in the eager path, before any slice is decoded
+    datasets = read_dicom_files(os.path.join(dicom_path, '*.dcm'), stop_before_pixels=True)
+    datasets[1].RescaleIntercept = float(datasets[0].RescaleIntercept) + 1
+    with pytest.raises(dicom_numpy.DicomImportException):
+        _extract_voxel_data(datasets, lazy=True)
+
+
 def test_load_ct_no_voxel(ct_path, dicom_path):
     meta = load_ct(dicom_path, voxel=False)
     assert isinstance(meta, list)
@@ -90,7 +214,53 @@ def test_load_ct_no_voxel(ct_path, dicom_path):
     assert all(isinstance(_slice, dicom.dataset.FileDataset) for _slice in meta)
 
     meta = load_ct(ct_path, voxel=False)
-    assert isinstance(meta, SimpleITK.SimpleITK.Image)
+    assert isinstance(meta, MetaData)
+
+
+def test_metadata_header_only(dicom_path):
+    full = MetaData(load_ct(dicom_path)[1])
+    header = MetaData(load_ct(dicom_path, voxel=False))
+
+    assert 'PixelData' not in header.meta[0]
+    assert list(full.spacing) == list(header.spacing)
+    assert list(full.origin) == list(header.origin)
+    assert full.slope == header.slope
+    assert full.intercept == header.intercept
+
+
+def test_metadata_rescale_vectors(dicom_path):
+    datasets = load_ct(dicom_path, voxel=False)
+    for position, dataset in enumerate(datasets):
+        dataset.RescaleIntercept = -1000 - position
+
+    meta = MetaData(datasets)
+    # the rescaling of the slices follows the order of the voxel data
+    expected = [float(dataset.RescaleIntercept) for dataset in sort_slices(datasets)]
+    assert meta.intercepts == expected
+    assert meta.slope == float(datasets[0].RescaleSlope)
+
+    slopes, intercepts = MetaData(meta.to_dict()).rescale_vectors(len(datasets))
+    assert intercepts.tolist() == expected
+    assert (slopes == meta.slope).all()
+
+    # meta data of a different number of slices fall back onto the first slice
+    slopes, intercepts = meta.rescale_vectors(3)
+    assert intercepts.tolist() == [meta.intercept] * 3
+
+
+def test_to_hu():
+    voxel_data = np.arange(-2, 10, dtype=np.int16).reshape(3, 2, 2)
+    expected = [np.int16(slope * value) + np.int16(intercept) if value != -2 else np.int16(intercept)
+                for slope, intercept, values in zip([1, 2.5, 1], [-1024.5, 0, 3], voxel_data) for value in values.flat]
+
+    hu = to_hu(voxel_data.copy(), [1, 2.5, 1], [-1024.5, 0, 3], padding=-2)
+    assert hu.dtype == np.int16
+    assert hu.ravel().tolist() == expected
+
+    # all slopes 1 keep the data-type
+    hu = to_hu(voxel_data.astype(np.float32), [1, 1, 1], [-1024, 0, 3])
+    assert hu.dtype == np.float32
+    assert hu[1].tolist() == voxel_data[1].tolist()
 
 
 def test_metadata(ct_path, dicom_path):
@@ -101,11 +271,44 @@ def test_metadata(ct_path, dicom_path):
 
     meta = load_ct(ct_path, voxel=False)
     # the default axes order which is used is: (z, y, x)
-    spacing = meta.GetSpacing()[::-1]
+    spacing = SimpleITK.ReadImage(glob.glob(os.path.join(ct_path, '*.mhd'))[0]).GetSpacing()[::-1]
     meta = MetaData(meta)
     assert meta.spacing == spacing
 
+    meta = MetaData(SimpleITK.ReadImage(glob.glob(os.path.join(ct_path, '*.mhd'))[0]))
+    assert meta.spacing == spacing
+
     try:
         MetaData([1, 2, 3])
     except ValueError as e:
         assert 'either list[dicom.dataset.FileDataset] or SimpleITK' in str(e)
+
+
+def test_load_ct_cache(tmpdir, monkeypatch, dicom_path):
+    monkeypatch.setattr(Config, 'CT_CACHE_DIR', str(tmpdir))
+    ct_array, meta = load_ct(dicom_path)
+
+    cached_array, cached_meta = load_ct(dicom_path, cache=True)
+    assert isinstance(cached_meta, MetaData)
+    assert len(tmpdir.listdir()) == 2
+
+    # the second request is served from the memory-mapped cache entry
+    cached_array, cached_meta = load_ct(dicom_path, cache=True)
+    assert isinstance(cached_array, np.memmap)
+    assert np.array_equal(ct_array, cached_array)
+    assert list(cached_meta.spacing) == list(MetaData(meta).spacing)
+
+    header = load_ct(dicom_path, voxel=False, cache=True)
+    assert header.to_dict() == cached_meta.to_dict()
+
+    # an entry evicted by another process between its opening and its renewal is still served
+    def evicted(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(ct_cache.os, 'utime', evicted)
+    cached_array, _ = load_ct(dicom_path, cache=True)
+    assert np.array_equal(ct_array, cached_array)
+
+    # the entry is evicted once the cache does not fit into the limit
+    ct_cache.evict(0, cache_dir=str(tmpdir))
+    assert len(tmpdir.listdir()) == 0
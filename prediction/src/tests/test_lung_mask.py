@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from ..preprocess import ct_cache, load_ct, lung_mask, volume_store
+from ..preprocess.extract_lungs import extract_lungs
+
+
+@pytest.fixture
+def chest_path(tmpdir, chest):
+    # the synthetic chest as a series of the volume store, which identifies it by its files
+    path = str(tmpdir.join('chest'))
+    volume_store.write(path, chest, {'spacing': [5., 2.8, 2.8], 'origin': [0., 0., 0.], 'slope': 1., 'intercept': 0.})
+    yield path
+
+
+def test_get_lung_mask(tmpdir, chest, chest_path):
+    spacing = [5., 2.8, 2.8]
+    cache_dir = str(tmpdir.join('cache'))
+
+    mask = lung_mask.get_lung_mask(chest_path, spacing=spacing, voxel_data=chest, workers=1, cache=True,
+                                   cache_dir=cache_dir)
+    assert mask.dtype == np.bool_
+    assert np.array_equal(mask, extract_lungs(chest, spacing, workers=1))
+
+    # the mask is stored under the identity of the series and read back without the voxel data
+    key = lung_mask.mask_key(load_ct.series_identity(chest_path), 'extract_lungs', spacing)
+    assert ct_cache.get(key, cache_dir=cache_dir) is not None
+    cached = lung_mask.get_lung_mask(chest_path, spacing=spacing, cache=True, cache_dir=cache_dir)
+    assert cached.shape == mask.shape
+    assert np.array_equal(cached, mask)
+
+    # other methods, spacings and derived voxel data are other masks
+    identity = load_ct.series_identity(chest_path)
+    assert lung_mask.mask_key(identity, 'per_slice', spacing) != key
+    assert lung_mask.mask_key(identity, 'extract_lungs', [1., 1., 1.]) != key
+    assert lung_mask.mask_key(identity, 'extract_lungs', spacing, derivation='rotated') != key
+
+    # the series is loaded if no voxel data are given, and nothing is cached by default
+    assert np.array_equal(lung_mask.get_lung_mask(chest_path, cache_dir=str(tmpdir.join('other'))), mask)
+    assert not tmpdir.join('other').check()
+
+
+def test_get_lung_mask_arguments(chest, chest_path):
+    with pytest.raises(ValueError):
+        lung_mask.get_lung_mask(chest_path, method='unknown')
+
+    with pytest.raises(ValueError):
+        lung_mask.get_lung_mask(chest_path, voxel_data=chest)
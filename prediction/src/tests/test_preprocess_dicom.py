@@ -1,5 +1,9 @@
+import threading
+import time
+
 import numpy as np
 import pytest
+import scipy.ndimage
 
 from src.preprocess import load_ct, preprocess_ct
 
@@ -13,6 +17,9 @@ def test_create_params():
         preprocess_ct.Params(ndim=0)
         preprocess_ct.Params(min_max_normalize=[False])
 
+    with pytest.raises(ValueError):
+        preprocess_ct.Params(backend='unknown')
+
 
 def test_preprocess_dicom_pure(dicom_path):
     preprocess = preprocess_ct.PreprocessCT()
@@ -38,3 +45,165 @@ def test_preprocess_dicom_min_max_scale(dicom_path):
     assert isinstance(dicom_array, np.ndarray)
     assert dicom_array.max() <= 1
     assert dicom_array.min() >= 0
+
+
+@pytest.mark.parametrize('params', [
+    dict(clip_lower=-1200., clip_upper=600., spacing=True, order=1, min_max_normalize=True, scale=255, dtype='uint8'),
+    dict(clip_lower=-1000, min_max_normalize=True),
+    dict(clip_upper=400, dtype='int16'),
+    dict(to_hu=True, clip_lower=-1000, clip_upper=400),
+])
+def test_preprocess_dicom_fused(monkeypatch, dicom_path, params):
+    monkeypatch.setattr(preprocess_ct.Config, 'PREPROCESS_SLAB_DEPTH', 3)
+    dicom_array, meta = load_ct.load_ct(dicom_path)
+    assert dicom_array.dtype == np.float32
+
+    expected, expected_meta = preprocess_ct.PreprocessCT(**params)(dicom_array.copy(), meta)
+    fused, fused_meta = preprocess_ct.PreprocessCT(fused=True, **params)(dicom_array.copy(), meta)
+
+    # float32 input is pre-processed identically
+    assert fused.dtype == expected.dtype
+    assert np.array_equal(fused, expected)
+    assert fused_meta.spacing == expected_meta.spacing
+
+    # other input differs by float32 rounding at most
+    int_array = np.rint(dicom_array).astype(np.int16)
+    expected, _ = preprocess_ct.PreprocessCT(**params)(int_array.copy(), meta)
+    fused, _ = preprocess_ct.PreprocessCT(fused=True, **params)(int_array.copy(), meta)
+    assert fused.shape == expected.shape
+    assert np.allclose(fused, expected, rtol=1e-5, atol=1.)
+
+
+@pytest.mark.parametrize('order', [0, 1, 3])
+def test_preprocess_dicom_resample(monkeypatch, dicom_path, order):
+    monkeypatch.setattr(preprocess_ct.Config, 'PREPROCESS_SLAB_DEPTH', 2)
+    dicom_array, meta = load_ct.load_ct(dicom_path)
+    spacing = (.7, 1.3, .9)
+
+    zoom = load_ct.MetaData(meta).spacing / np.asarray(spacing)
+    expected = scipy.ndimage.zoom(dicom_array, zoom, order=order)
+
+    # the slabs computed on a thread pool are identical to the single-threaded result
+    resampled, _ = preprocess_ct.PreprocessCT(spacing=spacing, order=order, workers=3)(dicom_array.copy(), meta)
+    assert resampled.dtype == expected.dtype
+    assert np.array_equal(resampled, expected)
+
+    single, _ = preprocess_ct.PreprocessCT(spacing=spacing, order=order, workers=1)(dicom_array.copy(), meta)
+    assert np.array_equal(single, expected)
+
+
+@pytest.mark.parametrize('params', [
+    dict(clip_lower=-1200., clip_upper=600., spacing=(.7, 1.3, .9), order=1, min_max_normalize=True, scale=255,
+         dtype='uint8'),
+    dict(clip_lower=-1000, spacing=1., order=0, min_max_normalize=True),
+    dict(to_hu=True, clip_upper=400, spacing=(2., .8, .8), order=1, fused=True),
+    dict(clip_upper=400, min_max_normalize=True, dtype='float32'),
+])
+def test_preprocess_dicom_stream(tmpdir, dicom_path, params):
+    dicom_array, meta = load_ct.load_ct(dicom_path)
+    expected, expected_meta = preprocess_ct.PreprocessCT(**params)(dicom_array.copy(), meta)
+
+    # a tiny memory ceiling streams a few output slices at a time
+    preprocess = preprocess_ct.PreprocessCT(**params)
+    streamed, streamed_meta = preprocess.stream(dicom_array, meta, max_bytes=1)
+    assert streamed.dtype == expected.dtype
+    assert np.array_equal(streamed, expected)
+    assert streamed_meta.spacing == expected_meta.spacing
+
+    lazy_array, meta = load_ct.load_ct(dicom_path, lazy=True)
+    path = str(tmpdir.join('preprocessed.npy'))
+    streamed, _ = preprocess.stream(lazy_array, meta, out=path, max_bytes=8 * 1024 ** 2)
+    assert isinstance(streamed, np.memmap)
+    assert np.array_equal(np.load(path), expected)
+
+    with pytest.raises(ValueError):
+        preprocess_ct.PreprocessCT(spacing=1., order=3).stream(dicom_array, meta)
+
+
+def test_preprocess_dicom_to_hu_per_slice(dicom_path):
+    dicom_array, meta = load_ct.load_ct(dicom_path)
+    meta = load_ct.MetaData(meta)
+    raw = np.rint(dicom_array).astype(np.int16)
+    meta.slopes = [1. + .5 * (position % 2) for position in range(len(raw))]
+    meta.intercepts = [-1024. + position for position in range(len(raw))]
+
+    hu, _ = preprocess_ct.PreprocessCT(to_hu=True)(raw.copy(), meta)
+    for position, (slope, intercept) in enumerate(zip(meta.slopes, meta.intercepts)):
+        expected = raw[position].copy()
+        expected[expected == raw[0, 0, 0]] = 0
+        expected = (slope * expected.astype(np.float64)).astype(np.int16) + np.int16(intercept)
+        assert np.array_equal(hu[position], expected)
+
+    fused, _ = preprocess_ct.PreprocessCT(to_hu=True, fused=True)(raw.copy(), meta)
+    assert np.allclose(fused, hu, atol=1.)
+
+
+def test_mm_to_voxel():
+    meta = load_ct.MetaData({'spacing': [2.5, .7, .7], 'origin': [-100., 10., 0.], 'slope': 1., 'intercept': 0.})
+    coords = np.random.RandomState(0).uniform(-200, 200, size=(1000, 3))
+
+    voxels = preprocess_ct.mm_to_voxel(coords, meta)
+    assert voxels.shape == coords.shape
+    assert np.array_equal(voxels, [preprocess_ct.mm_coordinates_to_voxel(coord, meta) for coord in coords])
+
+    # the inverse is exact up to the rounding to the nearest voxel
+    assert np.all(np.abs(preprocess_ct.voxel_to_mm(voxels, meta) - coords) <= np.array(meta.spacing) / 2 + 1e-9)
+    assert np.array_equal(preprocess_ct.mm_to_voxel(preprocess_ct.voxel_to_mm(voxels, meta), meta), voxels)
+    assert preprocess_ct.mm_to_voxel(np.empty((0, 3)), meta).shape == (0, 3)
+
+
+def test_preprocess_series_cache(dicom_path):
+    cache = preprocess_ct.PreprocessedCache()
+    preprocess = preprocess_ct.PreprocessCT(clip_lower=-1000, clip_upper=400, min_max_normalize=True)
+
+    dicom_array, meta = preprocess_ct.preprocess_series(dicom_path, preprocess, cache=cache)
+    assert not dicom_array.flags.writeable
+
+    # equal parameters hit the cache, the meta information is a private copy
+    same = preprocess_ct.PreprocessCT(clip_lower=-1000, clip_upper=400, min_max_normalize=True)
+    cached_array, cached_meta = preprocess_ct.preprocess_series(dicom_path, same, cache=cache)
+    assert cached_array is dicom_array
+    assert cached_meta is not meta
+
+    other = preprocess_ct.PreprocessCT(clip_lower=-1, clip_upper=40)
+    other_array, _ = preprocess_ct.preprocess_series(dicom_path, other, cache=cache)
+    assert other_array is not dicom_array
+    assert other_array.max() <= 40
+
+    # the least recently used entries are evicted once the budget is exceeded
+    cache.max_bytes = cache.nbytes
+    preprocess_ct.preprocess_series(dicom_path, preprocess_ct.PreprocessCT(clip_upper=0), cache=cache)
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_preprocessed_cache_concurrent():
+    calls, active = [], []
+
+    def compute():
+        active.append(None)
+        calls.append(len(active))
+        time.sleep(.05)
+        active.pop()
+        return np.zeros(4), {'spacing': [1., 1., 1.], 'origin': [0., 0., 0.], 'slope': 1., 'intercept': 0.}
+
+    def request(cache):
+        # the threads arrive while the key is computed as well as after it was computed
+        threads = [threading.Thread(target=cache.get_or_compute, args=('key', compute)) for _ in range(8)]
+        for index, thread in enumerate(threads):
+            thread.start()
+            if index % 3 == 2:
+                time.sleep(.06)
+
+        for thread in threads:
+            thread.join()
+
+        assert not cache._pending
+
+    cache = preprocess_ct.PreprocessedCache()
+    request(cache)
+    assert calls == [1]
+
+    # an entry too large to be cached is computed by one thread at a time
+    del calls[:]
+    request(preprocess_ct.PreprocessedCache(max_bytes=0))
+    assert calls == [1] * 8
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+import pytest
+import scipy.ndimage
+
+from ..preprocess import resample
+
+
+@pytest.fixture
+def volume():
+    return np.random.RandomState(0).randint(-1000, 1000, size=(20, 24, 600)).astype(np.int16)
+
+
+def test_resample_scipy(volume):
+    zoom = (1.7, .6, .25)
+    expected = scipy.ndimage.zoom(volume, zoom, order=1)
+    assert np.array_equal(resample.resample(volume, zoom, order=1, backend='scipy', workers=2), expected)
+
+
+def test_resample_cv2(volume):
+    zoom = (1.7, .6, 1.3)
+    resampled = resample.resample(volume, zoom, order=1, backend='cv2')
+    assert resampled.shape == resample.zoom_output_shape(volume.shape, zoom)
+    assert resampled.dtype == volume.dtype
+
+    # more than 512 x-columns are resized in chunks, each column independently of the others
+    first = cv2.resize(np.ascontiguousarray(volume[:, :, :300]), dsize=None, fx=1., fy=1.7)
+    second = cv2.resize(np.ascontiguousarray(volume[:, :, 300:]), dsize=None, fx=1., fy=1.7)
+    expected = cv2.resize(np.concatenate([first, second], axis=2).transpose(1, 2, 0), dsize=None, fx=1.3, fy=.6)
+    assert np.array_equal(resampled, expected.transpose(2, 0, 1))
+
+    with pytest.raises(ValueError):
+        resample.resample(volume, zoom, order=2, backend='cv2')
+
+
+def test_resample_nearest(volume):
+    mask = volume > 0
+    zoom = (1.7, .6, 1.3)
+    resampled = resample.resample(mask, zoom, order=0, backend='nearest')
+    assert resampled.dtype == np.bool_
+    assert resampled.shape == resample.zoom_output_shape(mask.shape, zoom)
+
+    # the same voxels as picked by cv2
+    expected = resample.resample(mask.astype(np.uint8), zoom, order=0, backend='cv2')
+    assert np.array_equal(resampled, expected.astype(np.bool_))
+
+    # an axis of unchanged length is copied as is
+    assert np.array_equal(resample.resample(mask, (1., 1.02, 1.), order=0, backend='nearest'), mask)
+
+    with pytest.raises(ValueError):
+        resample.resample(mask, zoom, order=0, backend='unknown')
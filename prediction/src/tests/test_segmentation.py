@@ -1,15 +1,18 @@
 import os
 import time
 
+import cv2
+import numpy as np
 import pylidc as pl
 import pytest
 
 from config import Config
 
 from . import get_timeout
-from ..algorithms.identify.prediction import load_patient_images
+from ..algorithms.identify.prediction import load_patient_volume
 from ..algorithms.segment.trained_model import predict
-from ..preprocess.lung_segmentation import save_lung_segments, get_z_range
+from ..preprocess import lung_segmentation
+from ..preprocess.lung_segmentation import save_lung_segments, get_z_range, get_segmented_lungs
 
 
 def test_correct_paths(dicom_paths):
@@ -65,7 +68,7 @@ def test_lung_segmentation(dicom_paths):
 
         for annotation in scan.annotations:
             centroid_x, centroid_y, centroid_z = annotation.centroid()
-            patient_mask = load_patient_images(patient_id, wildcard="*_m.png")
+            patient_mask = load_patient_volume(patient_id, 'masks')
             x_mask = int(mask_shape[1] / original_shape[1] * centroid_x)
             y_mask = int(mask_shape[2] / original_shape[2] * centroid_y)
             z_mask = int(abs(min_z) - abs(centroid_z))
@@ -73,6 +76,46 @@ def test_lung_segmentation(dicom_paths):
             assert mask_value == 255
 
 
+def test_get_segmented_lungs():
+    im = np.full((128, 128), 40, dtype=np.int16)
+    # two lungs and a smaller region of air inside the body
+    im[30:100, 10:45] = -900
+    im[30:100, 80:118] = -900
+    im[10:16, 60:66] = -900
+    lungs = im.copy()
+
+    img, mask = get_segmented_lungs(im)
+    assert img is im
+    assert mask[60, 25] and mask[60, 100]
+    assert not mask[13, 63] and not mask[60, 62]
+    assert (img[~mask] == -2000).all()
+    assert (img[mask] == lungs[mask]).all()
+
+
+def test_lung_segments_volumes(tmpdir):
+    image = np.full((4, 64, 64), 40, dtype=np.int16)
+    image[:, 10:50, 5:25] = -900
+    image[:, 10:50, 40:60] = -900
+    target_dir = tmpdir.mkdir('patient')
+    masks = lung_segmentation.segment_slices(image, workers=1)
+    assert masks.dtype == np.bool_ and masks.shape == image.shape
+
+    # the slices segmented by a pool of processes are identical
+    assert np.array_equal(lung_segmentation.segment_slices(image, workers=2), masks)
+
+    lung_segmentation._write_segments(image, masks, str(target_dir), png=True)
+    for kind, suffix in (('images', '_i.png'), ('masks', '_m.png')):
+        volume = lung_segmentation.load_lung_segments('patient', kind, base_dir=str(tmpdir))
+        assert volume.dtype == np.uint8
+        assert volume.shape == image.shape
+
+        # the same as the PNG images of the debug mode
+        paths = sorted(str(path) for path in tmpdir.listdir('patientimg_*' + suffix))
+        assert np.array_equal(volume, np.stack([cv2.imread(path, cv2.IMREAD_GRAYSCALE) for path in paths]))
+
+    assert lung_segmentation.load_lung_segments('other', 'masks', base_dir=str(tmpdir)) is None
+
+
 @pytest.mark.stop_timeout
 def test_stop_timeout():
     timeout = get_timeout()
@@ -0,0 +1,63 @@
+import os
+import glob
+import shutil
+
+import numpy as np
+
+from ..preprocess import series_index
+from ..preprocess.load_ct import load_ct, MetaData
+
+
+def test_series_index_update(tmpdir, monkeypatch, dicom_path):
+    series_path = str(tmpdir.mkdir('series'))
+    for path in glob.glob(os.path.join(dicom_path, '*.dcm')):
+        shutil.copy(path, series_path)
+
+    index_path = str(tmpdir.join('index.sqlite3'))
+    read_paths = []
+
+    def read_header(path):
+        read_paths.append(path)
+        return series_index_read_header(path)
+
+    series_index_read_header = series_index.read_header
+    monkeypatch.setattr(series_index, 'read_header', read_header)
+
+    found = series_index.update(series_path, index_path=index_path)
+    assert len(found) == 1
+    assert found[0]['format'] == 'dicom'
+    assert len(found[0]['files']) == len(read_paths) == len(os.listdir(series_path))
+    assert found[0]['positions'] == sorted(found[0]['positions'])
+    assert found[0]['meta'] == MetaData(load_ct(series_path, voxel=False, index=False)).to_dict()
+    assert series_index.series(series_path, index_path=index_path) == found
+
+    # Nothing is re-read as long as the files are unchanged
+    del read_paths[:]
+    assert series_index.update(series_path, index_path=index_path) == found
+    assert not read_paths
+
+    # Only the modified file is re-read, removed files are dropped
+    modified, removed = found[0]['files'][:2]
+    stat = os.stat(modified)
+    os.utime(modified, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    os.remove(removed)
+
+    updated = series_index.update(series_path, index_path=index_path)
+    assert read_paths == [modified]
+    assert updated[0]['files'] == found[0]['files'][:1] + found[0]['files'][2:]
+
+    assert series_index.update(str(tmpdir.join('missing')), index_path=index_path) == []
+
+
+def test_load_ct_series_index(tmpdir, monkeypatch, dicom_path):
+    monkeypatch.setattr(series_index.Config, 'SERIES_INDEX_PATH', str(tmpdir.join('index.sqlite3')))
+
+    record = series_index.lookup(dicom_path)
+    assert record['uid']
+
+    meta = load_ct(dicom_path, voxel=False, index=True)
+    assert isinstance(meta, MetaData)
+    assert meta.to_dict() == MetaData(load_ct(dicom_path, voxel=False, index=False)).to_dict()
+
+    voxel_data, _ = load_ct(dicom_path, index=True)
+    assert np.array_equal(voxel_data, load_ct(dicom_path, index=False)[0])
@@ -0,0 +1,63 @@
+import os
+import glob
+import shutil
+
+import numpy as np
+
+from ..preprocess import ingest, volume_store
+from ..preprocess.load_ct import load_ct, MetaData
+
+
+def test_volume_store(tmpdir, dicom_path):
+    voxel_data, meta = load_ct(dicom_path)
+    meta = MetaData(meta)
+    path = str(tmpdir.join('series'))
+
+    volume_store.write(path, voxel_data, meta.to_dict(), chunk_depth=4)
+    assert volume_store.is_stored(path)
+    assert not [name for name in os.listdir(str(tmpdir)) if name.endswith('.tmp')]
+
+    stored, stored_meta = load_ct(path, lazy=True)
+    assert isinstance(stored, volume_store.StoredVolume)
+    assert stored.shape == voxel_data.shape
+    assert stored.dtype == voxel_data.dtype
+    assert stored_meta.to_dict() == meta.to_dict()
+
+    # slabs crossing chunk boundaries are assembled from several chunks
+    assert np.array_equal(stored[3:10], voxel_data[3:10])
+    assert np.array_equal(stored[9:1:-2, 100:200], voxel_data[9:1:-2, 100:200])
+    assert np.array_equal(stored[5], voxel_data[5])
+
+    eager, _ = load_ct(path)
+    assert isinstance(eager, np.ndarray)
+    assert np.array_equal(eager, voxel_data)
+    assert load_ct(path, voxel=False).to_dict() == meta.to_dict()
+
+
+def test_ingest(tmpdir, caplog, dicom_path):
+    root = str(tmpdir.join('images'))
+    store = str(tmpdir.join('store'))
+    series_path = os.path.join(root, 'LIDC-IDRI-0001', 'study', 'series')
+    os.makedirs(series_path)
+    for path in glob.glob(os.path.join(dicom_path, '*.dcm')):
+        shutil.copy(path, series_path)
+
+    assert ingest.find_series(root) == [series_path]
+    assert ingest.ingest(root, store=store, workers=1) == {'written': 1, 'skipped': 0, 'failed': 0}
+
+    target = os.path.join(store, 'LIDC-IDRI-0001', 'study', 'series')
+    assert np.array_equal(load_ct(target)[0], load_ct(series_path)[0])
+
+    # a restarted run skips the series which are already stored
+    assert ingest.main(['--root', root, '--store', store, '--workers', '1']) == 0
+    assert ingest.ingest(root, store=store, workers=1) == {'written': 0, 'skipped': 1, 'failed': 0}
+
+    # a broken series is logged along with its traceback and fails the run
+    broken_path = os.path.join(root, 'LIDC-IDRI-0002', 'study', 'series')
+    os.makedirs(broken_path)
+    with open(os.path.join(broken_path, 'broken.dcm'), 'wb') as broken:
+        broken.write(b'not a DICOM file')
+
+    assert ingest.main(['--root', root, '--store', store, '--workers', '1']) == 1
+    assert 'Exception ingesting {}'.format(broken_path) in caplog.text
+    assert 'Traceback' in caplog.text